@@ -0,0 +1,263 @@
+# Batch separation (albums/playlists): manifest + decode prefetch
+import os
+import json
+import time
+import logging
+import tarfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from decoder import SUPPORTED_EXTENSIONS
+from staging import new_job_id, staged_file
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_members(path: str, max_member_bytes: int) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Percorre os arquivos de áudio de um .zip ou .tar(.gz), em ordem de nome.
+
+    Diretórios, arquivos ocultos e extensões não suportadas são ignorados;
+    membros maiores que max_member_bytes geram ValueError.
+
+    Yields:
+        Tuplas (nome do arquivo sem diretórios, stream de leitura)
+    """
+    def wanted(name: str) -> bool:
+        base = os.path.basename(name)
+        return (not base.startswith('.') and '__MACOSX' not in name
+                and os.path.splitext(base)[1].lower() in SUPPORTED_EXTENSIONS)
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = sorted((m for m in archive.infolist() if not m.is_dir() and wanted(m.filename)),
+                             key=lambda m: m.filename)
+            for member in members:
+                if member.file_size > max_member_bytes:
+                    raise ValueError(f"{member.filename}: maior que o limite por arquivo")
+                with archive.open(member) as stream:
+                    yield os.path.basename(member.filename), stream
+        return
+
+    with tarfile.open(path) as archive:
+        members = sorted((m for m in archive.getmembers() if m.isfile() and wanted(m.name)),
+                         key=lambda m: m.name)
+        for member in members:
+            if member.size > max_member_bytes:
+                raise ValueError(f"{member.name}: maior que o limite por arquivo")
+            yield os.path.basename(member.name), archive.extractfile(member)
+
+
+def copy_limited(source: IO[bytes], target: IO[bytes], max_bytes: int):
+    """Copia um stream recusando mais que max_bytes (tamanhos declarados podem mentir)."""
+    copied = 0
+    while True:
+        chunk = source.read(1024 * 1024)
+        if not chunk:
+            return
+        copied += len(chunk)
+        if copied > max_bytes:
+            raise ValueError("Arquivo maior que o limite por arquivo")
+        target.write(chunk)
+
+
+class BatchManager:
+    """
+    Executa lotes de faixas como uma unidade e mantém um manifesto por lote.
+
+    As faixas de um lote entram no pipeline sem esperar as anteriores, com
+    no máximo `max_in_flight` faixas submetidas e não concluídas por lote
+    (cada uma segura seu áudio decodificado); o decode da próxima faixa roda
+    em uma thread auxiliar. Os resultados são coletados na ordem do álbum e
+    o manifesto (em `<output_dir>/batches/<id>.json`) é atualizado a cada
+    faixa concluída; só os lotes em andamento ficam também em memória, os
+    concluídos são lidos do disco.
+    """
+
+    def __init__(self, output_dir: str, upload_dir: str, max_concurrent: int = 1, max_in_flight: int = 2):
+        """
+        Args:
+            output_dir: OUTPUT_DIR (stems e manifestos)
+            upload_dir: UPLOAD_DIR (áudios originais)
+            max_concurrent: Lotes processados ao mesmo tempo
+            max_in_flight: Faixas de um lote no pipeline ao mesmo tempo (ex: PIPELINE_QUEUE_DEPTH)
+        """
+        self.output_dir = output_dir
+        self.upload_dir = upload_dir
+        self.manifest_dir = os.path.join(output_dir, "batches")
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="batch")
+        self.max_in_flight = max(1, max_in_flight)
+
+    def manifest_path(self, batch_id: str) -> str:
+        return os.path.join(self.manifest_dir, f"{batch_id}.json")
+
+    def _save(self, manifest: Dict[str, Any]):
+        """Grava o manifesto de forma atômica (leitores nunca veem um JSON parcial)."""
+        manifest["updated_at"] = time.time()
+        path = self.manifest_path(manifest["batch_id"])
+        tmp_path = staged_file(path)
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def submit(self, tracks: List[Tuple[str, str]], options: Dict[str, Any],
+               decode: Callable[[str], Any], separate: Callable[[str, str, Any], "Future[List[str]]"],
+               on_complete: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        Agenda um lote.
+
+        Args:
+            tracks: Lista de (job_id, caminho do upload), na ordem do álbum
+            options: Parâmetros registrados no manifesto (modo, stems)
+            decode: Decodifica um caminho para o formato aceito por `separate`
+            separate: (caminho, job_id, áudio decodificado) -> Future com os caminhos dos stems
+                (sem bloquear; ex: SeparationPipeline.submit)
+            on_complete: Chamado ao final do lote (ex: liberar os arquivos no storage)
+
+        Returns:
+            Manifesto inicial
+        """
+        batch_id = new_job_id()
+        manifest = {
+            "batch_id": batch_id,
+            "status": "queued",
+            "created_at": time.time(),
+            **options,
+            "total": len(tracks),
+            "completed": 0,
+            "failed": 0,
+            "tracks": [
+                {
+                    "index": i,
+                    "filename": os.path.basename(path),
+                    "job_id": job_id,
+                    "status": "queued",
+                    "original_audio_path": os.path.relpath(path, self.upload_dir).replace("\\", "/"),
+                    "stems": [],
+                }
+                for i, (job_id, path) in enumerate(tracks)
+            ],
+        }
+        with self._lock:
+            self._batches[batch_id] = manifest
+            self._save(manifest)
+            snapshot = json.loads(json.dumps(manifest))
+
+        self._executor.submit(self._run, batch_id, tracks, decode, separate, on_complete)
+        logger.info(f"📚 Lote {batch_id} agendado: {len(tracks)} faixas")
+        return snapshot
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Cópia do manifesto (da memória ou do disco, após um restart)."""
+        with self._lock:
+            manifest = self._batches.get(batch_id)
+            if manifest is not None:
+                return json.loads(json.dumps(manifest))
+        path = self.manifest_path(os.path.basename(batch_id))
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return None
+
+    def _update(self, batch_id: str, index: Optional[int] = None, **fields):
+        with self._lock:
+            manifest = self._batches[batch_id]
+            target = manifest if index is None else manifest["tracks"][index]
+            target.update(fields)
+            if index is not None and fields.get("status") in ("done", "error"):
+                manifest["completed" if fields["status"] == "done" else "failed"] += 1
+            self._save(manifest)
+
+    def _run(self, batch_id: str, tracks: List[Tuple[str, str]], decode: Callable[[str], Any],
+             separate: Callable[[str, str, Any], "Future[List[str]]"], on_complete: Optional[Callable[[], None]]):
+        t_batch = time.time()
+        self._update(batch_id, status="running")
+
+        def timed_decode(path: str):
+            t0 = time.time()
+            return decode(path), time.time() - t0
+
+        # Faixas submetidas e ainda não registradas: (índice, Future, início, segundos de decode)
+        in_flight: deque = deque()
+        finished: Dict[int, float] = {}
+
+        def collect(index: int, future: Future, t0: float, decode_seconds: float):
+            try:
+                output_paths = future.result()
+            except Exception as e:
+                logger.error(f"❌ Lote {batch_id}: erro em {tracks[index][1]}: {e}", exc_info=True)
+                output_paths = []
+            if output_paths:
+                self._update(
+                    batch_id, index, status="done",
+                    stems=[os.path.relpath(p, self.output_dir).replace("\\", "/") for p in output_paths],
+                    decode_seconds=round(decode_seconds, 3),
+                    separation_seconds=round(finished.get(index, time.time()) - t0, 3),
+                )
+            else:
+                self._update(batch_id, index, status="error", error="Separação falhou")
+
+        def drain(limit: int):
+            # Registra em ordem as concluídas e espera a mais antiga enquanto houver mais que `limit`
+            while in_flight and (in_flight[0][1].done() or len(in_flight) > limit):
+                collect(*in_flight.popleft())
+
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-decode") as prefetch:
+                future = prefetch.submit(timed_decode, tracks[0][1]) if tracks else None
+                for index, (job_id, path) in enumerate(tracks):
+                    self._update(batch_id, index, status="decoding")
+                    try:
+                        decoded, decode_seconds = future.result()
+                    except Exception as e:
+                        decoded, decode_seconds = e, 0.0
+
+                    # Decode da próxima faixa em paralelo com a inferência desta
+                    if index + 1 < len(tracks):
+                        future = prefetch.submit(timed_decode, tracks[index + 1][1])
+
+                    if isinstance(decoded, Exception):
+                        logger.error(f"❌ Lote {batch_id}: falha no decode de {path}: {decoded}")
+                        self._update(batch_id, index, status="error", error=f"Falha no decode: {decoded}")
+                        drain(self.max_in_flight)
+                        continue
+
+                    self._update(batch_id, index, status="separating")
+                    t0 = time.time()
+                    try:
+                        separation = separate(path, job_id, decoded)
+                    except Exception as e:
+                        separation = Future()
+                        separation.set_exception(e)
+                    del decoded
+                    separation.add_done_callback(lambda f, i=index: finished.__setitem__(i, time.time()))
+                    in_flight.append((index, separation, t0, decode_seconds))
+                    drain(self.max_in_flight - 1)
+            drain(0)
+        finally:
+            with self._lock:
+                failed = self._batches[batch_id]["failed"]
+            self._update(
+                batch_id,
+                status="completed" if not failed else "completed_with_errors",
+                total_seconds=round(time.time() - t_batch, 3),
+            )
+            # Manifesto final já gravado: get() passa a ler do disco
+            with self._lock:
+                del self._batches[batch_id]
+            logger.info(f"📚 Lote {batch_id} concluído em {time.time() - t_batch:.1f}s ({failed} falhas)")
+            if on_complete is not None:
+                on_complete()
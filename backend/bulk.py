@@ -0,0 +1,252 @@
+# Offline bulk separation CLI: manifest, resume and deterministic sharding
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import torch
+
+from config import config
+from decoder import SUPPORTED_EXTENSIONS, decode_audio
+from inference import resolve_cpu_bf16
+from process import load_separation_model, select_model, separate_audio
+from probe_index import ProbeIndex
+from staging import job_dir_name
+
+logger = logging.getLogger(__name__)
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Converte 'i/N' em (i, N), com 0 <= i < N."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard inválido: '{value}'. Use i/N (ex: 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard inválido: '{value}'. Requer 0 <= i < N")
+    return index, count
+
+
+def in_shard(digest: str, shard: Tuple[int, int]) -> bool:
+    """Atribuição determinística de um arquivo a um shard pelo hash do conteúdo."""
+    index, count = shard
+    return int(digest[:16], 16) % count == index
+
+
+def collect_inputs(inputs: Iterable[str], file_list: Optional[str] = None) -> List[str]:
+    """Arquivos de áudio dos caminhos (arquivos ou diretórios, recursivo), em ordem estável."""
+    paths = list(inputs)
+    if file_list:
+        with open(file_list) as f:
+            paths += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    found: Set[str] = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.update(
+                    os.path.join(root, name) for name in files
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+                )
+        elif os.path.isfile(path):
+            found.add(path)
+        else:
+            logger.warning(f"⚠️ Caminho ignorado (não existe): {path}")
+    return sorted(os.path.abspath(p) for p in found)
+
+
+def job_key(digest: str, mode: str, stems: Optional[List[str]]) -> str:
+    """Chave de trabalho concluído: mesmo conteúdo + mesmo modo + mesmos stems."""
+    return f"{digest}:{mode}:{','.join(sorted(stems or []))}"
+
+
+def load_manifest(path: str) -> Set[str]:
+    """Chaves já concluídas no manifesto (JSON lines; linhas truncadas são ignoradas)."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done.add(entry["key"])
+    return done
+
+
+def append_jsonl(handle, record: Dict[str, Any]):
+    handle.write(json.dumps(record) + "\n")
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+def run(args: argparse.Namespace) -> int:
+    """Executa a separação em lote. Retorna o número de falhas."""
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    cpu_bf16 = device.type == "cpu" and config.INFERENCE_PRESET == "fp32" and resolve_cpu_bf16(config.CPU_BF16)
+    model_name = select_model(args.mode)
+    os.makedirs(args.output, exist_ok=True)
+
+    shard = args.shard
+    manifest_path = args.manifest or os.path.join(
+        args.output, f"manifest-{args.mode}-shard{shard[0]}of{shard[1]}.jsonl"
+    )
+    done = load_manifest(manifest_path)
+
+    def job_target(path: str, digest: str) -> Tuple[str, str, str]:
+        """(chave do manifesto, job_id, diretório de saída) determinísticos por (conteúdo, modo, stems)."""
+        key = job_key(digest, args.mode, args.stems)
+        job_id = hashlib.sha256(key.encode()).hexdigest()[:12]
+        base = os.path.splitext(os.path.basename(path))[0]
+        return key, job_id, os.path.join(args.output, model_name, job_dir_name(base, job_id))
+
+    # Seleção do trabalho deste shard (hash do conteúdo: estável entre máquinas).
+    # Os hashes ficam no índice de probes: retomar não relê arquivos inalterados
+    probe_index = ProbeIndex(args.probe_index)
+    pending: List[Tuple[str, str]] = []
+    recovered: List[Tuple[str, str]] = []
+    skipped = 0
+    for path in collect_inputs(args.inputs, args.file_list):
+        digest = probe_index.content_hash(path)
+        if not in_shard(digest, shard):
+            continue
+        if job_key(digest, args.mode, args.stems) in done:
+            skipped += 1
+            continue
+        # Publicado antes de uma interrupção, mas ausente do manifesto: não precisa de decode
+        if os.path.isdir(job_target(path, digest)[2]):
+            recovered.append((path, digest))
+            continue
+        pending.append((path, digest))
+    logger.info(
+        f"📋 Shard {shard[0]}/{shard[1]}: {len(pending)} pendentes, {skipped} já concluídos, "
+        f"{len(recovered)} recuperados"
+    )
+    if not pending and not recovered:
+        return 0
+
+    failures = 0
+    stats = open(args.stats, "a") if args.stats != "-" else sys.stdout
+
+    def finish(record: Dict[str, Any], key: str, output_paths: List[str]):
+        """Registra a faixa nas estatísticas e, se concluída, no manifesto."""
+        nonlocal failures
+        record["status"] = "done" if output_paths else "error"
+        record["stems"] = [os.path.relpath(p, args.output) for p in output_paths]
+        append_jsonl(stats, record)
+        if output_paths:
+            append_jsonl(manifest, {
+                "key": key,
+                "path": record["path"],
+                "stems": record["stems"],
+                "completed_at": time.time(),
+            })
+        else:
+            failures += 1
+
+    try:
+        with open(manifest_path, "a") as manifest:
+            for path, digest in recovered:
+                key, _, out_dir = job_target(path, digest)
+                output_paths = sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir))
+                finish({"path": path, "hash": digest, "mode": args.mode, "recovered": True}, key, output_paths)
+
+            if pending:
+                model = load_separation_model(
+                    model_name, device,
+                    inference_preset=config.INFERENCE_PRESET,
+                    inference_backend=config.INFERENCE_BACKEND,
+                    calibration_file=config.QUANTIZATION_CALIBRATION_FILE,
+                    onnx_cache_dir=config.ONNX_CACHE_DIR,
+                    onnx_threads=config.ONNX_THREADS
+                )
+                models_store = {model_name: model}
+
+                def timed_decode(path: str):
+                    t0 = time.time()
+                    try:
+                        return decode_audio(path, model.samplerate, model.audio_channels), time.time() - t0
+                    except Exception as e:
+                        return e, time.time() - t0
+
+                with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-decode") as prefetch:
+                    future = prefetch.submit(timed_decode, pending[0][0])
+                    for position, (path, digest) in enumerate(pending):
+                        decoded, decode_seconds = future.result()
+                        # Decode da próxima faixa sobreposto à inferência desta
+                        if position + 1 < len(pending):
+                            future = prefetch.submit(timed_decode, pending[position + 1][0])
+
+                        record: Dict[str, Any] = {"path": path, "hash": digest, "mode": args.mode,
+                                                  "decode_seconds": round(decode_seconds, 3)}
+                        key, job_id, _ = job_target(path, digest)
+
+                        output_paths: List[str] = []
+                        t0 = time.time()
+                        if isinstance(decoded, Exception):
+                            record["error"] = f"Falha no decode: {decoded}"
+                        else:
+                            record["audio_seconds"] = round(decoded[0].shape[-1] / model.samplerate, 3)
+                            output_paths = separate_audio(
+                                input_path=path,
+                                mode=args.mode,
+                                output_dir_base=args.output,
+                                device=device,
+                                models_store=models_store,
+                                requested_stems=args.stems,
+                                cpu_bf16=cpu_bf16,
+                                residual_other=config.RESIDUAL_OTHER,
+                                job_id=job_id,
+                                stem_format=args.stem_format,
+                                stem_dither=config.STEM_DITHER,
+                                decoded=decoded
+                            )
+                        del decoded
+                        separate_seconds = time.time() - t0
+
+                        record["separate_seconds"] = round(separate_seconds, 3)
+                        if "audio_seconds" in record and separate_seconds > 0:
+                            record["realtime_factor"] = round(record["audio_seconds"] / separate_seconds, 2)
+                        finish(record, key, output_paths)
+    finally:
+        if stats is not sys.stdout:
+            stats.close()
+
+    logger.info(f"✅ Shard {shard[0]}/{shard[1]} concluído: {len(pending) + len(recovered) - failures} faixas, {failures} falhas")
+    return failures
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Separação em lote offline (diretórios ou listas de arquivos), com retomada e sharding."
+    )
+    parser.add_argument("inputs", nargs="*", help="Arquivos de áudio ou diretórios (recursivo)")
+    parser.add_argument("--file-list", help="Arquivo com um caminho por linha")
+    parser.add_argument("--output", default=config.OUTPUT_DIR, help="Diretório de saída (padrão: OUTPUT_DIR)")
+    parser.add_argument("--mode", default="4-stem", choices=["2-stem", "4-stem", "6-stem", "custom"])
+    parser.add_argument("--stems", nargs="+", help="Stems do modo custom")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1), help="Shard i/N (por hash do conteúdo)")
+    parser.add_argument("--manifest", help="Manifesto JSON lines (padrão: <output>/manifest-<modo>-shard<i>of<N>.jsonl)")
+    parser.add_argument("--stats", default="-", help="Estatísticas por faixa em JSON lines (padrão: stdout)")
+    parser.add_argument("--stem-format", default=config.STEM_FORMAT, choices=["float32", "int16"])
+    parser.add_argument("--probe-index", default=config.PROBE_INDEX_PATH,
+                        help="Índice de probes e hashes (padrão: PROBE_INDEX_PATH)")
+    return parser
+
+
+if __name__ == "__main__":
+    # Uso: python bulk.py <arquivos/diretórios> [--mode 4-stem] [--shard 0/4] [--output dir]
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    args = build_parser().parse_args()
+    if not args.inputs and not args.file_list:
+        build_parser().error("informe arquivos/diretórios ou --file-list")
+    if args.mode == "custom" and not args.stems:
+        build_parser().error("--mode custom requer --stems")
+
+    sys.exit(1 if run(args) else 0)
@@ -1,11 +1,8 @@
 # Cache module for model optimization
-import os
 import logging
 import time
-from functools import lru_cache
 from typing import Dict, Any, Optional
 import torch
-from demucs.pretrained import get_model
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +28,7 @@ class ModelCache:
         
         # Carregar novo modelo
         logger.info(f"📥 Carregando modelo {model_name}...")
+        from demucs.pretrained import get_model
         model = get_model(model_name).to(self.device).eval()
         
         self.models[model_name] = model
@@ -88,66 +86,5 @@ class ModelCache:
 # Cache global de modelos
 model_cache = ModelCache()
 
-@lru_cache(maxsize=32)
-def get_audio_info(file_path: str) -> Dict[str, Any]:
-    """Cache para informações de áudio."""
-    try:
-        import librosa
-        duration = librosa.get_duration(filename=file_path)
-        return {
-            "duration": duration,
-            "cached_at": time.time()
-        }
-    except Exception as e:
-        logger.error(f"Erro ao obter info do áudio: {e}")
-        return {}
-
-def cleanup_temp_files(temp_dir: str, max_age_hours: int = 2):
-    """Limpar arquivos temporários antigos."""
-    if not os.path.exists(temp_dir):
-        return
-    
-    current_time = time.time()
-    max_age_seconds = max_age_hours * 3600
-    
-    for filename in os.listdir(temp_dir):
-        file_path = os.path.join(temp_dir, filename)
-        
-        try:
-            file_age = current_time - os.path.getmtime(file_path)
-            if file_age > max_age_seconds:
-                os.remove(file_path)
-                logger.info(f"🗑️ Arquivo temporário removido: {filename}")
-        except Exception as e:
-            logger.warning(f"Erro ao remover arquivo {filename}: {e}")
-
-def setup_periodic_cleanup():
-    """Configurar limpeza periódica (para usar com background tasks)."""
-    import threading
-    import time
-    
-    def cleanup_worker():
-        while True:
-            try:
-                # Limpar arquivos temporários a cada hora
-                cleanup_temp_files("/tmp/uploads", max_age_hours=1)
-                cleanup_temp_files("/tmp/stems", max_age_hours=2)
-                cleanup_temp_files("/tmp/outputs", max_age_hours=2)
-                
-                # Limpar cache GPU se necessário
-                if torch.cuda.is_available():
-                    memory_usage = torch.cuda.memory_allocated(0) / torch.cuda.get_device_properties(0).total_memory
-                    if memory_usage > 0.8:  # Se uso > 80%
-                        torch.cuda.empty_cache()
-                        logger.info("🧹 Cache GPU limpo por uso alto de memória")
-                
-                time.sleep(3600)  # Aguardar 1 hora
-                
-            except Exception as e:
-                logger.error(f"Erro na limpeza periódica: {e}")
-                time.sleep(300)  # Aguardar 5 minutos em caso de erro
-    
-    # Iniciar thread de limpeza
-    cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-    cleanup_thread.start()
-    logger.info("🧹 Limpeza periódica iniciada") 
\ No newline at end of file
+# Informações de áudio (duração, taxa, canais): ver probe_index.ProbeIndex
+# Limpeza de uploads e stems: ver storage.StorageManager
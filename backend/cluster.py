@@ -0,0 +1,349 @@
+# Shared spool queue and coordinator for multi-process / multi-node separation
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from process import select_model
+from staging import STAGING_PREFIX, new_job_id, staged_file
+
+logger = logging.getLogger(__name__)
+
+# Valores aceitos em CLUSTER_MODE
+CLUSTER_MODES = ("standalone", "coordinator")
+
+_PENDING, _CLAIMED, _DONE, _WORKERS = "pending", "claimed", "done", "workers"
+
+# Resultados não coletados há mais que isso são descartados
+_ORPHAN_RESULT_SECONDS = 3600
+
+
+def default_node() -> str:
+    """Identificador do nó (máquina) onde uploads são gravados."""
+    return socket.gethostname()
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    """Grava JSON e publica com os.replace (leitores nunca veem arquivo parcial)."""
+    tmp = staged_file(path)
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SpoolQueue:
+    """
+    Fila de jobs em um diretório compartilhado.
+
+    Cada job é um arquivo JSON em `pending/`; um worker o reivindica com um
+    os.rename para `claimed/` (atômico: só um worker vence) e publica o
+    resultado em `done/`. Workers registram seu estado em `workers/`
+    (heartbeat com modelos carregados e nó). Funciona entre processos de
+    uma máquina e entre nós que montam o mesmo volume (junto com
+    UPLOAD_DIR e OUTPUT_DIR).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        for name in (_PENDING, _CLAIMED, _DONE, _WORKERS):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.root, kind, name)
+
+    def _list(self, kind: str) -> List[str]:
+        return sorted(n for n in os.listdir(os.path.join(self.root, kind))
+                      if n.endswith(".json") and not n.startswith(STAGING_PREFIX))
+
+    # --- Jobs ---
+
+    def enqueue(self, job: Dict[str, Any]) -> str:
+        """Publica um job em pending/ (o nome começa pelo instante, ordem FIFO)."""
+        job = {"queue_id": new_job_id(), "created": time.time(), **job}
+        name = f"{int(job['created'] * 1000):013d}-{job['queue_id']}.json"
+        _write_json(self._path(_PENDING, name), job)
+        return job["queue_id"]
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Jobs aguardando, do mais antigo ao mais novo."""
+        jobs = []
+        for name in self._list(_PENDING):
+            job = _read_json(self._path(_PENDING, name))
+            if job is not None:
+                jobs.append({**job, "_file": name})
+        return jobs
+
+    def claim(self, job: Dict[str, Any], worker_id: str) -> bool:
+        """Reivindica um job de pending() para o worker. False se outro worker venceu."""
+        try:
+            os.rename(self._path(_PENDING, job["_file"]), self._path(_CLAIMED, f"{worker_id}~{job['_file']}"))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def cancel(self, queue_id: str) -> bool:
+        """Remove um job ainda em pending/. False se já foi reivindicado (ou não existe)."""
+        for name in self._list(_PENDING):
+            if name.endswith(f"-{queue_id}.json"):
+                try:
+                    os.remove(self._path(_PENDING, name))
+                    return True
+                except FileNotFoundError:
+                    return False
+        return False
+
+    def complete(self, job: Dict[str, Any], worker_id: str, result: Dict[str, Any]):
+        """Publica o resultado do job e remove a reivindicação."""
+        _write_json(self._path(_DONE, f"{job['queue_id']}.json"), {"queue_id": job["queue_id"], **result})
+        try:
+            os.remove(self._path(_CLAIMED, f"{worker_id}~{job['_file']}"))
+        except FileNotFoundError:
+            pass
+
+    def take_result(self, queue_id: str) -> Optional[Dict[str, Any]]:
+        """Resultado publicado de um job (removido da fila ao ser lido), ou None."""
+        path = self._path(_DONE, f"{queue_id}.json")
+        result = _read_json(path)
+        if result is not None:
+            os.remove(path)
+        return result
+
+    def done_ids(self) -> List[str]:
+        return [name[:-len(".json")] for name in self._list(_DONE)]
+
+    def purge_done(self, max_age: float) -> int:
+        """Remove resultados que nenhum coordenador buscou (ex: coordenador reiniciado)."""
+        cutoff = time.time() - max_age
+        purged = 0
+        for name in self._list(_DONE):
+            path = self._path(_DONE, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    purged += 1
+            except FileNotFoundError:
+                pass
+        return purged
+
+    def requeue_orphans(self, live_workers: List[str]) -> int:
+        """Devolve a pending/ os jobs reivindicados por workers que pararam de responder."""
+        requeued = 0
+        for name in self._list(_CLAIMED):
+            worker_id, _, job_file = name.partition("~")
+            if worker_id in live_workers:
+                continue
+            try:
+                os.rename(self._path(_CLAIMED, name), self._path(_PENDING, job_file))
+                requeued += 1
+                logger.warning(f"♻️ Job {job_file} devolvido à fila (worker {worker_id} inativo)")
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    # --- Workers ---
+
+    def heartbeat(self, worker_id: str, state: Dict[str, Any]):
+        _write_json(self._path(_WORKERS, f"{worker_id}.json"),
+                    {"worker_id": worker_id, "updated": time.time(), **state})
+
+    def unregister(self, worker_id: str):
+        try:
+            os.remove(self._path(_WORKERS, f"{worker_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def workers(self, max_age: float) -> List[Dict[str, Any]]:
+        """Workers com heartbeat nos últimos `max_age` segundos."""
+        now = time.time()
+        live = []
+        for name in self._list(_WORKERS):
+            state = _read_json(self._path(_WORKERS, name))
+            if state is not None and now - state.get("updated", 0) <= max_age:
+                live.append(state)
+        return live
+
+
+def affinity_score(job: Dict[str, Any], worker: Dict[str, Any]) -> int:
+    """Preferência de um worker por um job: modelo já carregado (2) e upload no mesmo nó (1)."""
+    score = 0
+    if job["model"] in worker.get("models", []):
+        score += 2
+    if job.get("node") == worker.get("node"):
+        score += 1
+    return score
+
+
+def choose_job(jobs: List[Dict[str, Any]], worker: Dict[str, Any], workers: List[Dict[str, Any]],
+               affinity_wait: float, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Jobs que este worker deve tentar reivindicar, em ordem de preferência.
+
+    Delay scheduling: um job só vai para um worker "pior" (modelo frio ou
+    upload em outro nó) se nenhum worker ocioso tiver afinidade maior ou se
+    o job já esperou `affinity_wait` segundos. Entre os elegíveis, maior
+    afinidade primeiro e, no empate, o mais antigo.
+    """
+    now = now if now is not None else time.time()
+    idle_others = [w for w in workers if w["worker_id"] != worker["worker_id"] and not w.get("busy")]
+    eligible = []
+    for job in jobs:
+        score = affinity_score(job, worker)
+        best_other = max((affinity_score(job, w) for w in idle_others), default=-1)
+        if score >= best_other or now - job["created"] >= affinity_wait:
+            eligible.append((-score, job["created"], job))
+    return [job for _, _, job in sorted(eligible, key=lambda item: item[:2])]
+
+
+class ClusterCoordinator:
+    """
+    Modo coordenador: a API enfileira separações para workers (ver worker.py).
+
+    Mesma interface do SeparationPipeline (start, submit -> Future, stats):
+    os handlers não mudam. Os caminhos trafegam relativos a UPLOAD_DIR e
+    OUTPUT_DIR, então coordenador e workers podem montar o volume
+    compartilhado em caminhos diferentes.
+
+    Um job não espera para sempre: o Future falha com TimeoutError se
+    passar de `job_timeout` ou se nenhum worker tiver heartbeat por
+    `worker_timeout` segundos.
+    """
+
+    def __init__(self, queue_dir: str, upload_dir: str, output_dir: str, node: Optional[str] = None,
+                 poll_interval: float = 0.2, worker_timeout: float = 30.0, job_timeout: float = 1800.0):
+        self.queue = SpoolQueue(queue_dir)
+        self.upload_dir = upload_dir
+        self.output_dir = output_dir
+        self.node = node or default_node()
+        self.poll_interval = poll_interval
+        self.worker_timeout = worker_timeout
+        self.job_timeout = job_timeout
+        self._futures: Dict[str, Future] = {}
+        self._submitted: Dict[str, float] = {}
+        self._workers_seen = time.time()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._completed = 0
+        self._failed = 0
+
+    def start(self):
+        """Inicia a thread que coleta resultados e devolve jobs de workers inativos."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._collect_loop, name="cluster-coordinator", daemon=True)
+        self._thread.start()
+        logger.info(f"🛰️ Coordenador iniciado: fila em {self.queue.root} (nó {self.node})")
+
+    def submit(self, input_path: str, mode: str, job_id: Optional[str] = None,
+               requested_stems: Optional[List[str]] = None, decoded: Any = None, profile: Any = None,
+               info: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        Enfileira uma separação. `decoded` e `profile` não atravessam processos e são ignorados.
+
+        Returns:
+            Future com a lista de caminhos dos stems (vazia em caso de erro, como separate_audio)
+        """
+        if profile is not None:
+            logger.warning("⚠️ Profiling não disponível no modo coordenador (a inferência roda nos workers)")
+        queue_id = self.queue.enqueue({
+            "input": os.path.relpath(input_path, self.upload_dir),
+            "mode": mode,
+            "model": select_model(mode),
+            "job_id": job_id,
+            "requested_stems": requested_stems,
+            "node": self.node,
+            "info": info,
+        })
+        future: Future = Future()
+        with self._lock:
+            self._futures[queue_id] = future
+            self._submitted[queue_id] = time.time()
+        return future
+
+    def _collect_loop(self):
+        last_requeue = 0.0
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._collect()
+                if time.time() - last_requeue >= self.worker_timeout:
+                    last_requeue = time.time()
+                    live = [w["worker_id"] for w in self.queue.workers(self.worker_timeout)]
+                    self.queue.requeue_orphans(live)
+                    self.queue.purge_done(_ORPHAN_RESULT_SECONDS)
+                    if live:
+                        self._workers_seen = time.time()
+                self._expire()
+            except Exception as e:
+                logger.error(f"Erro no coordenador: {e}", exc_info=True)
+
+    def _collect(self):
+        with self._lock:
+            waiting = set(self._futures)
+        for queue_id in waiting.intersection(self.queue.done_ids()):
+            result = self.queue.take_result(queue_id)
+            if result is None:
+                continue
+            with self._lock:
+                future = self._futures.pop(queue_id)
+                self._submitted.pop(queue_id, None)
+                if result.get("stems"):
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            if result.get("error"):
+                logger.error(f"❌ Worker {result.get('worker_id')} falhou: {result['error']}")
+            future.set_result([os.path.join(self.output_dir, p) for p in result.get("stems", [])])
+
+    def _expire(self):
+        """Falha os jobs acima de job_timeout, ou todos se não há workers ativos há worker_timeout."""
+        now = time.time()
+        if now - self._workers_seen > self.worker_timeout and self.queue.workers(self.worker_timeout):
+            self._workers_seen = now
+        no_workers = now - self._workers_seen > self.worker_timeout
+        with self._lock:
+            expired = [queue_id for queue_id, submitted in self._submitted.items()
+                       if no_workers or (self.job_timeout > 0 and now - submitted > self.job_timeout)]
+            futures = [(queue_id, self._futures.pop(queue_id)) for queue_id in expired]
+            for queue_id in expired:
+                del self._submitted[queue_id]
+            self._failed += len(expired)
+        for queue_id, future in futures:
+            # Ainda pendente: nenhum worker deve processá-lo depois; reivindicado, o resultado vira órfão
+            self.queue.cancel(queue_id)
+            reason = f"nenhum worker ativo há {self.worker_timeout:.0f}s" if no_workers \
+                else f"sem resultado em {self.job_timeout:.0f}s"
+            logger.error(f"❌ Job {queue_id} expirado: {reason}")
+            future.set_exception(TimeoutError(f"Separação não concluída: {reason}"))
+
+    def warm_models(self) -> List[str]:
+        """Modelos carregados em algum worker ativo."""
+        return sorted({m for w in self.queue.workers(self.worker_timeout) for m in w.get("models", [])})
+
+    def stats(self) -> Dict[str, Any]:
+        """Fila, workers ativos e jobs em espera deste coordenador."""
+        workers = self.queue.workers(self.worker_timeout)
+        with self._lock:
+            in_flight = len(self._futures)
+            completed, failed = self._completed, self._failed
+        return {
+            "mode": "coordinator",
+            "queued": {"pending": len(self.queue.pending()), "in_flight": in_flight},
+            "workers": [
+                {key: w.get(key) for key in ("worker_id", "node", "models", "busy", "completed")}
+                for w in workers
+            ],
+            "completed": completed,
+            "failed": failed,
+        }
@@ -1,4 +1,5 @@
 import os
+import socket
 from typing import Optional
 import logging
 from dotenv import load_dotenv
@@ -22,10 +23,101 @@ class Config:
         self.UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
         self.OUTPUT_DIR = os.getenv("OUTPUT_DIR", "separated")
         
+        # Ciclo de vida do armazenamento (uploads + stems): orçamento, TTL e varredura
+        self.STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", 10 * 1024**3))  # 10GB, 0 = sem limite
+        self.STORAGE_TTL_HOURS = float(os.getenv("STORAGE_TTL_HOURS", 24))  # 0 = sem TTL
+        self.STORAGE_SCAN_INTERVAL = float(os.getenv("STORAGE_SCAN_INTERVAL", 300))  # segundos
+        
         # Configurações de processamento
         self.MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 150 * 1024 * 1024))  # 150MB
+        self.MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", 0))  # 0 = sem limite
+        
+        # Índice persistente de probes (cabeçalhos) e hashes de conteúdo (fora de UPLOAD_DIR/OUTPUT_DIR)
+        self.PROBE_INDEX_PATH = os.getenv("PROBE_INDEX_PATH", "cache/probe_index.sqlite")
+        
+        # Uploads idênticos (hash + modelo + stems) em processamento simultâneo compartilham um único job
+        self.SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
         self.USE_GPU = os.getenv("USE_GPU", "auto").lower()
         
+        # Scheduler de inferência: partição de núcleos entre jobs concorrentes
+        self.SCHEDULER_CORES = int(os.getenv("SCHEDULER_CORES", 0))  # 0 = todos
+        self.SCHEDULER_MIN_CORES = int(os.getenv("SCHEDULER_MIN_CORES", 2))
+        self.SCHEDULER_PIN_AFFINITY = os.getenv("SCHEDULER_PIN_AFFINITY", "false").lower() == "true"
+        
+        # Pipeline decode -> inferência -> escrita: threads por estágio e jobs aguardando entre estágios
+        self.PIPELINE_DECODE_WORKERS = int(os.getenv("PIPELINE_DECODE_WORKERS", 1))
+        self.PIPELINE_INFER_WORKERS = int(os.getenv("PIPELINE_INFER_WORKERS", 2))
+        self.PIPELINE_ENCODE_WORKERS = int(os.getenv("PIPELINE_ENCODE_WORKERS", 1))
+        self.PIPELINE_QUEUE_DEPTH = int(os.getenv("PIPELINE_QUEUE_DEPTH", 2))
+        
+        # Lotes (álbuns/playlists): faixas por lote e lotes processados ao mesmo tempo
+        self.BATCH_MAX_TRACKS = int(os.getenv("BATCH_MAX_TRACKS", 30))
+        self.BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 1))
+        
+        # Em bags com um modelo por fonte, calcula "other" como mistura menos as demais fontes
+        self.RESIDUAL_OTHER = os.getenv("RESIDUAL_OTHER", "false").lower() == "true"
+        
+        # Formato dos stems gravados ("float32" ou "int16") e dither TPDF na conversão para int16
+        self.STEM_FORMAT = os.getenv("STEM_FORMAT", "float32").lower()
+        self.STEM_DITHER = os.getenv("STEM_DITHER", "true").lower() == "true"
+        
+        # Remix de stems (GET /remix): mixdowns em cache e bitrate do MP3
+        self.REMIX_CACHE_MAX_FILES = int(os.getenv("REMIX_CACHE_MAX_FILES", 50))
+        self.REMIX_MP3_BITRATE = int(os.getenv("REMIX_MP3_BITRATE", 192))
+        
+        # Backend de inferência dos modelos Demucs em CPU ("torch" ou "onnx")
+        self.INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+        self.ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "models/onnx")
+        self.ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))  # 0 = nº de CPUs
+        
+        # Autocast bf16 em CPU ("auto" usa se a CPU tiver bf16 nativo, "true" ou "false")
+        self.CPU_BF16 = os.getenv("CPU_BF16", "auto").lower()
+        
+        # Preset de precisão em CPU ("fp32", "int8" ou "int8_static")
+        self.INFERENCE_PRESET = os.getenv("INFERENCE_PRESET", "fp32").lower()
+        self.QUANTIZATION_CALIBRATION_FILE = os.getenv("QUANTIZATION_CALIBRATION_FILE")
+        
+        # Diarização: tratamento de vozes sobrepostas ("duplicate" ou "soft")
+        self.DIARIZATION_OVERLAP_MODE = os.getenv("DIARIZATION_OVERLAP_MODE", "duplicate").lower()
+        
+        # Diarização local por janelas para faixas longas (0 = desativada)
+        self.DIARIZATION_WINDOW_SECONDS = float(os.getenv("DIARIZATION_WINDOW_SECONDS", 600))
+        self.DIARIZATION_WINDOW_OVERLAP = float(os.getenv("DIARIZATION_WINDOW_OVERLAP", 30))
+        self.DIARIZATION_WINDOW_WORKERS = int(os.getenv("DIARIZATION_WINDOW_WORKERS", 1))
+        
+        # Sampler de recursos e critérios de readiness (/readyz)
+        self.SAMPLER_INTERVAL = float(os.getenv("SAMPLER_INTERVAL", 10))
+        self.READY_REQUIRE_DIARIZATION = os.getenv("READY_REQUIRE_DIARIZATION", "false").lower() == "true"
+        self.READY_MIN_DISK_MB = int(os.getenv("READY_MIN_DISK_MB", 500))
+        
+        # Modo coordenador/worker ("standalone": inferência no processo da API)
+        self.CLUSTER_MODE = os.getenv("CLUSTER_MODE", "standalone").lower()
+        self.CLUSTER_QUEUE_DIR = os.getenv("CLUSTER_QUEUE_DIR", "queue")
+        self.CLUSTER_NODE = os.getenv("CLUSTER_NODE") or socket.gethostname()
+        self.CLUSTER_AFFINITY_WAIT = float(os.getenv("CLUSTER_AFFINITY_WAIT", 5))
+        self.CLUSTER_WORKER_TIMEOUT = float(os.getenv("CLUSTER_WORKER_TIMEOUT", 30))
+        self.CLUSTER_JOB_TIMEOUT = float(os.getenv("CLUSTER_JOB_TIMEOUT", 1800))  # 0 = sem limite
+        
+        # Rate limiting por custo: token bucket em segundos de áudio x custo do modelo
+        self.RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # "memory", "redis" ou "off"
+        self.RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+        self.RATE_LIMIT_FAIL_OPEN = os.getenv("RATE_LIMIT_FAIL_OPEN", "true").lower() == "true"
+        self.RATE_CLIENT_CAPACITY = float(os.getenv("RATE_CLIENT_CAPACITY", 7200))
+        self.RATE_CLIENT_REFILL = float(os.getenv("RATE_CLIENT_REFILL", 2.0))
+        self.RATE_GLOBAL_CAPACITY = float(os.getenv("RATE_GLOBAL_CAPACITY", 72000))
+        self.RATE_GLOBAL_REFILL = float(os.getenv("RATE_GLOBAL_REFILL", 20.0))
+        self.RATE_MODEL_COSTS = os.getenv("RATE_MODEL_COSTS", "htdemucs_ft=4,htdemucs_6s=1")
+        self.RATE_DIARIZATION_COST = float(os.getenv("RATE_DIARIZATION_COST", 1.0))
+        
+        # Profiling sob demanda (torch.profiler): header X-Profile-Token ou amostragem
+        self.PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+        self.PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+        self.PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+        self.PROFILE_TOP_OPS = int(os.getenv("PROFILE_TOP_OPS", 25))
+        
+        # Orçamento de cold start (segundos até /readyz; 0 = sem orçamento), avisado no log
+        self.STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", 0))
+        
         # Logging
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
         self.LOG_FILE = os.getenv("LOG_FILE", "app.log")
@@ -50,9 +142,32 @@ class Config:
         else:
             logger.info("pyannoteAI API configurada com sucesso.")
         
+        # Falha na inicialização, não silenciosamente no primeiro job que usa o valor
+        from segments import OVERLAP_MODES
+        from onnx_backend import INFERENCE_BACKENDS
+        from quantization import INFERENCE_PRESETS
+        from inference import CPU_BF16_SETTINGS
+        from stem_writer import STEM_FORMATS
+        from cost_limiter import RATE_LIMIT_BACKENDS
+        from cluster import CLUSTER_MODES
+        self._require_choice("DIARIZATION_OVERLAP_MODE", OVERLAP_MODES)
+        self._require_choice("INFERENCE_BACKEND", INFERENCE_BACKENDS)
+        self._require_choice("INFERENCE_PRESET", INFERENCE_PRESETS)
+        self._require_choice("CPU_BF16", CPU_BF16_SETTINGS)
+        self._require_choice("STEM_FORMAT", STEM_FORMATS)
+        self._require_choice("RATE_LIMIT_BACKEND", RATE_LIMIT_BACKENDS)
+        self._require_choice("CLUSTER_MODE", CLUSTER_MODES)
+        
         # Criar diretórios se não existirem
         os.makedirs(self.UPLOAD_DIR, exist_ok=True)
         os.makedirs(self.OUTPUT_DIR, exist_ok=True)
+        os.makedirs(self.PROFILE_DIR, exist_ok=True)
+    
+    def _require_choice(self, name: str, valid):
+        """ValueError se a configuração `name` não estiver entre os valores válidos."""
+        value = getattr(self, name)
+        if value not in valid:
+            raise ValueError(f"{name} inválido: '{value}'. Use: {', '.join(valid)}")
     
     @property
     def has_pyannote_api(self) -> bool:
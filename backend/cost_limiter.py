@@ -0,0 +1,224 @@
+# Cost-weighted token-bucket rate limiting (audio-seconds x model cost)
+import math
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Importação condicional do cliente Redis
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    logger.info("redis não disponível: rate limiting por custo usa memória local")
+
+# Valores aceitos em RATE_LIMIT_BACKEND ("off" desativa o limitador)
+RATE_LIMIT_BACKENDS = ("memory", "redis", "off")
+
+# (chave, capacidade, reposição por segundo)
+Bucket = Tuple[str, float, float]
+
+# Intervalo entre limpezas dos buckets cheios em memória
+_PRUNE_INTERVAL = 60.0
+
+# Retry-After sugerido quando o Redis falha com a política fail-closed
+_REDIS_RETRY_SECONDS = 5.0
+
+
+class MemoryBucketStore:
+    """
+    Buckets em memória do processo.
+
+    Substituto local do RedisBucketStore (desenvolvimento, testes, réplica
+    única): mesma semântica, mas cada réplica tem seus próprios contadores.
+    Um bucket que já reabasteceu até a capacidade equivale a um ausente e
+    é descartado, então a memória acompanha só os clientes recentes.
+    """
+
+    def __init__(self):
+        # chave -> (saldo, atualizado em, instante em que volta a ficar cheio)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+
+    def _prune(self, now: float):
+        full = [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for key in full:
+            del self._buckets[key]
+        self._last_prune = now
+
+    def take(self, buckets: Sequence[Bucket], cost: float) -> Tuple[bool, float]:
+        """
+        Debita `cost` de todos os buckets, ou de nenhum.
+
+        Returns:
+            Tupla (permitido, segundos até haver saldo suficiente)
+        """
+        now = time.time()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            if now - self._last_prune >= _PRUNE_INTERVAL:
+                self._prune(now)
+            for key, capacity, rate in buckets:
+                tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                levels.append(tokens)
+                need = min(cost, capacity)
+                if tokens < need:
+                    wait = max(wait, (need - tokens) / rate)
+            if wait > 0:
+                return False, wait
+            for (key, capacity, rate), tokens in zip(buckets, levels):
+                tokens -= min(cost, capacity)
+                self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            return True, 0.0
+
+
+# Mesmo algoritmo do MemoryBucketStore, atômico no servidor e com o relógio do Redis
+# KEYS: buckets; ARGV: custo, depois (capacidade, reposição) de cada bucket
+_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[2 * i])
+  local rate = tonumber(ARGV[2 * i + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+  levels[i] = tokens
+  local need = math.min(cost, capacity)
+  if tokens < need then wait = math.max(wait, (need - tokens) / rate) end
+end
+if wait > 0 then return {0, tostring(wait)} end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[2 * i])
+  local rate = tonumber(ARGV[2 * i + 1])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - math.min(cost, capacity)), 'ts', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {1, '0'}
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets compartilhados entre réplicas em um servidor com protocolo Redis.
+
+    Se o Redis falhar durante uma cobrança, a política decide: fail-open
+    (padrão) cobra em buckets locais desta réplica até o Redis voltar;
+    fail-closed nega a requisição (HTTP 429 com Retry-After).
+    """
+
+    def __init__(self, url: str, prefix: str = "stemuc:ratelimit:", fail_open: bool = True):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requer o pacote redis")
+        self.client = redis.Redis.from_url(url)
+        # from_url e register_script não conectam: falha aqui cai no fallback de create_cost_limiter
+        self.client.ping()
+        self.prefix = prefix
+        self.fail_open = fail_open
+        self._local = MemoryBucketStore()
+        self._script = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, buckets: Sequence[Bucket], cost: float) -> Tuple[bool, float]:
+        keys = [self.prefix + key for key, _, _ in buckets]
+        args: List[float] = [cost]
+        for _, capacity, rate in buckets:
+            args += [capacity, rate]
+        try:
+            allowed, wait = self._script(keys=keys, args=args)
+        except redis.RedisError as e:
+            if self.fail_open:
+                logger.warning(f"⚠️ Redis indisponível ({e}); cobrança em buckets locais")
+                return self._local.take(buckets, cost)
+            logger.error(f"❌ Redis indisponível ({e}); requisição negada (fail-closed)")
+            return False, _REDIS_RETRY_SECONDS
+        return bool(int(allowed)), float(wait)
+
+
+class CostLimiter:
+    """
+    Token bucket cobrado em segundos de áudio x custo do modelo.
+
+    Cada requisição debita o mesmo custo de dois buckets: o do cliente e o
+    global (capacidade total do serviço). O débito é tudo-ou-nada. Um custo
+    maior que a capacidade do bucket é limitado à capacidade, então um
+    arquivo muito longo é aceito com o bucket cheio e o esvazia.
+    """
+
+    def __init__(self, store, client_capacity: float, client_refill: float,
+                 global_capacity: float, global_refill: float,
+                 model_costs: Optional[Dict[str, float]] = None, diarization_cost: float = 0.0):
+        """
+        Args:
+            store: MemoryBucketStore ou RedisBucketStore
+            client_capacity / client_refill: Saldo máximo e reposição por segundo de cada cliente
+            global_capacity / global_refill: Idem para o bucket global (0 desativa)
+            model_costs: Custo por segundo de áudio de cada modelo com todos os membros do bag (padrão 1.0)
+            diarization_cost: Custo adicional por segundo com diarização
+        """
+        self.store = store
+        self.client_capacity = client_capacity
+        self.client_refill = client_refill
+        self.global_capacity = global_capacity
+        self.global_refill = global_refill
+        self.model_costs = model_costs or {}
+        self.diarization_cost = diarization_cost
+
+    def cost(self, audio_seconds: float, model_name: str, diarization: bool = False,
+             member_fraction: float = 1.0) -> float:
+        """
+        Custo de uma separação.
+
+        `member_fraction` é a fração dos membros do bag que de fato roda
+        (ex: 2-stem no htdemucs_ft executa 1 de 4 modelos).
+        """
+        per_second = self.model_costs.get(model_name, 1.0) * member_fraction
+        if diarization:
+            per_second += self.diarization_cost
+        return audio_seconds * per_second
+
+    def charge(self, client_id: str, cost: float) -> Tuple[bool, float]:
+        """
+        Debita o custo do cliente e do bucket global.
+
+        Returns:
+            Tupla (permitido, segundos até poder tentar de novo)
+        """
+        buckets: List[Bucket] = [(f"client:{client_id}", self.client_capacity, self.client_refill)]
+        if self.global_capacity > 0:
+            buckets.append(("global", self.global_capacity, self.global_refill))
+        allowed, wait = self.store.take(buckets, cost)
+        if not allowed:
+            logger.warning(f"⏳ Custo {cost:.0f} negado para {client_id}: tente em {math.ceil(wait)}s")
+        return allowed, wait
+
+
+def parse_model_costs(value: str) -> Dict[str, float]:
+    """Converte "htdemucs_ft=4,htdemucs_6s=1" em dict."""
+    costs = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, cost = item.partition("=")
+        costs[name.strip()] = float(cost)
+    return costs
+
+
+def create_cost_limiter(backend: str, redis_url: Optional[str], fail_open: bool = True,
+                        **kwargs) -> CostLimiter:
+    """CostLimiter com o backend configurado (redis com fallback para memória)."""
+    store = MemoryBucketStore()
+    if backend == "redis":
+        try:
+            store = RedisBucketStore(redis_url, fail_open=fail_open)
+            logger.info("✅ Rate limiting por custo compartilhado via Redis")
+        except Exception as e:
+            logger.error(f"❌ Redis indisponível para rate limiting, usando memória local: {e}")
+    return CostLimiter(store, **kwargs)
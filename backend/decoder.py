@@ -0,0 +1,231 @@
+# Streaming audio decoder: native decode, conversion to model rate/layout
+import os
+import json
+import logging
+import subprocess
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import torch
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+# Containers aceitos e content-types correspondentes
+SUPPORTED_EXTENSIONS = {'.mp3', '.wav', '.flac', '.m4a', '.mp4'}
+SUPPORTED_CONTENT_TYPES = {
+    "audio/mpeg", "audio/mp3", "audio/x-mpeg",
+    "audio/wav", "audio/x-wav", "audio/wave",
+    "audio/flac", "audio/x-flac",
+    "audio/mp4", "audio/x-m4a", "audio/m4a", "audio/aac", "video/mp4",
+}
+
+# Formatos lidos diretamente pelo libsndfile (sem ffmpeg)
+_SNDFILE_EXTENSIONS = {'.wav', '.flac'}
+
+_resampler_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def stream_reader_available() -> bool:
+    """
+    torchaudio com ffmpeg utilizável (StreamReader). Verificado no primeiro decode.
+
+    Não basta o import: em versões novas do torchaudio o StreamReader não
+    existe, e em outras ele importa mas não carrega as bibliotecas do ffmpeg
+    do sistema. Por isso as bibliotecas são de fato inicializadas aqui.
+    """
+    try:
+        from torchaudio.io import StreamReader  # noqa: F401
+        from torchaudio.utils import ffmpeg_utils
+        ffmpeg_utils.get_versions()
+        return True
+    except Exception as e:
+        logger.info(f"StreamReader indisponível ({e}); decode via libsndfile/torchaudio.load/librosa")
+        return False
+
+
+@lru_cache(maxsize=16)
+def get_resampler(orig_sr: int, new_sr: int) -> "torchaudio.transforms.Resample":
+    """Resampler com kernel pré-calculado, reutilizado por par de taxas."""
+    import torchaudio
+    return torchaudio.transforms.Resample(orig_sr, new_sr)
+
+
+def _ffprobe(path: str) -> Dict[str, Any]:
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "stream=codec_name,sample_rate,channels,duration:format=duration",
+         "-of", "json", path],
+        capture_output=True, check=True, text=True
+    )
+    data = json.loads(result.stdout)
+    stream = data.get("streams", [{}])[0]
+    duration = stream.get("duration") or data.get("format", {}).get("duration") or 0
+    return {
+        "duration": float(duration),
+        "sample_rate": int(stream.get("sample_rate", 0)),
+        "channels": int(stream.get("channels", 0)),
+        "codec": stream.get("codec_name", "unknown"),
+    }
+
+
+def _sndfile_probe(path: str) -> Dict[str, Any]:
+    info = sf.info(path)
+    return {
+        "duration": info.duration,
+        "sample_rate": info.samplerate,
+        "channels": info.channels,
+        "codec": info.subtype.lower(),
+    }
+
+
+def _torchaudio_probe(path: str) -> Dict[str, Any]:
+    import torchaudio
+    info = torchaudio.info(path)
+    return {
+        "duration": info.num_frames / info.sample_rate if info.sample_rate else 0.0,
+        "sample_rate": info.sample_rate,
+        "channels": info.num_channels,
+        "codec": str(getattr(info, "encoding", "unknown")).lower(),
+    }
+
+
+def _audioread_probe(path: str) -> Dict[str, Any]:
+    # Dependência do librosa; lê duração e formato dos cabeçalhos/tags do container
+    import audioread
+    with audioread.audio_open(path) as f:
+        return {
+            "duration": float(f.duration),
+            "sample_rate": int(f.samplerate),
+            "channels": int(f.channels),
+            "codec": "unknown",
+        }
+
+
+def probe_audio(path: str) -> Dict[str, Any]:
+    """
+    Lê duração, taxa, canais e codec a partir dos cabeçalhos, sem decodificar o arquivo.
+
+    WAV/FLAC via libsndfile; os demais via ffprobe e, sem o binário,
+    libsndfile (MP3 a partir da 1.1), torchaudio.info e audioread.
+
+    Returns:
+        Dict com duration (s), sample_rate, channels e codec
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _SNDFILE_EXTENSIONS:
+        return _sndfile_probe(path)
+    try:
+        return _ffprobe(path)
+    except FileNotFoundError:
+        pass  # ffprobe não instalado
+
+    error: Optional[Exception] = None
+    for probe in (_sndfile_probe, _torchaudio_probe, _audioread_probe):
+        try:
+            info = probe(path)
+        except Exception as e:
+            error = e
+            continue
+        if info["duration"] > 0 and info["channels"] > 0:
+            return info
+    raise RuntimeError(f"Não foi possível ler os cabeçalhos de {os.path.basename(path)}: {error}")
+
+
+def _convert_channels(block: torch.Tensor, channels: int) -> torch.Tensor:
+    """Mixdown para mono e duplicação, como o pipeline original."""
+    if block.shape[0] == channels:
+        return block
+    block = block.mean(dim=0, keepdim=True)
+    if channels > 1:
+        block = block.expand(channels, -1)
+    return block
+
+
+def iter_blocks(path: str, sample_rate: int, channels: int,
+                block_seconds: float = 10.0) -> Iterator[torch.Tensor]:
+    """
+    Decodifica o arquivo em blocos já na taxa e no layout de canais do modelo.
+
+    Com o ffmpeg (StreamReader), a reamostragem acontece no próprio decode;
+    os canais vêm no layout nativo e passam por _convert_channels (o upmix
+    do ffmpeg atenua mono->estéreo em ~3 dB). Sem ele, WAV/FLAC vêm do libsndfile em blocos e os
+    formatos comprimidos num bloco único (_load_fallback), todos na taxa
+    nativa: o chamador reamostra (ver decode_audio).
+
+    Yields:
+        Tensores [C, L] float32
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if stream_reader_available():
+        from torchaudio.io import StreamReader
+
+        reader = StreamReader(path)
+        reader.add_basic_audio_stream(
+            frames_per_chunk=int(block_seconds * sample_rate),
+            sample_rate=sample_rate,
+            format="fltp",
+        )
+        for (chunk,) in reader.stream():
+            yield _convert_channels(chunk.T, channels)  # [L, C] -> [C, L]
+        return
+
+    if ext not in _SNDFILE_EXTENSIONS:
+        wav, _ = _load_fallback(path)
+        yield _convert_channels(wav, channels)
+        return
+
+    with sf.SoundFile(path) as f:
+        frames = int(block_seconds * f.samplerate)
+        for block in f.blocks(blocksize=frames, dtype='float32', always_2d=True):
+            yield _convert_channels(torch.from_numpy(block.T.copy()), channels)
+
+
+def _load_fallback(path: str) -> Tuple[torch.Tensor, int]:
+    """Decode completo sem StreamReader (como antes do decoder): torchaudio.load, depois librosa."""
+    try:
+        import torchaudio
+        return torchaudio.load(path)
+    except Exception as e:
+        logger.debug(f"torchaudio.load falhou para {path}: {e}; tentando librosa")
+    import librosa
+    y, sr = librosa.load(path, sr=None, mono=False)
+    wav = torch.from_numpy(y)
+    return (wav.unsqueeze(0) if wav.ndim == 1 else wav), sr
+
+
+def decode_audio(path: str, sample_rate: int, channels: int, block_seconds: float = 10.0,
+                 info: Optional[Dict[str, Any]] = None) -> Tuple[torch.Tensor, Dict[str, Any]]:
+    """
+    Decodifica o arquivo inteiro para a taxa e canais do modelo.
+
+    Args:
+        path: Caminho do arquivo
+        sample_rate: Taxa de amostragem do modelo
+        channels: Número de canais do modelo
+        block_seconds: Tamanho dos blocos de decode
+        info: Probe já feito (ex: ProbeIndex); None faz o probe aqui
+
+    Returns:
+        Tupla (tensor [C, T] float32, info dos cabeçalhos)
+    """
+    info = info or probe_audio(path)
+    if stream_reader_available() or os.path.splitext(path)[1].lower() in _SNDFILE_EXTENSIONS:
+        blocks = list(iter_blocks(path, sample_rate, channels, block_seconds))
+        wav = torch.cat(blocks, dim=1) if blocks else torch.zeros(channels, 0)
+        del blocks
+        native_rate = sample_rate if stream_reader_available() else info["sample_rate"]
+    else:
+        # Comprimido sem StreamReader: vale a taxa real do decode, não a do probe
+        wav, native_rate = _load_fallback(path)
+        wav = _convert_channels(wav, channels)
+
+    # Sem StreamReader o áudio vem na taxa nativa: reamostra com kernel em cache
+    if native_rate != sample_rate:
+        with _resampler_lock:
+            resampler = get_resampler(native_rate, sample_rate)
+        wav = resampler(wav)
+
+    return wav.contiguous(), info
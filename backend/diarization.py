@@ -1,25 +1,77 @@
+import io
 import os
+import copy
+import queue
+import importlib.util
 import logging
-import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+import numpy as np
 import torch
 import requests
-import librosa
 import soundfile as sf
-from typing import List, Dict, Any, Optional
-from pydub import AudioSegment
+from typing import List, Dict, Any, Optional, Tuple
+
+from staging import staged_output
+from segments import DiarizationSegments, SpeakerMaskEngine, as_segments
 
 logger = logging.getLogger(__name__)
 
-# Importações condicionais para pyannote
-try:
-    from pyannote.audio import Pipeline
-    from pyannote.audio.pipelines.utils import PipelineModel
-    PYANNOTE_AVAILABLE = True
-    logger.info("✅ pyannote.audio está disponível")
-except ImportError as e:
-    PYANNOTE_AVAILABLE = False
-    logger.warning(f"⚠️ pyannote.audio não disponível: {e}")
+# Taxa de amostragem esperada pelos modelos pyannote
+DIARIZATION_SAMPLE_RATE = 16000
+
+# pyannote.audio (e librosa/scipy) só são importados quando usados: o import
+# deste módulo não paga o custo do pipeline local
+PYANNOTE_AVAILABLE = importlib.util.find_spec("pyannote") is not None \
+    and importlib.util.find_spec("pyannote.audio") is not None
+if not PYANNOTE_AVAILABLE:
+    logger.warning("⚠️ pyannote.audio não disponível")
+
+def load_mono_16k(audio_path: str, offset: float = 0.0,
+                  duration: Optional[float] = None) -> Tuple[np.ndarray, int]:
+    """
+    Decodifica o áudio uma única vez e converte para mono 16kHz em memória.
+    
+    Usa resample polifásico (scipy) em vez do resampler padrão do librosa,
+    que é bem mais lento para faixas longas.
+    
+    Args:
+        audio_path: Caminho para o arquivo de áudio
+        offset: Início do trecho a decodificar, em segundos
+        duration: Duração do trecho em segundos (None = até o fim)
+        
+    Returns:
+        Tupla (waveform float32 mono, sample_rate)
+    """
+    try:
+        with sf.SoundFile(audio_path) as f:
+            sr = f.samplerate
+            f.seek(int(offset * sr))
+            frames = -1 if duration is None else int(duration * sr)
+            y = f.read(frames, dtype='float32', always_2d=True).mean(axis=1)
+    except RuntimeError:
+        # Formato não suportado pelo libsndfile (ex: mp3 antigo) - decodifica via librosa
+        import librosa
+        y, sr = librosa.load(audio_path, sr=None, mono=True, offset=offset, duration=duration)
+    
+    if sr != DIARIZATION_SAMPLE_RATE:
+        from scipy.signal import resample_poly
+        g = gcd(int(sr), DIARIZATION_SAMPLE_RATE)
+        y = resample_poly(y, DIARIZATION_SAMPLE_RATE // g, int(sr) // g)
+    
+    return np.ascontiguousarray(y, dtype=np.float32), DIARIZATION_SAMPLE_RATE
+
+
+def get_audio_duration(audio_path: str) -> float:
+    """Duração em segundos, lida do cabeçalho quando possível."""
+    try:
+        return sf.info(audio_path).duration
+    except RuntimeError:
+        import librosa
+        return librosa.get_duration(path=audio_path)
+
 
 class VocalDiarizer:
     """
@@ -27,17 +79,31 @@ class VocalDiarizer:
     Suporta tanto API da pyannoteAI quanto pyannote.audio local.
     """
     
-    def __init__(self, huggingface_token: str, pyannote_api_key: Optional[str] = None):
+    def __init__(self, huggingface_token: str, pyannote_api_key: Optional[str] = None,
+                 window_seconds: float = 0.0, window_overlap: float = 30.0, window_workers: int = 1,
+                 link_threshold: float = 0.5):
         """
         Inicializa o diarizador com tokens necessários.
         
         Args:
             huggingface_token: Token de autenticação do Hugging Face (para modelos locais)
             pyannote_api_key: API key da pyannoteAI (para serviço premium)
+            window_seconds: Tamanho da janela da diarização local em janelas (0 = desativada)
+            window_overlap: Sobreposição entre janelas consecutivas, em segundos
+            window_workers: Janelas processadas em paralelo (cada worker além do
+                primeiro carrega uma cópia própria do pipeline em memória)
+            link_threshold: Similaridade cosseno mínima para unir speakers entre janelas
         """
         self.huggingface_token = huggingface_token
         self.pyannote_api_key = pyannote_api_key
         self.pipeline = None
+        self.window_seconds = window_seconds
+        self.window_overlap = min(window_overlap, window_seconds / 2)
+        self.window_workers = max(1, window_workers)
+        # Pipelines para as janelas (um por worker); o pipeline não é thread-safe
+        self._window_pipelines: Optional["queue.Queue"] = None
+        self._window_lock = threading.Lock()
+        self.link_threshold = link_threshold
         self.use_api = bool(pyannote_api_key)
         
         logger.info(f"🎤 Inicializando VocalDiarizer - API: {self.use_api}, Local: {PYANNOTE_AVAILABLE}")
@@ -46,45 +112,36 @@ class VocalDiarizer:
         if PYANNOTE_AVAILABLE:
             self._initialize_local_pipeline()
     
-    def _compress_audio_for_api(self, audio_path: str, max_size_mb: int = 20) -> str:
+    def _encode_audio_for_api(self, audio_path: str, max_size_mb: int = 20) -> io.BytesIO:
         """
-        Comprime áudio para ficar abaixo do limite da API.
+        Prepara o áudio para upload, reduzindo-o se passar do limite da API.
         
         Args:
             audio_path: Caminho para o arquivo original
             max_size_mb: Tamanho máximo em MB
             
         Returns:
-            Caminho para arquivo comprimido temporário
+            Buffer em memória com o WAV a ser enviado
         """
-        try:
-            # Verificar tamanho atual
-            current_size_mb = os.path.getsize(audio_path) / (1024 * 1024)
-            
-            if current_size_mb <= max_size_mb:
-                logger.info(f"Arquivo já é pequeno o suficiente: {current_size_mb:.1f}MB")
-                return audio_path
-            
-            logger.info(f"Comprimindo áudio de {current_size_mb:.1f}MB para menos de {max_size_mb}MB...")
-            
-            # Criar arquivo temporário
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.wav', prefix='compressed_')
-            os.close(temp_fd)
-            
-            # Carregar áudio com librosa
-            y, sr = librosa.load(audio_path, sr=16000, mono=True)
-            
-            # Salvar com qualidade reduzida
-            sf.write(temp_path, y, sr, subtype='PCM_16')
-            
-            new_size_mb = os.path.getsize(temp_path) / (1024 * 1024)
-            logger.info(f"Áudio comprimido: {new_size_mb:.1f}MB (economia: {current_size_mb - new_size_mb:.1f}MB)")
-            
-            return temp_path
-            
-        except Exception as e:
-            logger.error(f"Erro ao comprimir áudio: {e}")
-            return audio_path
+        current_size_mb = os.path.getsize(audio_path) / (1024 * 1024)
+        
+        if current_size_mb <= max_size_mb:
+            logger.info(f"Arquivo já é pequeno o suficiente: {current_size_mb:.1f}MB")
+            with open(audio_path, 'rb') as f:
+                return io.BytesIO(f.read())
+        
+        logger.info(f"Comprimindo áudio de {current_size_mb:.1f}MB para menos de {max_size_mb}MB...")
+        
+        # Resample em memória e codificação direto no buffer (sem arquivo temporário)
+        y, sr = load_mono_16k(audio_path)
+        buffer = io.BytesIO()
+        sf.write(buffer, y, sr, format='WAV', subtype='PCM_16')
+        buffer.seek(0)
+        
+        new_size_mb = buffer.getbuffer().nbytes / (1024 * 1024)
+        logger.info(f"Áudio comprimido: {new_size_mb:.1f}MB (economia: {current_size_mb - new_size_mb:.1f}MB)")
+        
+        return buffer
     
     def _initialize_local_pipeline(self):
         """Inicializa o pipeline local de diarização."""
@@ -99,6 +156,7 @@ class VocalDiarizer:
             os.environ["HF_TOKEN"] = self.huggingface_token
             
             # Tentar carregar o pipeline com configurações melhoradas
+            from pyannote.audio import Pipeline
             self.pipeline = Pipeline.from_pretrained(
                 "pyannote/speaker-diarization-3.1",
                 use_auth_token=self.huggingface_token
@@ -142,16 +200,15 @@ class VocalDiarizer:
             logger.error("API key da pyannoteAI não configurada")
             return None
         
-        compressed_path = None
         try:
             logger.info("Iniciando diarização via pyannoteAI API...")
             
             # Comprimir áudio se necessário
-            compressed_path = self._compress_audio_for_api(audio_path, max_size_mb=15)
+            upload = self._encode_audio_for_api(audio_path, max_size_mb=15)
             
-            # Upload do arquivo
-            with open(compressed_path, 'rb') as f:
-                files = {'file': f}
+            # Upload do buffer
+            with upload:
+                files = {'file': (os.path.basename(audio_path), upload, 'audio/wav')}
                 headers = {'Authorization': f'Bearer {self.pyannote_api_key}'}
                 
                 # Iniciar job de diarização
@@ -204,14 +261,6 @@ class VocalDiarizer:
         except Exception as e:
             logger.error(f"Erro na diarização via API: {e}", exc_info=True)
             return None
-        finally:
-            # Limpar arquivo temporário se foi criado
-            if compressed_path and compressed_path != audio_path:
-                try:
-                    os.unlink(compressed_path)
-                    logger.debug("Arquivo temporário comprimido removido")
-                except Exception as e:
-                    logger.warning(f"Erro ao remover arquivo temporário: {e}")
     
     def _parse_api_result(self, api_result: Dict) -> Dict[str, Any]:
         """
@@ -224,30 +273,18 @@ class VocalDiarizer:
             Resultado formatado
         """
         try:
-            speakers = {}
-            
             # A API retorna segmentos com speaker, start, end
-            for segment in api_result.get('segments', []):
-                speaker_id = f"artist_{segment['speaker']}"
-                if speaker_id not in speakers:
-                    speakers[speaker_id] = []
-                
-                speakers[speaker_id].append({
-                    'start': segment['start'],
-                    'end': segment['end'],
-                    'duration': segment['end'] - segment['start']
-                })
-            
-            num_speakers = len(speakers)
-            total_duration = max([seg['end'] for segments in speakers.values() 
-                                for seg in segments]) if speakers else 0
+            segments = DiarizationSegments.from_turns(
+                (segment['start'], segment['end'], segment['speaker'])
+                for segment in api_result.get('segments', [])
+            )
             
-            logger.info(f"🎤 API detectou {num_speakers} speakers em {total_duration:.1f}s")
+            logger.info(f"🎤 API detectou {segments.num_speakers} speakers em {segments.total_duration:.1f}s")
             
             return {
-                'num_speakers': num_speakers,
-                'speakers': speakers,
-                'total_duration': total_duration,
+                'num_speakers': segments.num_speakers,
+                'segments': segments,
+                'total_duration': segments.total_duration,
                 'method': 'api'
             }
             
@@ -272,63 +309,207 @@ class VocalDiarizer:
         try:
             logger.info(f"Iniciando diarização local do arquivo: {audio_path}")
             
-            # Preparar áudio para processamento local (reduzir para melhor performance)
-            temp_path = None
-            try:
-                # Comprimir para 16kHz mono para melhor processamento
-                y, sr = librosa.load(audio_path, sr=16000, mono=True)
-                
-                # Criar arquivo temporário se necessário
-                if sr != 16000 or len(y.shape) > 1:
-                    temp_fd, temp_path = tempfile.mkstemp(suffix='.wav', prefix='diarize_')
-                    os.close(temp_fd)
-                    sf.write(temp_path, y, 16000)
-                    process_path = temp_path
-                else:
-                    process_path = audio_path
-                
-                # Aplicar diarização com parâmetros ajustados
-                logger.info("🔄 Processando diarização...")
-                diarization = self.pipeline(process_path, min_speakers=1, max_speakers=8)
-                
-                # Processar resultados
-                speakers = {}
-                for turn, _, speaker in diarization.itertracks(yield_label=True):
-                    speaker_id = f"artist_{speaker}"
-                    if speaker_id not in speakers:
-                        speakers[speaker_id] = []
-                    speakers[speaker_id].append({
-                        'start': turn.start,
-                        'end': turn.end,
-                        'duration': turn.end - turn.start
-                    })
-                
-                num_speakers = len(speakers)
-                total_duration = max([segment['end'] for segments in speakers.values() 
-                                    for segment in segments]) if speakers else 0
-                
-                logger.info(f"🎤 Local detectou {num_speakers} speakers em {total_duration:.1f}s")
-                
-                return {
-                    'num_speakers': num_speakers,
-                    'speakers': speakers,
-                    'total_duration': total_duration,
-                    'diarization_object': diarization,
-                    'method': 'local'
-                }
-                
-            finally:
-                # Limpar arquivo temporário
-                if temp_path:
-                    try:
-                        os.unlink(temp_path)
-                    except Exception as e:
-                        logger.warning(f"Erro ao remover arquivo temporário: {e}")
+            # Faixas longas: diarização por janelas com memória limitada
+            if self.window_seconds > 0:
+                duration = get_audio_duration(audio_path)
+                if duration > self.window_seconds + self.window_overlap:
+                    return self._diarize_windowed(audio_path, duration)
+            
+            # Preparar áudio em memória: mono 16kHz, passado ao pyannote como tensor
+            y, sr = load_mono_16k(audio_path)
+            waveform = torch.from_numpy(y).unsqueeze(0)  # shape: [1, T]
+            
+            # Aplicar diarização com parâmetros ajustados
+            logger.info("🔄 Processando diarização...")
+            diarization = self.pipeline(
+                {"waveform": waveform, "sample_rate": sr},
+                min_speakers=1,
+                max_speakers=8
+            )
+            
+            # Processar resultados (o objeto do pyannote não é mantido em memória)
+            segments = DiarizationSegments.from_turns(
+                (turn.start, turn.end, speaker)
+                for turn, _, speaker in diarization.itertracks(yield_label=True)
+            )
+            del diarization
+            
+            logger.info(f"🎤 Local detectou {segments.num_speakers} speakers em {segments.total_duration:.1f}s")
+            
+            return {
+                'num_speakers': segments.num_speakers,
+                'segments': segments,
+                'total_duration': segments.total_duration,
+                'method': 'local'
+            }
             
         except Exception as e:
             logger.error(f"Erro na diarização local: {e}", exc_info=True)
             return None
     
+    def _window_pipeline_pool(self) -> "queue.Queue":
+        """
+        Pool com um pipeline por worker de janela, criado no primeiro uso.
+        
+        O primeiro é o próprio self.pipeline; os demais são cópias (memória
+        extra por worker). Se a cópia falhar, o pool fica menor e as janelas
+        esperam por um pipeline livre.
+        """
+        with self._window_lock:
+            if self._window_pipelines is None:
+                pool: "queue.Queue" = queue.Queue()
+                pool.put(self.pipeline)
+                for _ in range(self.window_workers - 1):
+                    try:
+                        pool.put(copy.deepcopy(self.pipeline))
+                    except Exception as e:
+                        logger.warning(f"⚠️ Cópia do pipeline para janelas falhou ({e}); {pool.qsize()} em paralelo")
+                        break
+                self._window_pipelines = pool
+            return self._window_pipelines
+    
+    def _diarize_window(self, audio_path: str, offset: float,
+                        duration: float) -> Tuple[List[Tuple[float, float, str]], List[str], np.ndarray]:
+        """
+        Diariza uma janela e retorna turnos em tempo absoluto e embeddings por speaker.
+        
+        Usa um pipeline exclusivo do pool enquanto a janela roda.
+        
+        Args:
+            audio_path: Caminho para o arquivo de áudio
+            offset: Início da janela em segundos
+            duration: Duração da janela em segundos
+            
+        Returns:
+            Tupla (turnos, rótulos locais, embeddings [S, D])
+        """
+        y, sr = load_mono_16k(audio_path, offset=offset, duration=duration)
+        waveform = torch.from_numpy(y).unsqueeze(0)
+        del y
+        
+        pool = self._window_pipeline_pool()
+        pipeline = pool.get()
+        try:
+            diarization, embeddings = pipeline(
+                {"waveform": waveform, "sample_rate": sr},
+                min_speakers=1,
+                max_speakers=8,
+                return_embeddings=True
+            )
+        finally:
+            pool.put(pipeline)
+        
+        turns = [
+            (offset + turn.start, offset + turn.end, speaker)
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+        # As linhas de embeddings seguem a ordem de diarization.labels()
+        return turns, list(diarization.labels()), np.asarray(embeddings, dtype=np.float32)
+    
+    def _link_speakers(self, labels: List[str], embeddings: np.ndarray,
+                       centroids: List[np.ndarray], counts: List[int]) -> Dict[str, int]:
+        """
+        Associa os speakers de uma janela aos speakers globais por similaridade de embedding.
+        
+        Usa atribuição ótima (húngaro) sobre a similaridade cosseno; pares abaixo
+        de link_threshold viram novos speakers globais. Os centróides são
+        atualizados com média móvel.
+        
+        Args:
+            labels: Rótulos locais da janela
+            embeddings: Embeddings [S, D] na ordem de labels
+            centroids: Centróides globais (atualizados in-place)
+            counts: Nº de janelas agregadas em cada centróide (atualizado in-place)
+            
+        Returns:
+            Mapeamento rótulo local -> índice global
+        """
+        mapping: Dict[str, int] = {}
+        valid = [i for i in range(len(labels)) if np.all(np.isfinite(embeddings[i]))]
+        
+        if centroids and valid:
+            local = embeddings[valid]
+            local = local / np.linalg.norm(local, axis=1, keepdims=True).clip(min=1e-8)
+            known = np.stack(centroids)
+            known = known / np.linalg.norm(known, axis=1, keepdims=True).clip(min=1e-8)
+            similarity = local @ known.T
+            from scipy.optimize import linear_sum_assignment
+            rows, cols = linear_sum_assignment(-similarity)
+            for r, c in zip(rows, cols):
+                if similarity[r, c] >= self.link_threshold:
+                    i = valid[r]
+                    mapping[labels[i]] = int(c)
+                    counts[c] += 1
+                    centroids[c] = centroids[c] + (embeddings[i] - centroids[c]) / counts[c]
+        
+        for i, label in enumerate(labels):
+            if label in mapping:
+                continue
+            # Sem correspondência (ou embedding inválido): novo speaker global
+            mapping[label] = len(centroids)
+            centroids.append(embeddings[i] if i in valid else np.zeros(embeddings.shape[1], dtype=np.float32))
+            counts.append(1 if i in valid else 0)
+        
+        return mapping
+    
+    def _diarize_windowed(self, audio_path: str, duration: float) -> Optional[Dict[str, Any]]:
+        """
+        Diarização local por janelas fixas sobrepostas, para faixas longas.
+        
+        Cada janela é decodificada e diarizada isoladamente (memória limitada
+        pelo tamanho da janela). Os speakers de janelas diferentes são unidos
+        pelos embeddings, e cada janela só contribui com os turnos do seu
+        trecho central, cortando a sobreposição ao meio.
+        
+        Args:
+            audio_path: Caminho para o arquivo de áudio
+            duration: Duração total em segundos
+            
+        Returns:
+            Resultado da diarização local
+        """
+        step = self.window_seconds - self.window_overlap
+        offsets = [i * step for i in range(int(np.ceil(max(duration - self.window_overlap, 0) / step)))]
+        half = self.window_overlap / 2
+        
+        logger.info(
+            f"🪟 Diarização por janelas: {len(offsets)} janelas de {self.window_seconds:.0f}s "
+            f"(sobreposição {self.window_overlap:.0f}s, {self.window_workers} em paralelo)"
+        )
+        
+        with ThreadPoolExecutor(max_workers=self.window_workers, thread_name_prefix="diarize") as executor:
+            results = list(executor.map(
+                lambda offset: self._diarize_window(audio_path, offset, self.window_seconds),
+                offsets
+            ))
+        
+        centroids: List[np.ndarray] = []
+        counts: List[int] = []
+        turns: List[Tuple[float, float, str]] = []
+        
+        for k, (offset, (window_turns, labels, embeddings)) in enumerate(zip(offsets, results)):
+            mapping = self._link_speakers(labels, embeddings, centroids, counts)
+            
+            # Trecho central desta janela
+            core_start = 0.0 if k == 0 else offset + half
+            core_end = duration if k == len(offsets) - 1 else offset + self.window_seconds - half
+            
+            for start, end, speaker in window_turns:
+                start, end = max(start, core_start), min(end, core_end)
+                if end > start:
+                    turns.append((start, end, f"SPEAKER_{mapping[speaker]:02d}"))
+        
+        segments = DiarizationSegments.from_turns(turns)
+        
+        logger.info(f"🎤 Local (janelas) detectou {segments.num_speakers} speakers em {segments.total_duration:.1f}s")
+        
+        return {
+            'num_speakers': segments.num_speakers,
+            'segments': segments,
+            'total_duration': segments.total_duration,
+            'method': 'local_windowed'
+        }
+    
     def is_available(self) -> bool:
         """Verifica se algum método de diarização está disponível."""
         return (self.pyannote_api_key is not None) or (PYANNOTE_AVAILABLE and self.pipeline is not None)
@@ -365,78 +546,109 @@ class VocalDiarizer:
         logger.error("❌ Todos os métodos de diarização falharam")
         return None
     
-    def segment_vocals(self, vocal_path: str, diarization_result: Dict[str, Any], output_dir: str) -> List[str]:
+    def segment_vocals(self, vocal_path: str, diarization_result: Dict[str, Any], output_dir: str,
+                       overlap_mode: str = "duplicate", max_workers: Optional[int] = None,
+                       block_seconds: float = 10.0) -> List[str]:
         """
         Segmenta o áudio vocal em faixas individuais por artista.
         
+        As máscaras têm precisão de amostra na taxa original do arquivo e são
+        aplicadas por blocos. Em cada bloco, a escrita de cada artista roda em
+        paralelo (numpy e libsndfile liberam o GIL). As faixas são escritas em
+        staging e `output_dir` só aparece, completo, ao final.
+        
         Args:
             vocal_path: Caminho para o arquivo vocal original
             diarization_result: Resultado da diarização
             output_dir: Diretório de saída para os arquivos segmentados
+            overlap_mode: Tratamento de vozes sobrepostas ("duplicate" ou "soft")
+            max_workers: Número máximo de threads (padrão: um por artista, até o nº de CPUs)
+            block_seconds: Duração de cada bloco processado
             
         Returns:
             Lista de caminhos para os arquivos de cada artista
         """
-        if not diarization_result or 'speakers' not in diarization_result:
+        segments = as_segments(diarization_result)
+        if segments is None:
             logger.error("Resultado de diarização inválido")
             return []
         
         try:
-            logger.info(f"Iniciando segmentação vocal em {output_dir}")
-            
-            # Criar diretório de saída
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Carregar áudio original
-            audio = AudioSegment.from_wav(vocal_path)
-            output_paths = []
-            
-            # Processar cada cantor
-            speakers = diarization_result['speakers']
-            for speaker_id, segments in speakers.items():
-                logger.info(f"Processando {speaker_id} com {len(segments)} segmentos")
+            logger.info(f"Iniciando segmentação vocal em {output_dir} (sobreposição: {overlap_mode})")
+            
+            # Carregar áudio original uma única vez (buffer compartilhado entre as threads)
+            subtype = sf.info(vocal_path).subtype
+            audio, sr = sf.read(vocal_path, dtype='float32', always_2d=True)
+            audio.setflags(write=False)
+            
+            if segments.num_speakers == 0:
+                return []
+            
+            num_samples = audio.shape[0]
+            block_size = max(1, int(block_seconds * sr))
+            engine = SpeakerMaskEngine(segments, sr, num_samples, overlap_mode)
+            if overlap_mode == "soft":
+                weights = engine.estimate_weights(audio, block_size)
+                logger.info(f"Pesos por energia: {dict(zip(segments.labels, weights.round(4).tolist()))}")
+            
+            output_paths = [os.path.join(output_dir, f"{speaker_id}.wav") for speaker_id in segments.labels]
+            counts = np.bincount(segments.speakers, minlength=segments.num_speakers)
+            for speaker_id, n in zip(segments.labels, counts.tolist()):
+                logger.info(f"Processando {speaker_id} com {n} segmentos")
+            
+            workers = max_workers or min(segments.num_speakers, os.cpu_count() or 1)
+            
+            # Escreve no staging e publica todas as faixas de uma vez
+            with staged_output(output_dir) as staging_dir:
+                writers = [
+                    sf.SoundFile(os.path.join(staging_dir, os.path.basename(path)), 'w',
+                                 samplerate=sr, channels=audio.shape[1], subtype=subtype)
+                    for path in output_paths
+                ]
                 
-                # Criar áudio vazio para este cantor
-                artist_audio = AudioSegment.silent(duration=len(audio))
-                
-                # Adicionar todos os segmentos deste cantor
-                for segment in segments:
-                    start_ms = int(segment['start'] * 1000)
-                    end_ms = int(segment['end'] * 1000)
-                    
-                    # Verificar limites
-                    if start_ms < len(audio) and end_ms <= len(audio):
-                        # Extrair segmento e sobrepor no áudio do artista
-                        segment_audio = audio[start_ms:end_ms]
-                        artist_audio = artist_audio.overlay(segment_audio, position=start_ms)
-                
-                # Salvar arquivo do artista
-                output_path = os.path.join(output_dir, f"{speaker_id}.wav")
-                artist_audio.export(output_path, format="wav")
-                output_paths.append(output_path)
+                def write_block(speaker: int, block: np.ndarray, gains: np.ndarray):
+                    writers[speaker].write(block * gains[speaker][:, None])
                 
+                try:
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as executor:
+                        for b0 in range(0, num_samples, block_size):
+                            b1 = min(b0 + block_size, num_samples)
+                            block = audio[b0:b1]
+                            gains = engine.gains(b0, b1)
+                            # Barreira por bloco: mantém a ordem das amostras em cada arquivo
+                            list(executor.map(
+                                write_block, range(segments.num_speakers),
+                                [block] * segments.num_speakers, [gains] * segments.num_speakers
+                            ))
+                finally:
+                    for writer in writers:
+                        writer.close()
+            
+            for output_path in output_paths:
                 logger.info(f"Arquivo salvo: {output_path}")
             
-            logger.info(f"Segmentação concluída. {len(output_paths)} arquivos gerados")
+            logger.info(f"Segmentação concluída. {len(output_paths)} arquivos gerados ({workers} threads)")
             return output_paths
             
         except Exception as e:
             logger.error(f"Erro na segmentação: {e}", exc_info=True)
             return []
 
-def create_diarizer(huggingface_token: str, pyannote_api_key: Optional[str] = None) -> Optional[VocalDiarizer]:
+def create_diarizer(huggingface_token: str, pyannote_api_key: Optional[str] = None,
+                    **kwargs) -> Optional[VocalDiarizer]:
     """
     Factory function para criar uma instância do diarizador.
     
     Args:
         huggingface_token: Token do Hugging Face
         pyannote_api_key: API key da pyannoteAI (opcional)
+        **kwargs: Opções adicionais do VocalDiarizer (ex: window_seconds)
         
     Returns:
         Instância do VocalDiarizer ou None se falhar
     """
     try:
-        return VocalDiarizer(huggingface_token, pyannote_api_key)
+        return VocalDiarizer(huggingface_token, pyannote_api_key, **kwargs)
     except Exception as e:
         logger.error(f"Erro ao criar diarizador: {e}")
         return None 
\ No newline at end of file
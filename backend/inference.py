@@ -0,0 +1,264 @@
+# Chunked inference helpers shared by the separation backends
+import sys
+import time
+import logging
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Valores aceitos em CPU_BF16
+CPU_BF16_SETTINGS = ("auto", "true", "false")
+
+# SNR mínimo (dB) do caminho bf16 em relação ao fp32 na checagem de qualidade
+BF16_MIN_SNR_DB = 30.0
+
+# Tamanho do bloco (amostras) usado na normalização das saídas acumuladas
+_NORMALIZE_BLOCK = 1 << 20
+
+
+def cpu_bf16_supported() -> bool:
+    """
+    Verifica se a CPU tem bf16 nativo (AVX512-BF16 ou AMX).
+
+    Sem suporte nativo o oneDNN emula bf16 e fica mais lento que fp32,
+    então só os flags de hardware contam.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    return bool(flags & {"avx512_bf16", "amx_bf16"})
+    except OSError:
+        pass
+    return False
+
+
+def resolve_cpu_bf16(setting: str) -> bool:
+    """
+    Decide se o caminho bf16 em CPU deve ser usado.
+
+    Args:
+        setting: "auto" (usa se o hardware suportar), "true" ou "false"
+    """
+    if setting == "false":
+        return False
+    supported = cpu_bf16_supported()
+    if setting == "true" and not supported:
+        logger.warning("⚠️ CPU_BF16=true mas a CPU não tem bf16 nativo - desempenho pode piorar")
+        return True
+    return supported
+
+
+def overlap_add(run_chunk: Callable[[torch.Tensor], torch.Tensor], mix: torch.Tensor, num_sources: int,
+                segment_length: int, overlap: float = 0.25, transition_power: float = 1.0,
+                accum_dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """
+    Aplica um modelo em trechos sobrepostos e junta com janela triangular (como apply_model).
+
+    Args:
+        run_chunk: Função que recebe [B, C, L] (L <= segment_length) e retorna [B, S, C, L]
+        mix: Mistura [B, C, T]
+        num_sources: Número de fontes do modelo
+        segment_length: Tamanho de cada trecho em amostras
+        overlap: Fração de sobreposição entre trechos
+        transition_power: Expoente da janela triangular
+        accum_dtype: Tipo do buffer de acumulação (ex: bfloat16 para economizar memória)
+
+    Returns:
+        Saída normalizada [B, S, C, T] em accum_dtype
+    """
+    batch, channels, length = mix.shape
+    stride = int((1 - overlap) * segment_length)
+
+    out = torch.zeros(batch, num_sources, channels, length, dtype=accum_dtype)
+    sum_weight = torch.zeros(length)
+    weight = torch.cat([torch.arange(1, segment_length // 2 + 1),
+                        torch.arange(segment_length - segment_length // 2, 0, -1)]).float()
+    weight = (weight / weight.max()) ** transition_power
+
+    for offset in range(0, length, stride):
+        chunk = mix[..., offset:offset + segment_length]
+        chunk_length = chunk.shape[-1]
+        chunk_out = run_chunk(chunk.contiguous())[..., :chunk_length]
+        out[..., offset:offset + chunk_length] += (weight[:chunk_length] * chunk_out.float()).to(accum_dtype)
+        sum_weight[offset:offset + chunk_length] += weight[:chunk_length]
+
+    # Normalização em fp32, por blocos, para não criar uma cópia fp32 inteira
+    for b0 in range(0, length, _NORMALIZE_BLOCK):
+        b1 = min(b0 + _NORMALIZE_BLOCK, length)
+        out[..., b0:b1] = (out[..., b0:b1].float() / sum_weight[b0:b1]).to(accum_dtype)
+    return out
+
+
+def bag_members_for(bag, sources: Iterable[str]) -> Optional[List[int]]:
+    """
+    Membros de um bag necessários para produzir as fontes pedidas.
+
+    Bags como o htdemucs_ft têm um modelo ajustado por fonte (pesos one-hot),
+    então só os membros com peso não nulo em alguma fonte pedida precisam rodar.
+
+    Args:
+        bag: Modelo Demucs (bag ou modelo único)
+        sources: Fontes necessárias
+
+    Returns:
+        Índices dos membros necessários, ou None se todos forem necessários
+    """
+    weights = getattr(bag, "weights", None)
+    if weights is None:
+        return None
+    wanted = [bag.sources.index(name) for name in sources]
+    members = [i for i, w in enumerate(weights) if any(w[k] for k in wanted)]
+    return None if len(members) == len(weights) else members
+
+
+def apply_bag(run_model: Callable[[int, torch.Tensor], torch.Tensor], weights: Sequence[Sequence[float]],
+              num_sources: int, mix: torch.Tensor, accum_dtype: torch.dtype = torch.float32,
+              members: Optional[Sequence[int]] = None) -> torch.Tensor:
+    """
+    Combina as saídas dos sub-modelos de um bag com os pesos por fonte.
+
+    Args:
+        run_model: Função (índice do sub-modelo, mistura) -> [B, S, C, T]
+        weights: Pesos por sub-modelo e fonte (bag.weights)
+        num_sources: Número de fontes
+        mix: Mistura [B, C, T]
+        accum_dtype: Tipo do buffer de acumulação
+        members: Índices dos sub-modelos a executar (None = todos); fontes
+            sem nenhum membro executado ficam zeradas
+
+    Returns:
+        Estimativas [B, S, C, T] em float32
+    """
+    estimates = None
+    totals: List[float] = [0.0] * num_sources
+    for index in (range(len(weights)) if members is None else members):
+        out = run_model(index, mix)
+        if estimates is None:
+            estimates = torch.zeros(out.shape, dtype=accum_dtype, device=out.device)
+        for k, inst_weight in enumerate(weights[index]):
+            if inst_weight:
+                estimates[:, k] += (out[:, k].float() * inst_weight).to(accum_dtype)
+            totals[k] += inst_weight
+        del out
+
+    # Única conversão para fp32: normalização final
+    result = estimates.float()
+    del estimates
+    for k in range(num_sources):
+        if totals[k]:
+            result[:, k] /= totals[k]
+    return result
+
+
+def apply_model_members(bag, mix: torch.Tensor, members: Sequence[int], device: torch.device) -> torch.Tensor:
+    """
+    apply_model do Demucs restrito a alguns membros do bag.
+
+    Returns:
+        Estimativas [B, S, C, T] em float32 (fontes não calculadas zeradas)
+    """
+    from demucs.apply import apply_model
+
+    def run_model(index: int, x: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            with torch.cuda.amp.autocast(enabled=device.type == 'cuda', dtype=torch.float16):
+                return apply_model(bag.models[index], x, device=device, progress=False, num_workers=0)
+
+    return apply_bag(run_model, bag.weights, len(bag.sources), mix, members=members)
+
+
+def apply_model_bf16(bag, mix: torch.Tensor, overlap: float = 0.25,
+                     members: Optional[Sequence[int]] = None) -> torch.Tensor:
+    """
+    Separação em CPU com autocast bf16 e acumulação em bf16.
+
+    Args:
+        bag: Modelo Demucs (bag ou modelo único)
+        mix: Mistura [B, C, T] em CPU
+        members: Índices dos sub-modelos a executar (None = todos)
+
+    Returns:
+        Estimativas [B, S, C, T] em float32
+    """
+    from demucs.apply import apply_model
+
+    sub_models = list(getattr(bag, "models", [bag]))
+    weights = getattr(bag, "weights", [[1.0] * len(bag.sources)])
+
+    def run_model(index: int, x: torch.Tensor) -> torch.Tensor:
+        sub_model = sub_models[index]
+        segment_length = int(sub_model.segment * sub_model.samplerate)
+
+        def run_chunk(chunk: torch.Tensor) -> torch.Tensor:
+            with torch.no_grad(), torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                # split=False: o apply_model só faz o padding para o tamanho válido e o corte
+                return apply_model(sub_model, chunk, shifts=0, split=False, device="cpu")
+
+        return overlap_add(run_chunk, x, len(bag.sources), segment_length,
+                           overlap=overlap, accum_dtype=torch.bfloat16)
+
+    return apply_bag(run_model, weights, len(bag.sources), mix, accum_dtype=torch.bfloat16, members=members)
+
+
+def bf16_quality_check(audio_path: str, model_name: str = "htdemucs_ft", seconds: float = 20.0) -> dict:
+    """
+    Regressão de qualidade: compara bf16 com fp32 no mesmo trecho (SNR por stem).
+    """
+    import torchaudio
+    from demucs.apply import apply_model
+    from demucs.pretrained import get_model
+
+    bag = get_model(model_name).cpu().eval()
+    wav, sr = torchaudio.load(audio_path)
+    if sr != bag.samplerate:
+        wav = torchaudio.transforms.Resample(sr, bag.samplerate)(wav)
+    if wav.shape[0] != bag.audio_channels:
+        wav = wav.mean(dim=0, keepdim=True).expand(bag.audio_channels, -1)
+    mix = wav[:, :int(seconds * bag.samplerate)].unsqueeze(0).contiguous()
+
+    t0 = time.time()
+    with torch.no_grad():
+        reference = apply_model(bag, mix, shifts=0, progress=False, num_workers=0)
+    t_fp32 = time.time() - t0
+
+    t0 = time.time()
+    estimate = apply_model_bf16(bag, mix)
+    t_bf16 = time.time() - t0
+
+    snr = {}
+    for k, name in enumerate(bag.sources):
+        noise = (reference[:, k] - estimate[:, k]).pow(2).sum()
+        power = reference[:, k].pow(2).sum()
+        snr[name] = round(float(10 * torch.log10(power / noise.clamp(min=1e-12))), 2)
+
+    return {
+        "model": model_name,
+        "bf16_native": cpu_bf16_supported(),
+        "fp32_seconds": round(t_fp32, 3),
+        "bf16_seconds": round(t_bf16, 3),
+        "snr_db": snr,
+        "passed": min(snr.values()) >= BF16_MIN_SNR_DB,
+    }
+
+
+if __name__ == "__main__":
+    # Uso: python inference.py <audio> [modelo] [segundos]
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) < 2:
+        print("Uso: python inference.py <audio> [modelo] [segundos]")
+        sys.exit(1)
+
+    result = bf16_quality_check(
+        sys.argv[1],
+        sys.argv[2] if len(sys.argv) > 2 else "htdemucs_ft",
+        float(sys.argv[3]) if len(sys.argv) > 3 else 20.0,
+    )
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["passed"] else 1)
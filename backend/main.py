@@ -1,17 +1,27 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+# Perfil de import e de cold start: instalado antes de qualquer outro import
+from startup_profile import startup_profile
+startup_profile.install()
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 import os
+import hmac
+import math
+import asyncio
 import shutil
-from typing import List, Optional
+import tarfile
+import tempfile
+import threading
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 import logging
 import traceback
 import torch
-from demucs import pretrained
 from datetime import datetime
+from starlette.background import BackgroundTask
 from starlette.concurrency import run_in_threadpool
 
 # Import security configurations
@@ -42,8 +52,23 @@ if torch.cuda.is_available():
     if hasattr(torch.cuda, 'set_per_process_memory_fraction'):
         torch.cuda.set_per_process_memory_fraction(0.9)  # Usar 90% da GPU
     
-from process import separate_audio
+from process import BEST_MODEL_NAME, EXTRA_MODEL_NAME, select_model, load_separation_model, member_fraction
+from decoder import SUPPORTED_CONTENT_TYPES, SUPPORTED_EXTENSIONS, decode_audio
+from probe_index import ProbeIndex
+from singleflight import SingleFlight, flight_key
+from remix import REMIX_FORMATS, RemixCache, job_stems, parse_gains, remix_key, stream_remix
+from cost_limiter import create_cost_limiter, parse_model_costs
+from batch import BatchManager, copy_limited, is_archive, iter_archive_members
 from diarization import create_diarizer
+from inference import resolve_cpu_bf16
+from scheduler import InferenceScheduler
+from pipeline import SeparationPipeline
+from cluster import ClusterCoordinator
+from monitor import ResourceSampler, readiness
+from profiling import PROFILE_HEADER, ProfileSession, should_profile
+from storage import StorageManager, TrackedStaticFiles
+from staging import STAGING_PREFIX, new_job_id, job_dir_name, staged_output
+startup_profile.mark("imports")
 
 # --- Configurar Logging ---
 logging.basicConfig(
@@ -60,6 +85,12 @@ logger = logging.getLogger(__name__)
 
 logger.info(f"🚀 Sistema iniciando com PyTorch {torch.__version__}")
 logger.info(f"🎮 Device: {device}")
+
+# Mixed precision bf16 em CPU (somente com suporte nativo, salvo CPU_BF16=true;
+# não se combina com os presets quantizados)
+cpu_bf16 = device.type == "cpu" and config.INFERENCE_PRESET == "fp32" and resolve_cpu_bf16(config.CPU_BF16)
+if cpu_bf16:
+    logger.info("⚡ Autocast bf16 habilitado em CPU")
 if torch.cuda.is_available():
     logger.info(f"🔥 GPU: {torch.cuda.get_device_name(0)}")
     logger.info(f"⚡ CUDNN Benchmark: {torch.backends.cudnn.benchmark}")
@@ -68,6 +99,81 @@ if torch.cuda.is_available():
 models_store = {}
 diarizer = None
 
+# Partição de núcleos entre requisições concorrentes (evita oversubscription do PyTorch)
+inference_scheduler = InferenceScheduler(
+    total_cores=config.SCHEDULER_CORES,
+    min_cores=config.SCHEDULER_MIN_CORES,
+    pin_affinity=config.SCHEDULER_PIN_AFFINITY
+)
+
+# Orçamento de disco para uploads (um arquivo por job) e stems (um diretório por job)
+storage_manager = StorageManager(
+    roots=[(config.UPLOAD_DIR, 1), (config.OUTPUT_DIR, 2), (config.PROFILE_DIR, 1)],
+    budget_bytes=config.STORAGE_MAX_BYTES,
+    ttl_seconds=config.STORAGE_TTL_HOURS * 3600,
+    scan_interval=config.STORAGE_SCAN_INTERVAL
+)
+
+# Execução das separações em três estágios (decode, inferência, escrita) com filas limitadas;
+# no modo coordenador, a API só enfileira e os workers (worker.py) executam
+cluster_mode = config.CLUSTER_MODE == "coordinator"
+separation_pipeline = ClusterCoordinator(
+    config.CLUSTER_QUEUE_DIR, config.UPLOAD_DIR, config.OUTPUT_DIR,
+    node=config.CLUSTER_NODE,
+    worker_timeout=config.CLUSTER_WORKER_TIMEOUT,
+    job_timeout=config.CLUSTER_JOB_TIMEOUT
+) if cluster_mode else SeparationPipeline(
+    models_store, device, config.OUTPUT_DIR, inference_scheduler,
+    cpu_bf16=cpu_bf16,
+    residual_other=config.RESIDUAL_OTHER,
+    stem_format=config.STEM_FORMAT,
+    stem_dither=config.STEM_DITHER,
+    queue_depth=config.PIPELINE_QUEUE_DEPTH,
+    decode_workers=config.PIPELINE_DECODE_WORKERS,
+    infer_workers=config.PIPELINE_INFER_WORKERS,
+    encode_workers=config.PIPELINE_ENCODE_WORKERS
+)
+
+# Snapshot periódico de recursos para /health, /readyz e /status (os endpoints só leem)
+resource_sampler = ResourceSampler(
+    interval=config.SAMPLER_INTERVAL,
+    disk_paths={"upload": config.UPLOAD_DIR, "output": config.OUTPUT_DIR},
+    probes={
+        "models": lambda: separation_pipeline.warm_models() if cluster_mode else list(models_store.keys()),
+        "diarization": lambda: bool(diarizer and diarizer.is_available()),
+        "pipeline_queued": lambda: separation_pipeline.stats()["queued"],
+        "scheduler_waiting": lambda: inference_scheduler.stats()["waiting_jobs"],
+    }
+)
+
+# Lotes de faixas (álbuns): manifesto por lote, decode da próxima faixa sobreposto à inferência
+batch_manager = BatchManager(
+    config.OUTPUT_DIR, config.UPLOAD_DIR,
+    max_concurrent=config.BATCH_CONCURRENCY,
+    max_in_flight=config.PIPELINE_QUEUE_DEPTH
+)
+
+# Probes de cabeçalho persistentes: validação, custo e agendamento sem decode
+probe_index = ProbeIndex(config.PROBE_INDEX_PATH)
+
+# Uploads idênticos em processamento simultâneo compartilham o job do primeiro (líder)
+single_flight = SingleFlight() if config.SINGLE_FLIGHT else None
+
+# Mixdowns de stems já separados (GET /remix), com cache dos parâmetros repetidos
+remix_cache = RemixCache(os.path.join(config.OUTPUT_DIR, "remix"), max_files=config.REMIX_CACHE_MAX_FILES)
+
+# Rate limiting por custo (segundos de áudio x modelo), buckets por cliente e global
+cost_limiter = None if config.RATE_LIMIT_BACKEND == "off" else create_cost_limiter(
+    config.RATE_LIMIT_BACKEND, config.RATE_LIMIT_REDIS_URL,
+    fail_open=config.RATE_LIMIT_FAIL_OPEN,
+    client_capacity=config.RATE_CLIENT_CAPACITY,
+    client_refill=config.RATE_CLIENT_REFILL,
+    global_capacity=config.RATE_GLOBAL_CAPACITY,
+    global_refill=config.RATE_GLOBAL_REFILL,
+    model_costs=parse_model_costs(config.RATE_MODEL_COSTS),
+    diarization_cost=config.RATE_DIARIZATION_COST
+)
+
 app = FastAPI(
     title="Stemuc Audio Forge API",
     description="Sistema de separação de áudio com diarização de vozes - FUNCIONAL!",
@@ -94,31 +200,46 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
+def start_background_services():
+    # Modelos e diarizador carregam em segundo plano: /livez responde desde já e
+    # /readyz fica 503 até os modelos estarem prontos
+    storage_manager.start()
+    separation_pipeline.start()
+    resource_sampler.start()
+    threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+    startup_profile.mark("server")
+
 def load_models():
     global diarizer
     
     logger.info("🔄 Iniciando carregamento dos modelos...")
     
     try:
-        # Carregar o BEST_MODEL (htdemucs_ft) para 4 stems
-        logger.info("📥 Carregando htdemucs_ft...")
-        models_store["htdemucs_ft"] = pretrained.get_model("htdemucs_ft").to(device).eval()
-        logger.info(f"✅ Modelo htdemucs_ft carregado em {device}")
-        
-        # Carregar o EXTRA_MODEL (htdemucs_6s) para 6 stems / custom
-        logger.info("📥 Carregando htdemucs_6s...")
-        models_store["htdemucs_6s"] = pretrained.get_model("htdemucs_6s").to(device).eval()
-        logger.info(f"✅ Modelo htdemucs_6s carregado em {device}")
+        # BEST_MODEL (htdemucs_ft) para 2/4 stems e EXTRA_MODEL (htdemucs_6s) para 6 stems / custom;
+        # no modo coordenador os modelos ficam nos workers (worker.py)
+        for name in () if cluster_mode else (BEST_MODEL_NAME, EXTRA_MODEL_NAME):
+            models_store[name] = load_separation_model(
+                name, device,
+                inference_preset=config.INFERENCE_PRESET,
+                inference_backend=config.INFERENCE_BACKEND,
+                calibration_file=config.QUANTIZATION_CALIBRATION_FILE,
+                onnx_cache_dir=config.ONNX_CACHE_DIR,
+                onnx_threads=config.ONNX_THREADS
+            )
 
     except Exception as e:
         logger.error(f"❌ Erro ao carregar modelos Demucs: {e}", exc_info=True)
+    startup_profile.mark("models")
     
     # Inicializar diarizador
     try:
         logger.info("🎤 Inicializando diarizador de vozes...")
         diarizer = create_diarizer(
             huggingface_token=config.HUGGINGFACE_TOKEN,
-            pyannote_api_key=config.PYANNOTE_API_KEY
+            pyannote_api_key=config.PYANNOTE_API_KEY,
+            window_seconds=config.DIARIZATION_WINDOW_SECONDS,
+            window_overlap=config.DIARIZATION_WINDOW_OVERLAP,
+            window_workers=config.DIARIZATION_WINDOW_WORKERS
         )
         
         if diarizer and diarizer.is_available():
@@ -132,11 +253,17 @@ def load_models():
     except Exception as e:
         logger.error(f"❌ Erro ao carregar diarizador: {e}", exc_info=True)
     
+    # Readiness reflete os modelos sem esperar o próximo ciclo do sampler
+    resource_sampler.sample()
+    startup_profile.mark("ready")
+    startup_profile.log_report(budget_seconds=config.STARTUP_BUDGET_SECONDS)
+    
     logger.info("🎉 Sistema totalmente carregado e pronto!")
 
 # --- Static File Serving ---
-app.mount("/stems", StaticFiles(directory=config.OUTPUT_DIR), name="stems")
-app.mount("/original_audio", StaticFiles(directory=config.UPLOAD_DIR), name="original_audio")
+# Arquivos sendo servidos ficam fixados no storage manager e não são removidos
+app.mount("/stems", TrackedStaticFiles(directory=config.OUTPUT_DIR, storage=storage_manager), name="stems")
+app.mount("/original_audio", TrackedStaticFiles(directory=config.UPLOAD_DIR, storage=storage_manager), name="original_audio")
 
 # CORS configuration for production
 ALLOWED_ORIGINS = [
@@ -174,40 +301,57 @@ def has_vocals(mode: str, selected_stems: Optional[List[str]]) -> bool:
         return "vocals" in selected_stems
     return False
 
+# Sondas de saúde nunca passam pelo rate limiter
+_rate_limit_exempt = limiter.exempt if SECURITY_AVAILABLE and limiter else (lambda f: f)
+
+def _readiness():
+    return readiness(
+        resource_sampler.snapshot,
+        required_models=[BEST_MODEL_NAME, EXTRA_MODEL_NAME],
+        require_diarization=config.READY_REQUIRE_DIARIZATION,
+        min_disk_bytes=config.READY_MIN_DISK_MB * 1024**2,
+        max_age=3 * config.SAMPLER_INTERVAL,
+        age=resource_sampler.age()
+    )
+
+@app.get("/livez")
+@_rate_limit_exempt
+async def livez():
+    """Liveness: o processo responde (sem nenhum trabalho)."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+@_rate_limit_exempt
+async def readyz():
+    """Readiness: modelos carregados, diarizador (se exigido) e disco, a partir do último snapshot."""
+    state = _readiness()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
 @app.get("/health")
+@_rate_limit_exempt
 async def health_check():
-    """Endpoint de verificação de saúde do sistema."""
-    import shutil
-    
-    gpu_info = None
-    if torch.cuda.is_available():
-        gpu_info = {
-            "name": torch.cuda.get_device_name(0),
-            "memory_total": torch.cuda.get_device_properties(0).total_memory,
-            "memory_allocated": torch.cuda.memory_allocated(0),
-            "memory_cached": torch.cuda.memory_reserved(0)
-        }
-    
-    # Verificar espaço em disco
-    disk_usage = shutil.disk_usage("/tmp")
-    disk_free_gb = round(disk_usage.free / (1024**3), 2)
+    """Endpoint de verificação de saúde do sistema (lê o snapshot do sampler)."""
+    snapshot = resource_sampler.snapshot
+    state = _readiness()
+    disk = snapshot.get("disk", {}).get("output", {})
     
     return {
-        "status": "healthy",
+        "status": "healthy" if state["ready"] else "degraded",
         "timestamp": datetime.now().isoformat(),
-        "message": "🎉 Sistema funcionando 100%!",
-        "diarization_available": diarizer.is_available() if diarizer else False,
+        "sampled_at": snapshot.get("sampled_at"),
+        "diarization_available": bool(snapshot.get("diarization")),
         "pyannote_api_configured": config.has_pyannote_api,
         "huggingface_token_configured": config.has_huggingface_token,
         "device": str(device),
         "pytorch_version": torch.__version__,
         "cuda_available": torch.cuda.is_available(),
-        "gpu_info": gpu_info,
-        "models_loaded": list(models_store.keys()),
-        "demucs_ready": len(models_store) > 0,
-        "disk_free_gb": disk_free_gb,
+        "gpu_info": snapshot.get("gpu"),
+        "models_loaded": snapshot.get("models", []),
+        "demucs_ready": not any(r.startswith("modelos") for r in state["reasons"]),
+        "disk_free_gb": round(disk["free_bytes"] / 1024**3, 2) if "free_bytes" in disk else None,
         "security_enabled": SECURITY_AVAILABLE,
-        "full_system_status": "🟢 FULLY OPERATIONAL"
+        "not_ready_reasons": state["reasons"],
+        "full_system_status": "🟢 FULLY OPERATIONAL" if state["ready"] else "🟡 NOT READY"
     }
 
 @app.get("/status")
@@ -219,6 +363,9 @@ async def system_status():
     except ImportError:
         cache_info = {"cache": "not_available"}
     
+    # sqlite: fora do event loop
+    probe_stats = await run_in_threadpool(probe_index.stats)
+    
     return {
         "system": {
             "uptime": "running",
@@ -229,6 +376,12 @@ async def system_status():
             "loaded": list(models_store.keys()),
             "cache_info": cache_info
         },
+        "startup": startup_profile.report(top=10, budget_seconds=config.STARTUP_BUDGET_SECONDS),
+        "scheduler": inference_scheduler.stats(),
+        "storage": storage_manager.usage(),
+        "probe_index": probe_stats,
+        "pipeline": separation_pipeline.stats(),
+        "single_flight": single_flight.stats() if single_flight else None,
         "services": {
             "diarization": diarizer.is_available() if diarizer else False,
             "pyannote_api": config.has_pyannote_api,
@@ -241,6 +394,29 @@ async def system_status():
         }
     }
 
+def _check_profile_token(request: Request):
+    token = request.headers.get(PROFILE_HEADER) or ""
+    if not config.PROFILE_ADMIN_TOKEN or not hmac.compare_digest(token, config.PROFILE_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Token de profiling inválido.")
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Resumo de um profile: operadores com maior self-time por estágio."""
+    _check_profile_token(request)
+    path = os.path.join(config.PROFILE_DIR, os.path.basename(profile_id), "summary.json")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Profile não encontrado: {profile_id}")
+    return FileResponse(path, media_type="application/json")
+
+@app.get("/profiles/{profile_id}/{artifact}")
+async def get_profile_artifact(profile_id: str, artifact: str, request: Request):
+    """Trace Chrome (`<estágio>.trace.json`) ou tabela de operadores (`<estágio>.top_ops.txt`)."""
+    _check_profile_token(request)
+    path = os.path.join(config.PROFILE_DIR, os.path.basename(profile_id), os.path.basename(artifact))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Artefato não encontrado: {artifact}")
+    return FileResponse(path, filename=os.path.basename(path))
+
 @app.get("/")
 async def root():
     """Endpoint raiz da API."""
@@ -252,6 +428,8 @@ async def root():
             "health": "/health",
             "status": "/status",
             "separate": "/separate",
+            "batch": "/separate/batch",
+            "remix": "/remix/{model}/{job}",
             "docs": "/docs" if os.getenv("NODE_ENV") != "production" else "disabled"
         }
     }
@@ -283,6 +461,184 @@ else:
     ):
         return await _separate_handler(request, file, mode, selectedStems, enable_diarization)
 
+# Lotes (álbuns/playlists): uma requisição, uma unidade no rate limit
+if SECURITY_AVAILABLE and limiter:
+    @app.post("/separate/batch", status_code=202)
+    @limiter.limit(rate_limit)
+    async def separate_batch(
+        request: Request,
+        files: List[UploadFile] = File(...),
+        mode: str = Form(...),
+        selectedStems: Optional[List[str]] = Form(None)
+    ):
+        return await _separate_batch_handler(request, files, mode, selectedStems)
+else:
+    @app.post("/separate/batch", status_code=202)
+    async def separate_batch(
+        request: Request,
+        files: List[UploadFile] = File(...),
+        mode: str = Form(...),
+        selectedStems: Optional[List[str]] = Form(None)
+    ):
+        return await _separate_batch_handler(request, files, mode, selectedStems)
+
+@app.get("/batch/{batch_id}")
+async def batch_status(batch_id: str):
+    """Manifesto de um lote, preenchido conforme as faixas terminam."""
+    manifest = batch_manager.get(batch_id) if batch_id.isalnum() else None
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Lote não encontrado: {batch_id}")
+    return manifest
+
+def _prepare_remix(job_dir: str, gains: Dict[str, float], start: float, end: Optional[float],
+                   fmt: str) -> Tuple[Optional[str], Optional[Any], Optional[int]]:
+    """
+    Lista os stems, valida os nomes e consulta o cache ou abre o mixdown (I/O de disco: threadpool).
+
+    Returns:
+        Tupla (arquivo em cache, ou None; iterador de bytes; tamanho total se conhecido)
+    """
+    stems = job_stems(job_dir)
+    if not stems:
+        raise HTTPException(status_code=404, detail=f"Job não encontrado: {os.path.relpath(job_dir, config.OUTPUT_DIR)}")
+    unknown = sorted(set(gains) - set(stems))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Stems inexistentes: {unknown}. Disponíveis: {sorted(stems)}")
+
+    key = remix_key(job_dir, stems, gains, start, end, fmt)
+    cached = remix_cache.get(key, fmt)
+    if cached:
+        storage_manager.touch(cached)
+        return cached, None, None
+    try:
+        chunks, length = stream_remix(
+            [(path, gains.get(name, 0.0)) for name, path in stems.items()],
+            fmt=fmt, start=start, end=end,
+            cache=remix_cache, cache_key=key,
+            mp3_bitrate=config.REMIX_MP3_BITRATE
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return None, chunks, length
+
+@app.get("/remix/{model_name}/{job_name}")
+async def remix(
+    model_name: str,
+    job_name: str,
+    gain: List[str] = Query([]),
+    mute: List[str] = Query([]),
+    start: float = 0.0,
+    end: Optional[float] = None,
+    format: str = "wav"
+):
+    """
+    Mixdown dos stems de um job já separado, sem rodar a separação de novo.
+
+    `gain=vocals:-6` ajusta um stem em dB (repetível), `mute=vocals` o remove;
+    `start`/`end` recortam o trecho em segundos. A saída é codificada enquanto
+    os stems são lidos em blocos; parâmetros idênticos vêm do cache.
+    """
+    if model_name not in (BEST_MODEL_NAME, EXTRA_MODEL_NAME, "artists") or job_name != os.path.basename(job_name):
+        raise HTTPException(status_code=404, detail=f"Job não encontrado: {model_name}/{job_name}")
+    if format not in REMIX_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {format}. Use {list(REMIX_FORMATS)}")
+    if start < 0 or (end is not None and end <= start):
+        raise HTTPException(status_code=400, detail="Intervalo inválido: use 0 <= start < end")
+    try:
+        gains = parse_gains(gain)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    gains.update({name: -math.inf for name in mute})
+
+    job_dir = os.path.join(config.OUTPUT_DIR, model_name, job_name)
+    filename = f"{job_name}-remix.{format}"
+    storage_manager.hold(job_dir)
+    try:
+        cached, chunks, length = await run_in_threadpool(_prepare_remix, job_dir, gains, start, end, format)
+    except Exception:
+        storage_manager.release(job_dir)
+        raise
+
+    if cached:
+        storage_manager.hold(cached)
+        storage_manager.release(job_dir)
+        return FileResponse(
+            cached, media_type=REMIX_FORMATS[format], filename=filename,
+            headers={"X-Remix-Cache": "hit"},
+            background=BackgroundTask(storage_manager.release, cached)
+        )
+
+    def body():
+        # Stems fixados até o fim da transmissão (ou desconexão do cliente)
+        try:
+            yield from chunks
+        finally:
+            storage_manager.release(job_dir)
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "X-Remix-Cache": "miss"}
+    if length is not None:
+        headers["Content-Length"] = str(length)
+    return StreamingResponse(body(), media_type=REMIX_FORMATS[format], headers=headers)
+
+def _job_paths(job_id: str, input_path: str) -> List[str]:
+    """Upload e possíveis diretórios de saída de um job (fixados no storage)."""
+    job_name = job_dir_name(os.path.splitext(os.path.basename(input_path))[0], job_id)
+    paths = [input_path, os.path.join(config.OUTPUT_DIR, "artists", job_name)]
+    return paths + [os.path.join(config.OUTPUT_DIR, name, job_name) for name in (BEST_MODEL_NAME, EXTRA_MODEL_NAME)]
+
+def _store_upload(input_path: str, stream, max_bytes: Optional[int] = None):
+    """Grava o upload em UPLOAD_DIR/<job_id>/ via staging (publicação atômica)."""
+    with staged_output(os.path.dirname(input_path)) as staging_dir:
+        with open(os.path.join(staging_dir, os.path.basename(input_path)), "wb") as buffer:
+            if max_bytes is None:
+                shutil.copyfileobj(stream, buffer)
+            else:
+                copy_limited(stream, buffer, max_bytes)
+    logger.info(f"💾 Arquivo salvo: {input_path}")
+
+def _probe_upload(input_path: str) -> Dict[str, Any]:
+    """
+    Cabeçalhos e hash do upload, validados antes de qualquer decode.
+
+    Uploads ganham sempre um caminho novo: o índice de probes é consultado
+    pelo hash do conteúdo (o mesmo usado pelo single-flight).
+    """
+    filename = os.path.basename(input_path)
+    try:
+        info = probe_index.probe_content(input_path)
+    except Exception as e:
+        logger.warning(f"❌ Probe falhou para {input_path}: {e}")
+        raise HTTPException(status_code=400, detail=f"Arquivo de áudio ilegível: {filename}")
+    if info["duration"] <= 0 or info["channels"] <= 0:
+        raise HTTPException(status_code=400, detail=f"Arquivo sem áudio: {filename}")
+    if config.MAX_AUDIO_SECONDS and info["duration"] > config.MAX_AUDIO_SECONDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Áudio muito longo ({info['duration'] / 60:.1f} min). Máximo: {config.MAX_AUDIO_SECONDS / 60:.1f} min."
+        )
+    return info
+
+def _charge_cost(request: Request, seconds: float, mode: str, diarization: bool = False,
+                 requested_stems: Optional[List[str]] = None):
+    """Debita o custo do áudio no rate limiter; HTTP 429 com Retry-After se não houver saldo."""
+    if cost_limiter is None:
+        return
+    # Só os membros do bag que rodam para o modo; no coordenador o modelo não está
+    # carregado aqui e o custo é o do bag inteiro
+    model_name = select_model(mode)
+    model = models_store.get(model_name)
+    fraction = member_fraction(model, mode, requested_stems, config.RESIDUAL_OTHER) if model is not None else 1.0
+    cost = cost_limiter.cost(seconds, model_name, diarization, fraction)
+    client_id = request.client.host if request.client else "unknown"
+    allowed, retry_after = cost_limiter.charge(client_id, cost)
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Limite de processamento excedido ({seconds:.0f}s de áudio). Tente novamente em {math.ceil(retry_after)}s.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    logger.info(f"🪙 Custo {cost:.0f} debitado de {client_id} ({seconds:.0f}s de áudio)")
+
 # Função principal de separação (sem rate limiting direto)
 async def _separate_handler(
     request: Request,
@@ -291,6 +647,8 @@ async def _separate_handler(
     selectedStems: Optional[List[str]],
     enable_diarization: bool
 ):
+    job_paths: List[str] = []
+    profile: Optional[ProfileSession] = None
     try:
         logger.info(f"🎵 Nova requisição: {file.filename}, modo: {mode}, diarização: {enable_diarization}")
         
@@ -303,10 +661,10 @@ async def _separate_handler(
                 logger.warning(f"❌ Validação de segurança falhou: {e}")
                 # Continue mesmo se a validação de segurança falhar
         
-        if file.content_type not in ["audio/mpeg", "audio/wav", "audio/mp3", "audio/flac", "audio/x-wav", "audio/x-mpeg"]:
+        if file.content_type not in SUPPORTED_CONTENT_TYPES:
             logger.warning(f"❌ Tipo de arquivo inválido: {file.content_type}")
             raise HTTPException(
-                status_code=400, detail=f"Tipo de arquivo inválido: {file.content_type}. Use MP3, WAV ou FLAC."
+                status_code=400, detail=f"Tipo de arquivo inválido: {file.content_type}. Use MP3, WAV, FLAC ou M4A."
             )
 
         if file.size > config.MAX_FILE_SIZE:
@@ -329,6 +687,10 @@ async def _separate_handler(
                 status_code=400, detail="Para modo 'custom', 'selectedStems' deve ser fornecido."
             )
 
+        # Modelos carregam em segundo plano após o boot
+        if not cluster_mode and select_model(mode) not in models_store:
+            raise HTTPException(status_code=503, detail="Modelos ainda carregando. Tente novamente em instantes.")
+
         # Validar diarização
         if enable_diarization:
             if not has_vocals(mode, selectedStems):
@@ -344,37 +706,77 @@ async def _separate_handler(
                 )
 
         # --- File Handling ---
+        # Cada job tem seu próprio namespace: uploads e saídas com o mesmo nome não colidem
+        job_id = new_job_id()
         safe_filename = os.path.basename(file.filename or "uploaded_audio")
-        input_path = os.path.join(config.UPLOAD_DIR, safe_filename)
+        input_path = os.path.join(config.UPLOAD_DIR, job_id, safe_filename)
+
+        # Upload e diretórios de saída deste job não podem ser removidos durante o processamento
+        job_name = job_dir_name(os.path.splitext(safe_filename)[0], job_id)
+        job_paths = _job_paths(job_id, input_path)
+        storage_manager.hold(*job_paths)
 
         try:
-            with open(input_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            logger.info(f"💾 Arquivo salvo: {input_path}")
+            _store_upload(input_path, file.file)
         except IOError as e:
              logger.error(f"❌ Falha ao salvar arquivo: {e}")
              raise HTTPException(status_code=500, detail=f"Falha ao salvar arquivo: {str(e)}")
         finally:
             await file.close()
 
+        # Probe (índice persistente), validação e custo antes de qualquer decode;
+        # se rejeitado aqui, o upload é descartado
+        try:
+            info = await run_in_threadpool(_probe_upload, input_path)
+            await run_in_threadpool(_charge_cost, request, info["duration"], mode, enable_diarization, selectedStems)
+        except HTTPException:
+            shutil.rmtree(os.path.dirname(input_path), ignore_errors=True)
+            raise
+
         # --- Separation Logic (Non-blocking with ThreadPool) ---
         separation_start = datetime.now()
-        logger.info(f"🔄 Iniciando separação com {device} (threadpool) - {separation_start}")
+        logger.info(f"🔄 Iniciando separação com {device} (pipeline) - {separation_start}")
         
         # Verificar memória GPU antes do processamento
         if torch.cuda.is_available():
             gpu_memory_before = torch.cuda.memory_allocated(0) / 1024**3
             logger.info(f"🎮 GPU Memory antes: {gpu_memory_before:.2f}GB")
         
-        output_paths = await run_in_threadpool(
-            separate_audio,
-            input_path=input_path, 
-            mode=mode, 
-            output_dir_base=config.OUTPUT_DIR,
-            requested_stems=selectedStems,
-            device=device,
-            models_store=models_store
-        )
+        # Profiling opcional (header de admin ou amostragem)
+        if should_profile(request.headers.get(PROFILE_HEADER), config.PROFILE_ADMIN_TOKEN, config.PROFILE_SAMPLE_RATE):
+            profile = ProfileSession(config.PROFILE_DIR, top_ops=config.PROFILE_TOP_OPS)
+            logger.info(f"🔬 Profiling ativo para esta requisição: {profile.profile_id}")
+        
+        # Pipeline decode -> infer -> encode (sobrepõe estágios de requisições diferentes)
+        def start_separation():
+            return separation_pipeline.submit(
+                input_path, mode, job_id=job_id, requested_stems=selectedStems, profile=profile, info=info
+            )
+
+        # Fora do event loop: no modo coordenador o submit grava o job no spool
+        if single_flight is not None:
+            key = flight_key(info["content_hash"], select_model(mode), mode, selectedStems)
+            flight, leader, leader_job = await run_in_threadpool(
+                single_flight.join, key, start_separation, (input_path, job_paths)
+            )
+        else:
+            flight, leader, leader_job = await run_in_threadpool(start_separation), True, None
+
+        if not leader:
+            # Mesmo áudio já em separação: a resposta aponta para o upload e os stems do líder
+            leader_input, leader_paths = leader_job
+            logger.info(f"🪢 Upload idêntico a um job em andamento; aguardando {os.path.basename(os.path.dirname(leader_input))}")
+            storage_manager.hold(*leader_paths)
+            job_paths = job_paths + leader_paths
+            shutil.rmtree(os.path.dirname(input_path), ignore_errors=True)
+            input_path = leader_input
+
+        # shield: um cliente desconectado não cancela o job compartilhado com os seguidores
+        try:
+            output_paths = await asyncio.shield(asyncio.wrap_future(flight))
+        except TimeoutError as e:
+            # Modo coordenador: job expirado (sem workers ativos ou acima de CLUSTER_JOB_TIMEOUT)
+            raise HTTPException(status_code=504, detail=str(e))
         
         # Log de performance da separação
         separation_end = datetime.now()
@@ -411,21 +813,23 @@ async def _separate_handler(
                 try:
                     # Aplicar diarização (non-blocking)
                     logger.info(f"🎤 Executando diarização em threadpool")
+                    diarize = profile.wrap("diarize", diarizer.diarize_vocals) if profile else diarizer.diarize_vocals
                     diarization_data = await run_in_threadpool(
-                        diarizer.diarize_vocals,
+                        inference_scheduler.run,
+                        diarize,
                         vocal_path
                     )
                     
                     if diarization_data and diarization_data.get('num_speakers', 0) > 1:
                         # Múltiplos cantores detectados
-                        base_name = os.path.splitext(os.path.basename(input_path))[0]
-                        artists_output_dir = os.path.join(config.OUTPUT_DIR, "artists", base_name)
+                        artists_output_dir = os.path.join(config.OUTPUT_DIR, "artists", job_name)
                         
                         artist_paths = await run_in_threadpool(
                             diarizer.segment_vocals,
                             vocal_path, 
                             diarization_data, 
-                            artists_output_dir
+                            artists_output_dir,
+                            overlap_mode=config.DIARIZATION_OVERLAP_MODE
                         )
                         
                         diarization_result = {
@@ -475,6 +879,9 @@ async def _separate_handler(
         if diarization_result:
             response["diarization"] = diarization_result
         
+        if profile:
+            response["profile_id"] = profile.profile_id
+        
         logger.info(f"✅ Separação concluída! Stems: {len(relative_output_paths)}")
         return response
 
@@ -484,6 +891,132 @@ async def _separate_handler(
     except Exception as e:
         logger.error(f"❌ Erro interno: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+    finally:
+        storage_manager.release(*job_paths)
+        if profile:
+            profile.finish({"filename": file.filename, "mode": mode, "diarization": enable_diarization})
+
+def _store_batch_file(filename: str, stream, max_tracks: int, held: List[str]) -> List[Tuple[str, str]]:
+    """
+    Grava um arquivo do lote (áudio ou arquivo compactado) como uma ou mais faixas.
+
+    Cada faixa é fixada no storage antes de ser gravada; os caminhos fixados
+    são acrescentados a `held` (liberados ao fim do lote ou por _discard_batch).
+    """
+    stored: List[Tuple[str, str]] = []
+
+    def store(name: str, source):
+        if len(stored) >= max_tracks:
+            raise ValueError(f"Lote com mais de {config.BATCH_MAX_TRACKS} faixas")
+        job_id = new_job_id()
+        input_path = os.path.join(config.UPLOAD_DIR, job_id, name)
+        paths = _job_paths(job_id, input_path)
+        storage_manager.hold(*paths)
+        held.extend(paths)
+        _store_upload(input_path, source, config.MAX_FILE_SIZE)
+        stored.append((job_id, input_path))
+
+    if not is_archive(filename):
+        store(filename, stream)
+        return stored
+
+    with tempfile.NamedTemporaryFile(dir=config.UPLOAD_DIR, prefix=STAGING_PREFIX) as archive:
+        copy_limited(stream, archive, config.MAX_FILE_SIZE * config.BATCH_MAX_TRACKS)
+        archive.flush()
+        for name, member in iter_archive_members(archive.name, config.MAX_FILE_SIZE):
+            store(name, member)
+    return stored
+
+def _discard_batch(held: List[str]):
+    """Remove os uploads de um lote recusado e libera os caminhos fixados."""
+    upload_root = os.path.abspath(config.UPLOAD_DIR) + os.sep
+    for path in held:
+        if os.path.abspath(path).startswith(upload_root):
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    storage_manager.release(*held)
+
+async def _separate_batch_handler(
+    request: Request,
+    files: List[UploadFile],
+    mode: str,
+    selectedStems: Optional[List[str]]
+):
+    logger.info(f"📚 Novo lote: {len(files)} arquivos, modo: {mode}")
+
+    valid_modes = ["2-stem", "4-stem", "6-stem", "custom"]
+    if mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Modo inválido: '{mode}'. Modos válidos: {valid_modes}")
+    if mode == "custom" and not selectedStems:
+        raise HTTPException(status_code=400, detail="Para modo 'custom', 'selectedStems' deve ser fornecido.")
+
+    model = models_store.get(select_model(mode))
+    if model is None and not cluster_mode:
+        raise HTTPException(status_code=503, detail="Modelo não carregado.")
+
+    for file in files:
+        filename = os.path.basename(file.filename or "")
+        if not is_archive(filename) and os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Arquivo não suportado: {filename}. Use MP3, WAV, FLAC, M4A ou ZIP/TAR com esses formatos."
+            )
+
+    # --- File Handling ---
+    # Faixas fixadas no storage desde antes da gravação (como no handler de arquivo único)
+    tracks: List[Tuple[str, str]] = []
+    job_paths: List[str] = []
+    try:
+        for file in files:
+            tracks += await run_in_threadpool(
+                _store_batch_file, os.path.basename(file.filename), file.file,
+                config.BATCH_MAX_TRACKS - len(tracks), job_paths
+            )
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        _discard_batch(job_paths)
+        raise HTTPException(status_code=400, detail=f"Lote inválido: {e}")
+    except Exception:
+        _discard_batch(job_paths)
+        raise
+    finally:
+        for file in files:
+            await file.close()
+
+    if not tracks:
+        raise HTTPException(status_code=400, detail="Nenhuma faixa de áudio encontrada no lote.")
+
+    # Probe de todas as faixas e cobrança do lote inteiro de uma vez: ou todas entram, ou nenhuma
+    infos: Dict[str, Dict[str, Any]] = {}
+    try:
+        for _, input_path in tracks:
+            infos[input_path] = await run_in_threadpool(_probe_upload, input_path)
+        seconds = sum(info["duration"] for info in infos.values())
+        await run_in_threadpool(_charge_cost, request, seconds, mode, False, selectedStems)
+    except HTTPException:
+        _discard_batch(job_paths)
+        raise
+
+    # --- Agendamento ---
+
+    def decode(input_path: str):
+        # No modo coordenador o decode acontece no worker
+        if model is None:
+            return None
+        return decode_audio(input_path, model.samplerate, model.audio_channels, info=infos[input_path])
+
+    def separate(input_path: str, job_id: str, decoded):
+        # Já decodificado pelo prefetch do lote: entra direto na inferência (sem bloquear o lote)
+        return separation_pipeline.submit(
+            input_path, mode, job_id=job_id, requested_stems=selectedStems, decoded=decoded,
+            info=infos[input_path]
+        )
+
+    return batch_manager.submit(
+        tracks,
+        {"mode": mode, "selected_stems": selectedStems},
+        decode,
+        separate,
+        on_complete=lambda: storage_manager.release(*job_paths)
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,153 @@
+# Background resource sampler backing the health/readiness endpoints
+import os
+import time
+import shutil
+import logging
+import resource
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Importação condicional do psutil (sem ele: load average e pico de RSS)
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+    logger.info("psutil não disponível: usando load average e ru_maxrss")
+
+
+class ResourceSampler:
+    """
+    Amostra periodicamente CPU, memória, disco, filas e modelos em um snapshot compartilhado.
+
+    Os endpoints de saúde só leem o último snapshot (custo constante); todo o
+    trabalho de coleta acontece nesta thread. O snapshot é substituído por
+    inteiro a cada amostra, então leitores nunca veem um estado parcial.
+    """
+
+    def __init__(self, interval: float = 10.0, disk_paths: Optional[Dict[str, str]] = None,
+                 probes: Optional[Dict[str, Callable[[], Any]]] = None):
+        """
+        Args:
+            interval: Segundos entre amostras
+            disk_paths: Diretórios cujo espaço livre é medido (nome -> caminho)
+            probes: Funções baratas chamadas a cada amostra (nome -> função),
+                ex: profundidade das filas, modelos carregados
+        """
+        self.interval = interval
+        self.disk_paths = disk_paths or {}
+        self.probes = probes or {}
+        self.snapshot: Dict[str, Any] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process() if PSUTIL_AVAILABLE else None
+
+    def _sample_system(self) -> Dict[str, Any]:
+        if self._process is not None:
+            memory = psutil.virtual_memory()
+            return {
+                "cpu_percent": psutil.cpu_percent(interval=None),
+                "rss_bytes": self._process.memory_info().rss,
+                "memory_available_bytes": memory.available,
+                "memory_percent": memory.percent,
+            }
+        # ru_maxrss é o pico (KB no Linux), não o RSS atual
+        return {
+            "load_average": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+
+    def _sample_gpu(self) -> Optional[Dict[str, Any]]:
+        if not torch.cuda.is_available():
+            return None
+        return {
+            "memory_allocated": torch.cuda.memory_allocated(0),
+            "memory_reserved": torch.cuda.memory_reserved(0),
+        }
+
+    def sample(self) -> Dict[str, Any]:
+        """Coleta uma amostra e publica como o snapshot atual."""
+        disks = {}
+        for name, path in self.disk_paths.items():
+            try:
+                usage = shutil.disk_usage(path)
+                disks[name] = {"free_bytes": usage.free, "total_bytes": usage.total}
+            except OSError as e:
+                disks[name] = {"error": str(e)}
+
+        probes = {}
+        for name, probe in self.probes.items():
+            try:
+                probes[name] = probe()
+            except Exception as e:
+                probes[name] = {"error": str(e)}
+
+        snapshot = {
+            "sampled_at": time.time(),
+            "system": self._sample_system(),
+            "gpu": self._sample_gpu(),
+            "disk": disks,
+            **probes,
+        }
+        self.snapshot = snapshot
+        return snapshot
+
+    def age(self) -> float:
+        """Segundos desde a última amostra (infinito se nenhuma)."""
+        sampled_at = self.snapshot.get("sampled_at")
+        return time.time() - sampled_at if sampled_at else float("inf")
+
+    def start(self):
+        """Inicia a amostragem periódica em uma thread daemon."""
+        if self._thread is not None:
+            return
+        if PSUTIL_AVAILABLE:
+            psutil.cpu_percent(interval=None)  # primeira leitura estabelece a base
+        self.sample()
+
+        def worker():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.sample()
+                except Exception as e:
+                    logger.error(f"Erro no sampler de recursos: {e}", exc_info=True)
+
+        self._thread = threading.Thread(target=worker, name="resource-sampler", daemon=True)
+        self._thread.start()
+        logger.info(f"📈 Sampler de recursos iniciado (a cada {self.interval:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+
+
+def readiness(snapshot: Dict[str, Any], required_models: List[str], require_diarization: bool,
+              min_disk_bytes: int, max_age: float, age: float) -> Dict[str, Any]:
+    """
+    Avalia se o serviço consegue atender, a partir de um snapshot.
+
+    Returns:
+        Dict com ready (bool) e a lista de motivos quando não está pronto
+    """
+    reasons = []
+    if age > max_age:
+        reasons.append(f"snapshot desatualizado ({age:.0f}s)")
+
+    loaded = snapshot.get("models", [])
+    missing = [name for name in required_models if name not in loaded]
+    if missing:
+        reasons.append(f"modelos não carregados: {missing}")
+
+    if require_diarization and not snapshot.get("diarization"):
+        reasons.append("diarizador indisponível")
+
+    for name, disk in snapshot.get("disk", {}).items():
+        if "error" in disk:
+            reasons.append(f"disco {name}: {disk['error']}")
+        elif disk["free_bytes"] < min_disk_bytes:
+            reasons.append(f"pouco espaço em {name} ({disk['free_bytes'] / 1024**2:.0f}MB livres)")
+
+    return {"ready": not reasons, "reasons": reasons}
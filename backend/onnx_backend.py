@@ -0,0 +1,315 @@
+# ONNX Runtime inference backend (CPU) for Demucs models
+import os
+import sys
+import importlib.util
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from torch import nn
+
+from inference import apply_bag, overlap_add
+
+logger = logging.getLogger(__name__)
+
+# Valores aceitos em INFERENCE_BACKEND
+INFERENCE_BACKENDS = ("torch", "onnx")
+
+# ONNX Runtime é importado só quando INFERENCE_BACKEND=onnx carrega um modelo
+ONNX_AVAILABLE = importlib.util.find_spec("onnxruntime") is not None
+if not ONNX_AVAILABLE:
+    logger.info("onnxruntime não disponível")
+
+ONNX_OPSET = 17
+# Tolerância de paridade com o PyTorch (erro máximo relativo ao pico da saída)
+PARITY_TOLERANCE = 1e-3
+
+
+class _HTDemucsCore(nn.Module):
+    """
+    Parte exportável do HTDemucs: tudo exceto STFT/iSTFT.
+
+    O ONNX não exporta tensores complexos, então o espectrograma da mistura
+    é calculado fora (em PyTorch) e entra como `mag`. Durante o trace, os
+    métodos espectrais do modelo são substituídos por versões reais e a saída
+    do ramo espectral é capturada como segunda saída do grafo.
+    """
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, mix: torch.Tensor, mag: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        model = self.model
+        batch, channels, _ = mix.shape
+        num_sources = len(model.sources)
+        captured: List[torch.Tensor] = []
+
+        def fake_mask(z, m):
+            captured.append(m)
+            return m
+
+        patches = {
+            "_spec": lambda x: mag,
+            "_magnitude": lambda z: z,
+            "_mask": fake_mask,
+            "_ispec": lambda z, length=None, scale=0: mix.new_zeros(batch, num_sources, channels, length),
+        }
+        for name, fn in patches.items():
+            setattr(model, name, fn)
+        try:
+            # Com _ispec zerado, a saída do forward é apenas o ramo temporal
+            time_out = model(mix)
+        finally:
+            for name in patches:
+                delattr(model, name)
+        return time_out, captured[0]
+
+
+class OnnxModel:
+    """
+    Executa um modelo Demucs (bag de HTDemucs) via ONNX Runtime.
+
+    Expõe os mesmos atributos usados por `separate_audio` (sources,
+    samplerate, audio_channels) e um método `apply` equivalente ao
+    `apply_model` do Demucs com split e sem shifts.
+    """
+
+    def __init__(self, name: str, bag: Any, sessions: List["ort.InferenceSession"]):
+        self.name = name
+        self.bag = bag
+        self.models = list(bag.models)
+        self.weights = bag.weights
+        self.sources = bag.sources
+        self.samplerate = bag.samplerate
+        self.audio_channels = bag.audio_channels
+        self.sessions = sessions
+
+    def _segment_length(self, sub_model: nn.Module) -> int:
+        return int(sub_model.segment * sub_model.samplerate)
+
+    def run_chunk(self, index: int, chunk: torch.Tensor) -> torch.Tensor:
+        """
+        Roda um sub-modelo em um trecho de exatamente `segment` amostras.
+
+        Args:
+            index: Índice do sub-modelo no bag
+            chunk: Tensor [1, C, L] float32 em CPU
+
+        Returns:
+            Tensor [1, S, C, L]
+        """
+        sub_model = self.models[index]
+        length = chunk.shape[-1]
+        with torch.no_grad():
+            z = sub_model._spec(chunk)
+            mag = sub_model._magnitude(z)
+        time_out, spec_out = self.sessions[index].run(
+            None, {"mix": chunk.numpy(), "mag": mag.contiguous().numpy()}
+        )
+        with torch.no_grad():
+            zout = sub_model._mask(z, torch.from_numpy(spec_out))
+            x = sub_model._ispec(zout, length).view(1, len(self.sources), -1, length)
+        return torch.from_numpy(time_out) + x
+
+    def apply(self, mix: torch.Tensor, overlap: float = 0.25, transition_power: float = 1.0,
+              members: Optional[List[int]] = None) -> torch.Tensor:
+        """
+        Separa a mistura [B, C, T] e retorna [B, S, C, T], como apply_model.
+
+        Com `members`, só esses sub-modelos do bag são executados.
+        """
+        mix = mix.float().cpu()
+
+        def run_model(index: int, x: torch.Tensor) -> torch.Tensor:
+            segment_length = self._segment_length(self.models[index])
+
+            def run_chunk(chunk: torch.Tensor) -> torch.Tensor:
+                # O grafo exportado tem tamanho fixo: completa o último trecho com zeros
+                chunk_length = chunk.shape[-1]
+                if chunk_length < segment_length:
+                    chunk = torch.nn.functional.pad(chunk, (0, segment_length - chunk_length))
+                return self.run_chunk(index, chunk)[..., :chunk_length]
+
+            return overlap_add(run_chunk, x, len(self.sources), segment_length,
+                               overlap=overlap, transition_power=transition_power)
+
+        return apply_bag(run_model, self.weights, len(self.sources), mix, members=members)
+
+
+def _session_options(num_threads: int) -> "ort.SessionOptions":
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    # Fixo por sessão: o InferenceScheduler não particiona ONNX (ver ONNX_THREADS)
+    options.intra_op_num_threads = num_threads or (os.cpu_count() or 1)
+    options.inter_op_num_threads = 1
+    return options
+
+
+def _export_path(cache_dir: str, name: str, index: int, segment_length: int) -> str:
+    stamp = f"torch{torch.__version__.split('+')[0]}_opset{ONNX_OPSET}"
+    return os.path.join(cache_dir, f"{name}_{index}_{segment_length}_{stamp}.onnx")
+
+
+def export_model(sub_model: nn.Module, path: str):
+    """Exporta um sub-modelo HTDemucs para ONNX (uma única vez por versão)."""
+    sub_model = sub_model.cpu().eval()
+    segment_length = int(sub_model.segment * sub_model.samplerate)
+    mix = torch.randn(1, sub_model.audio_channels, segment_length)
+    with torch.no_grad():
+        mag = sub_model._magnitude(sub_model._spec(mix))
+
+    tmp_path = path + ".tmp"
+    torch.onnx.export(
+        _HTDemucsCore(sub_model),
+        (mix, mag),
+        tmp_path,
+        input_names=["mix", "mag"],
+        output_names=["time_out", "spec_out"],
+        opset_version=ONNX_OPSET,
+        do_constant_folding=True,
+    )
+    os.replace(tmp_path, path)
+
+
+def check_parity(onnx_model: OnnxModel, seed: int = 0) -> float:
+    """
+    Compara ONNX e PyTorch em um trecho aleatório de cada sub-modelo.
+
+    Returns:
+        Maior erro absoluto relativo ao pico da saída do PyTorch
+    """
+    generator = torch.Generator().manual_seed(seed)
+    worst = 0.0
+    for index, sub_model in enumerate(onnx_model.models):
+        segment_length = int(sub_model.segment * sub_model.samplerate)
+        chunk = 0.1 * torch.randn(1, onnx_model.audio_channels, segment_length, generator=generator)
+        with torch.no_grad():
+            expected = sub_model(chunk)
+        actual = onnx_model.run_chunk(index, chunk)
+        error = float((expected - actual).abs().max() / expected.abs().max().clamp(min=1e-8))
+        worst = max(worst, error)
+    return worst
+
+
+def load_onnx_model(name: str, bag: Any, cache_dir: str, num_threads: int = 0) -> Optional[OnnxModel]:
+    """
+    Exporta (se necessário) e carrega um modelo Demucs no ONNX Runtime.
+
+    Retorna None se o ONNX Runtime não estiver instalado, se o modelo não
+    for um bag de HTDemucs, ou se a paridade com o PyTorch falhar; nesses
+    casos o chamador deve continuar usando o modelo PyTorch.
+
+    Args:
+        name: Nome do modelo (ex: htdemucs_ft)
+        bag: Modelo retornado por demucs.pretrained.get_model
+        cache_dir: Diretório do cache de exportações
+        num_threads: Threads intra-op do ONNX Runtime (0 = nº de CPUs)
+    """
+    if not ONNX_AVAILABLE:
+        logger.warning("⚠️ INFERENCE_BACKEND=onnx mas onnxruntime não está instalado")
+        return None
+
+    sub_models = list(getattr(bag, "models", [bag]))
+    if not all(hasattr(m, "_spec") and hasattr(m, "segment") for m in sub_models):
+        logger.warning(f"⚠️ {name}: backend ONNX suporta apenas HTDemucs, usando PyTorch")
+        return None
+
+    import onnxruntime as ort
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        sessions = []
+        for index, sub_model in enumerate(sub_models):
+            segment_length = int(sub_model.segment * sub_model.samplerate)
+            path = _export_path(cache_dir, name, index, segment_length)
+            if not os.path.exists(path):
+                logger.info(f"📦 Exportando {name}[{index}] para ONNX: {path}")
+                t0 = time.time()
+                export_model(sub_model, path)
+                logger.info(f"✅ Exportação concluída em {time.time() - t0:.1f}s")
+
+            options = _session_options(num_threads)
+            options.optimized_model_filepath = path.replace(".onnx", ".opt.onnx")
+            sessions.append(ort.InferenceSession(path, options, providers=["CPUExecutionProvider"]))
+
+        onnx_model = OnnxModel(name, bag, sessions)
+        error = check_parity(onnx_model)
+        if error > PARITY_TOLERANCE:
+            logger.warning(f"⚠️ {name}: paridade ONNX falhou (erro {error:.2e}), usando PyTorch")
+            return None
+
+        logger.info(f"✅ {name} carregado no ONNX Runtime (CPU, paridade {error:.2e})")
+        return onnx_model
+
+    except Exception as e:
+        logger.error(f"❌ Erro ao preparar {name} no ONNX Runtime: {e}", exc_info=True)
+        return None
+
+
+def benchmark(audio_path: str, model_name: str, cache_dir: str, seconds: float = 30.0) -> Dict[str, Any]:
+    """
+    Compara PyTorch e ONNX Runtime lado a lado em um trecho de áudio.
+
+    Returns:
+        Dict com tempos, fator de tempo real e erro máximo entre as saídas
+    """
+    import torchaudio
+    from demucs.apply import apply_model
+    from demucs.pretrained import get_model
+
+    bag = get_model(model_name).cpu().eval()
+    onnx_model = load_onnx_model(model_name, bag, cache_dir)
+    if onnx_model is None:
+        raise RuntimeError(f"Não foi possível carregar {model_name} no ONNX Runtime")
+
+    wav, sr = torchaudio.load(audio_path)
+    if sr != bag.samplerate:
+        wav = torchaudio.transforms.Resample(sr, bag.samplerate)(wav)
+    if wav.shape[0] != bag.audio_channels:
+        wav = wav.mean(dim=0, keepdim=True).expand(bag.audio_channels, -1)
+    wav = wav[:, :int(seconds * bag.samplerate)].unsqueeze(0).contiguous()
+    duration = wav.shape[-1] / bag.samplerate
+
+    t0 = time.time()
+    with torch.no_grad():
+        expected = apply_model(bag, wav, shifts=0, progress=False, num_workers=0)
+    t_torch = time.time() - t0
+
+    t0 = time.time()
+    actual = onnx_model.apply(wav)
+    t_onnx = time.time() - t0
+
+    return {
+        "model": model_name,
+        "audio_seconds": round(duration, 2),
+        "torch_seconds": round(t_torch, 3),
+        "onnx_seconds": round(t_onnx, 3),
+        "torch_rtf": round(t_torch / duration, 3),
+        "onnx_rtf": round(t_onnx / duration, 3),
+        "speedup": round(t_torch / t_onnx, 2),
+        "max_abs_error": float((expected - actual).abs().max()),
+    }
+
+
+if __name__ == "__main__":
+    # Uso: python onnx_backend.py <audio> [modelo] [segundos]
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    from config import config
+
+    if len(sys.argv) < 2:
+        print("Uso: python onnx_backend.py <audio> [modelo] [segundos]")
+        sys.exit(1)
+
+    result = benchmark(
+        sys.argv[1],
+        sys.argv[2] if len(sys.argv) > 2 else "htdemucs_ft",
+        config.ONNX_CACHE_DIR,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 30.0,
+    )
+    print(json.dumps(result, indent=2))
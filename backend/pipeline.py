@@ -0,0 +1,211 @@
+# Three-stage separation pipeline: decode -> infer -> encode with bounded queues
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from profiling import ProfileSession, maybe_capture
+from process import decode_stage, encode_stage, get_model_for, infer_stage, job_output_dir
+
+logger = logging.getLogger(__name__)
+
+_STAGES = ("decode", "infer", "encode")
+
+
+class PipelineJob:
+    """Uma separação em trânsito pelo pipeline."""
+
+    def __init__(self, input_path: str, mode: str, job_id: Optional[str],
+                 requested_stems: Optional[List[str]], decoded: Optional[Tuple[torch.Tensor, Dict[str, Any]]],
+                 profile: Optional[ProfileSession] = None, info: Optional[Dict[str, Any]] = None):
+        self.input_path = input_path
+        self.mode = mode
+        self.job_id = job_id
+        self.requested_stems = requested_stems
+        self.profile = profile
+        self.info = info
+        self.future: Future = Future()
+
+        self.model_name: Optional[str] = None
+        self.model: Any = None
+        self.wav: Optional[torch.Tensor] = decoded[0] if decoded is not None else None
+        self.stems: Optional[torch.Tensor] = None
+        self.names: List[str] = []
+
+        self.submitted_at = time.time()
+        self.timings: Dict[str, float] = {}
+
+
+class SeparationPipeline:
+    """
+    Executa as separações do servidor em três estágios com filas limitadas.
+
+    Cada estágio tem suas próprias threads: enquanto o job N está na
+    inferência, o decode do job N+1 e a escrita dos stems do job N-1 rodam
+    em paralelo. As filas entre estágios são limitadas (`queue_depth`), então
+    um estágio lento segura os anteriores em vez de acumular áudio decodificado
+    em memória. Um job sozinho atravessa os estágios sem espera adicional.
+    """
+
+    def __init__(self, models_store: Dict[str, Any], device: torch.device, output_dir: str, scheduler: Any,
+                 cpu_bf16: bool = False, residual_other: bool = False, stem_format: str = "float32",
+                 stem_dither: bool = True, queue_depth: int = 2, decode_workers: int = 1,
+                 infer_workers: int = 1, encode_workers: int = 1):
+        """
+        Args:
+            models_store: Modelos carregados (por nome)
+            device: Device da inferência
+            output_dir: OUTPUT_DIR
+            scheduler: InferenceScheduler usado pelo estágio de inferência
+            queue_depth: Jobs aguardando entre estágios (limita a memória)
+            decode_workers / infer_workers / encode_workers: Threads por estágio
+        """
+        self.models_store = models_store
+        self.device = device
+        self.output_dir = output_dir
+        self.scheduler = scheduler
+        self.cpu_bf16 = cpu_bf16
+        self.residual_other = residual_other
+        self.stem_format = stem_format
+        self.stem_dither = stem_dither
+
+        # Entrada sem limite (uploads já estão em disco); entre estágios, filas limitadas
+        self._queues = {
+            "decode": queue.Queue(),
+            "infer": queue.Queue(maxsize=queue_depth),
+            "encode": queue.Queue(maxsize=queue_depth),
+        }
+        self._workers = {"decode": decode_workers, "infer": infer_workers, "encode": encode_workers}
+        self._busy = {stage: 0 for stage in _STAGES}
+        self._busy_seconds = {stage: 0.0 for stage in _STAGES}
+        self._completed = 0
+        self._failed = 0
+        self._backlog_seconds = 0.0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """Inicia as threads de cada estágio."""
+        if self._threads:
+            return
+        handlers = {"decode": self._decode, "infer": self._infer, "encode": self._encode}
+        for stage in _STAGES:
+            for i in range(max(1, self._workers[stage])):
+                thread = threading.Thread(
+                    target=self._loop, args=(stage, handlers[stage]),
+                    name=f"pipeline-{stage}-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(
+            f"🏭 Pipeline iniciado: decode x{self._workers['decode']}, infer x{self._workers['infer']}, "
+            f"encode x{self._workers['encode']}, filas de {self._queues['infer'].maxsize}"
+        )
+
+    def submit(self, input_path: str, mode: str, job_id: Optional[str] = None,
+               requested_stems: Optional[List[str]] = None,
+               decoded: Optional[Tuple[torch.Tensor, Dict[str, Any]]] = None,
+               profile: Optional[ProfileSession] = None, info: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        Agenda uma separação.
+
+        Com `decoded`, o job entra direto no estágio de inferência. Com
+        `profile`, cada estágio do job roda sob o torch.profiler. `info` é
+        o probe dos cabeçalhos (ProbeIndex): o decode não repete o probe e a
+        duração entra no backlog de `stats()`.
+
+        Returns:
+            Future com a lista de caminhos dos stems (vazia em caso de erro, como separate_audio)
+        """
+        job = PipelineJob(input_path, mode, job_id, requested_stems, decoded, profile, info)
+        try:
+            job.model_name, job.model = get_model_for(mode, self.models_store)
+        except RuntimeError:
+            job.future.set_result([])
+            return job.future
+        with self._lock:
+            self._backlog_seconds += self._job_seconds(job)
+        self._queues["decode" if job.wav is None else "infer"].put(job)
+        return job.future
+
+    @staticmethod
+    def _job_seconds(job: PipelineJob) -> float:
+        return float(job.info["duration"]) if job.info else 0.0
+
+    def _loop(self, stage: str, handler):
+        next_stage = {"decode": "infer", "infer": "encode"}.get(stage)
+        while True:
+            job = self._queues[stage].get()
+            with self._lock:
+                self._busy[stage] += 1
+            t0 = time.time()
+            try:
+                # A inferência abre a captura dentro do scheduler (ver _infer)
+                with maybe_capture(job.profile if stage != "infer" else None, stage):
+                    result = handler(job)
+            except Exception as e:
+                logger.error(f"❌ Pipeline ({stage}) falhou em {job.input_path}: {e}", exc_info=True)
+                with self._lock:
+                    self._failed += 1
+                    self._backlog_seconds -= self._job_seconds(job)
+                job.future.set_result([])
+                continue
+            finally:
+                elapsed = time.time() - t0
+                job.timings[stage] = elapsed
+                with self._lock:
+                    self._busy[stage] -= 1
+                    self._busy_seconds[stage] += elapsed
+
+            if next_stage is not None:
+                # Bloqueia se o próximo estágio estiver cheio (backpressure)
+                self._queues[next_stage].put(job)
+            else:
+                with self._lock:
+                    self._completed += 1
+                    self._backlog_seconds -= self._job_seconds(job)
+                total = time.time() - job.submitted_at
+                waited = total - sum(job.timings.values())
+                logger.info(
+                    f"🚀 PIPELINE: decode {job.timings.get('decode', 0.0):.2f}s | "
+                    f"infer {job.timings['infer']:.2f}s | write {job.timings['encode']:.2f}s | "
+                    f"filas {waited:.2f}s | TOTAL {total:.2f}s"
+                )
+                job.future.set_result(result)
+
+    def _decode(self, job: PipelineJob):
+        job.wav, _ = decode_stage(job.input_path, job.model, job.info)
+
+    def _infer(self, job: PipelineJob):
+        # Núcleos primeiro, captura depois: mesma ordem da diarização (profile.wrap dentro
+        # de scheduler.run), senão as duas podem esperar uma pela outra para sempre
+        infer = job.profile.wrap("infer", infer_stage) if job.profile else infer_stage
+        job.stems, job.names = self.scheduler.run(
+            infer, job.model, job.wav, job.mode, self.device,
+            job.requested_stems, self.cpu_bf16, self.residual_other
+        )
+        job.wav = None
+
+    def _encode(self, job: PipelineJob) -> List[str]:
+        out_dir = job_output_dir(self.output_dir, job.model_name, job.input_path, job.job_id)
+        paths = encode_stage(job.stems, job.names, out_dir, job.model.samplerate,
+                             self.stem_format, self.stem_dither)
+        job.stems = None
+        return paths
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidade das filas e ocupação de cada estágio."""
+        with self._lock:
+            return {
+                "queued": {stage: self._queues[stage].qsize() for stage in _STAGES},
+                "busy": dict(self._busy),
+                "workers": dict(self._workers),
+                "busy_seconds": {stage: round(s, 2) for stage, s in self._busy_seconds.items()},
+                "backlog_audio_seconds": round(max(0.0, self._backlog_seconds), 1),
+                "completed": self._completed,
+                "failed": self._failed,
+            }
@@ -0,0 +1,206 @@
+# Persistent index of audio header probes and content hashes (sqlite)
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from decoder import probe_audio
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK = 1024 * 1024
+
+# Campos devolvidos por probe_audio
+PROBE_FIELDS = ("duration", "sample_rate", "channels", "codec")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    codec TEXT,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_hash ON probes (content_hash);
+CREATE INDEX IF NOT EXISTS probes_used ON probes (used_at);
+"""
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 do conteúdo do arquivo (independe de nome e caminho)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProbeIndex:
+    """
+    Informações de cabeçalho (duração, taxa, canais, codec) e hash de conteúdo por arquivo.
+
+    A chave é (caminho, tamanho, mtime): um arquivo sobrescrito no mesmo
+    caminho nunca devolve dados antigos. Com o hash de conteúdo, um arquivo
+    idêntico em outro caminho reaproveita o probe sem abrir os cabeçalhos.
+    Arquivos de caminho efêmero (uploads da API, sempre num diretório novo)
+    usam probe_content, indexado só pelo hash. Persistido em sqlite, sobrevive a
+    reinícios; as entradas menos usadas são descartadas acima de `max_entries`.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 100000):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str) -> Tuple[str, int, int]:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _row(self, key: Tuple[str, int, int]) -> Optional[Dict[str, Any]]:
+        cursor = self._conn.execute(
+            "SELECT content_hash, duration, sample_rate, channels, codec FROM probes "
+            "WHERE path = ? AND size = ? AND mtime_ns = ?", key
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(("content_hash",) + PROBE_FIELDS, row))
+
+    def _by_hash(self, digest: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT duration, sample_rate, channels, codec FROM probes "
+            "WHERE content_hash = ? AND duration IS NOT NULL LIMIT 1", (digest,)
+        ).fetchone()
+        return dict(zip(PROBE_FIELDS, row)) if row else None
+
+    def _store(self, key: Tuple[str, int, int], entry: Dict[str, Any]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO probes (path, size, mtime_ns, content_hash, duration, sample_rate, "
+            "channels, codec, used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (entry.get("content_hash"),) + tuple(entry.get(f) for f in PROBE_FIELDS) + (time.time(),)
+        )
+        self._conn.commit()
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._prune()
+
+    def _prune(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM probes WHERE path IN (SELECT path FROM probes ORDER BY used_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            self._conn.commit()
+
+    def probe(self, path: str, with_hash: bool = False) -> Dict[str, Any]:
+        """
+        Probe do arquivo (só cabeçalhos), do índice quando possível.
+
+        Args:
+            path: Caminho do arquivo
+            with_hash: Também calcula (ou lê do índice) o hash do conteúdo
+
+        Returns:
+            Dict com duration, sample_rate, channels, codec (e content_hash se pedido)
+
+        Raises:
+            Exceções de probe_audio se o arquivo não puder ser lido
+        """
+        key = self._key(path)
+        with self._lock:
+            entry = self._row(key)
+        if entry is not None and entry["duration"] is not None and (entry["content_hash"] or not with_hash):
+            self.hits += 1
+            with self._lock:
+                self._conn.execute("UPDATE probes SET used_at = ? WHERE path = ?", (time.time(), key[0]))
+                self._conn.commit()
+            return self._result(entry, with_hash)
+
+        entry = entry or {}
+        if with_hash and not entry.get("content_hash"):
+            entry["content_hash"] = content_hash(path)
+
+        if entry.get("duration") is None:
+            known = None
+            if entry.get("content_hash"):
+                with self._lock:
+                    known = self._by_hash(entry["content_hash"])
+            if known is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                known = probe_audio(path)
+            entry.update({f: known[f] for f in PROBE_FIELDS})
+
+        with self._lock:
+            self._store(key, entry)
+        return self._result(entry, with_hash)
+
+    def probe_content(self, path: str) -> Dict[str, Any]:
+        """
+        Probe indexado pelo hash do conteúdo, para arquivos de caminho efêmero.
+
+        O caminho nunca se repete, então a busca por (caminho, tamanho,
+        mtime) não acertaria; a entrada fica sob uma chave do próprio hash
+        (uma por conteúdo, não por upload).
+
+        Returns:
+            Dict com duration, sample_rate, channels, codec e content_hash
+        """
+        digest = content_hash(path)
+        with self._lock:
+            known = self._by_hash(digest)
+            if known is not None:
+                self._conn.execute("UPDATE probes SET used_at = ? WHERE content_hash = ?", (time.time(), digest))
+                self._conn.commit()
+        if known is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            known = probe_audio(path)
+            with self._lock:
+                self._store((f"sha256:{digest}", os.path.getsize(path), 0), {**known, "content_hash": digest})
+        return {**{f: known[f] for f in PROBE_FIELDS}, "content_hash": digest}
+
+    def content_hash(self, path: str) -> str:
+        """Hash do conteúdo, calculado uma vez por (caminho, tamanho, mtime)."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._row(key)
+        if entry is not None and entry["content_hash"]:
+            return entry["content_hash"]
+        entry = entry or {}
+        entry["content_hash"] = content_hash(path)
+        with self._lock:
+            self._store(key, entry)
+        return entry["content_hash"]
+
+    @staticmethod
+    def _result(entry: Dict[str, Any], with_hash: bool) -> Dict[str, Any]:
+        result = {f: entry[f] for f in PROBE_FIELDS}
+        if with_hash:
+            result["content_hash"] = entry["content_hash"]
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
@@ -2,11 +2,18 @@ import os
 import glob
 import time
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 
 import torch
-import torchaudio
-from demucs.apply import apply_model
+import torch.nn as nn
+
+from decoder import decode_audio
+from inference import apply_model_bf16, apply_model_members, bag_members_for
+from onnx_backend import OnnxModel, load_onnx_model
+from quantization import quantize_model, load_calibration_mix
+from scheduler import checkpoint
+from staging import job_dir_name, staged_output
+from stem_writer import write_stems
 
 # Logger configurado para este módulo
 logger = logging.getLogger(__name__)
@@ -16,6 +23,236 @@ BEST_MODEL_NAME = "htdemucs_ft"
 EXTRA_MODEL_NAME = "htdemucs_6s"
 
 
+def select_model(mode: str) -> str:
+    """Nome do modelo usado em cada modo de separação."""
+    return EXTRA_MODEL_NAME if mode in ("6-stem", "custom") else BEST_MODEL_NAME
+
+
+def load_separation_model(
+    name: str,
+    device: torch.device,
+    inference_preset: str = "fp32",
+    inference_backend: str = "torch",
+    calibration_file: Optional[str] = None,
+    onnx_cache_dir: str = "models/onnx",
+    onnx_threads: int = 0,
+) -> Any:
+    """
+    Carrega um modelo Demucs com o preset de precisão e o backend configurados.
+
+    A quantização int8 só se aplica em CPU com o backend PyTorch; o backend
+    ONNX (CPU) volta ao modelo PyTorch se a exportação ou a paridade falhar.
+    """
+    logger.info(f"📥 Carregando {name}...")
+    from demucs import pretrained
+    model = pretrained.get_model(name).to(device).eval()
+    logger.info(f"✅ Modelo {name} carregado em {device}")
+
+    # Preset quantizado int8 (somente CPU com backend PyTorch)
+    if inference_preset != "fp32" and device.type == "cpu":
+        if inference_backend != "torch":
+            logger.warning("⚠️ INFERENCE_PRESET ignorado: quantização só vale para INFERENCE_BACKEND=torch")
+        else:
+            calibration_mix = None
+            if calibration_file:
+                calibration_mix = load_calibration_mix(calibration_file, model.samplerate, model.audio_channels)
+            model = quantize_model(model, inference_preset, calibration_mix)
+            logger.info(f"✅ Modelo {name} quantizado ({inference_preset})")
+
+    # Backend ONNX Runtime (somente CPU); em caso de falha mantém o PyTorch
+    if inference_backend == "onnx" and device.type == "cpu":
+        onnx_model = load_onnx_model(name, model, cache_dir=onnx_cache_dir, num_threads=onnx_threads)
+        if onnx_model is not None:
+            model = onnx_model
+
+    # Aplica rebalanceamentos do scheduler a cada trecho de inferência (não vale para ONNX)
+    if isinstance(model, nn.Module):
+        for sub_model in getattr(model, "models", None) or [model]:
+            sub_model.register_forward_pre_hook(lambda module, args: checkpoint())
+
+    return model
+
+
+def get_model_for(mode: str, models_store: Dict[str, Any]) -> Tuple[str, Any]:
+    """Modelo carregado para o modo (RuntimeError se ausente)."""
+    model_name = select_model(mode)
+    model = models_store.get(model_name)
+    if model is None:
+        msg = f"Modelo '{model_name}' não encontrado em models_store"
+        logger.error(msg)
+        raise RuntimeError(msg)
+    return model_name, model
+
+
+def decode_stage(input_path: str, model: Any,
+                 info: Optional[Dict[str, Any]] = None) -> Tuple[torch.Tensor, Dict[str, Any]]:
+    """
+    Estágio 1: decode em blocos já na taxa e nos canais do modelo (resampler em cache).
+
+    `info` é o probe dos cabeçalhos, se já conhecido (evita um novo probe).
+
+    Returns:
+        Tupla (tensor [C, T] float32 em CPU, info dos cabeçalhos)
+    """
+    wav, info = decode_audio(input_path, model.samplerate, model.audio_channels, info=info)
+    logger.info(
+        f"Áudio: {info['codec']} {info['sample_rate']}Hz {info['channels']}ch, "
+        f"{info['duration']:.1f}s -> {model.samplerate}Hz {model.audio_channels}ch"
+    )
+    return wav, info
+
+
+def needed_sources(model: Any, mode: str, requested_stems: Optional[List[str]] = None,
+                   residual_other: bool = False) -> Tuple[List[str], Optional[str]]:
+    """
+    Fontes que a inferência precisa calcular para o modo.
+
+    Returns:
+        Tupla (fontes calculadas, stem residual = mistura menos elas, ou None)
+    """
+    if mode == "2-stem":
+        return ["vocals"], "no_vocals"
+    if mode == "custom" and requested_stems:
+        return [name for name in model.sources if name in requested_stems], None
+    if (residual_other and "other" in model.sources
+            and bag_members_for(model, [name for name in model.sources if name != "other"]) is not None):
+        return [name for name in model.sources if name != "other"], "other"
+    return list(model.sources), None
+
+
+def member_fraction(model: Any, mode: str, requested_stems: Optional[List[str]] = None,
+                    residual_other: bool = False) -> float:
+    """Fração dos membros do bag que roda para o modo (1.0 = todos; ex: 2-stem no htdemucs_ft = 1/4)."""
+    needed, _ = needed_sources(model, mode, requested_stems, residual_other)
+    members = bag_members_for(model, needed)
+    return 1.0 if members is None else len(members) / len(model.weights)
+
+
+def infer_stage(
+    model: Any,
+    wav: torch.Tensor,
+    mode: str,
+    device: torch.device,
+    requested_stems: Optional[List[str]] = None,
+    cpu_bf16: bool = False,
+    residual_other: bool = False,
+) -> Tuple[torch.Tensor, List[str]]:
+    """
+    Estágio 2: separa a mistura [C, T] e monta os stems pedidos.
+
+    Returns:
+        Tupla (stems [S, C, T] em CPU, nomes dos stems)
+    """
+    # Mover para GPU e adicionar batch dimension
+    if device.type == 'cuda' and wav.device != device:
+        wav = wav.to(device, non_blocking=True)
+    wav = wav.unsqueeze(0)  # shape: [1, C, T]
+
+    # Fontes a calcular e membros do bag necessários para elas
+    needed, residual = needed_sources(model, mode, requested_stems, residual_other)
+    members = bag_members_for(model, needed)
+    if members is not None:
+        logger.info(f"🎯 Executando {len(members)}/{len(model.weights)} modelos do bag para {needed}")
+
+    # Limpar cache da GPU antes da inferência
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        
+    if isinstance(model, OnnxModel):
+        # Backend ONNX Runtime (CPU)
+        separated = model.apply(wav, members=members)
+    elif cpu_bf16 and device.type == 'cpu':
+        # Mixed precision bf16 em CPU
+        separated = apply_model_bf16(model, wav, members=members)
+    elif members is not None:
+        # Apenas os membros do bag necessários
+        separated = apply_model_members(model, wav, members, device)
+    else:
+        from demucs.apply import apply_model
+        with torch.no_grad():
+            # Usar mixed precision para melhor performance
+            with torch.cuda.amp.autocast(enabled=device.type == 'cuda', dtype=torch.float16):
+                separated = apply_model(
+                    model,
+                    wav,
+                    device=device,
+                    progress=False,
+                    num_workers=0,  # Evitar overhead de multiprocessing
+                )
+            
+    # Sincronizar GPU se necessário
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    # Normaliza dimensões: se batch dimension existir, remove
+    if separated.dim() == 4:
+        # [batch, S, C, T] -> [S, C, T]
+        separated = separated[0]
+    elif separated.dim() != 3:
+        msg = f"Formato inesperado de saída do Demucs: {separated.shape}"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    # Define quais stems salvar (na ordem do modelo)
+    stems_to_save = {name: separated[model.sources.index(name)] for name in needed}
+    if residual is not None and members is None:
+        # Todas as fontes foram calculadas: residual = soma das demais
+        stems_to_save[residual] = separated.sum(dim=0) - sum(stems_to_save.values())
+    elif residual is not None:
+        # Stem residual: mistura menos as fontes calculadas
+        stems_to_save[residual] = wav[0].to(separated.device) - sum(stems_to_save.values())
+        if residual == "other":
+            stems_to_save = {name: stems_to_save[name] for name in model.sources}
+
+    # Uma única transferência para CPU de todos os stems [S, C, T]
+    names = list(stems_to_save)
+    stems_cpu = torch.stack([stems_to_save[name] for name in names]).cpu()
+    del stems_to_save, separated
+
+    # Limpar cache da GPU após mover para CPU
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+    return stems_cpu, names
+
+
+def encode_stage(
+    stems: torch.Tensor,
+    names: List[str],
+    out_dir: str,
+    sample_rate: int,
+    stem_format: str = "float32",
+    stem_dither: bool = True,
+) -> List[str]:
+    """
+    Estágio 3: conversão vetorizada, escrita paralela no staging e publicação atômica.
+
+    Returns:
+        Caminhos publicados dos stems
+    """
+    with staged_output(out_dir) as staging_dir:
+        _, write_stats = write_stems(
+            stems, names, staging_dir, sample_rate,
+            sample_format=stem_format, dither=stem_dither
+        )
+    output_paths = [os.path.join(out_dir, f"{name}.wav") for name in names]
+    for path in output_paths:
+        logger.info(f"💾 Stem salvo: {path}")
+
+    write_mb = write_stats["bytes"] / 1024**2
+    logger.info(
+        f"💾 WRITE: {len(names)} stems {stem_format} | convert {write_stats['convert_seconds']:.2f}s | "
+        f"io {write_stats['write_seconds']:.2f}s ({write_mb:.1f}MB, "
+        f"{write_mb / max(write_stats['write_seconds'], 1e-6):.0f}MB/s, {write_stats['workers']} threads)"
+    )
+    return output_paths
+
+
+def job_output_dir(output_dir_base: str, model_name: str, input_path: str, job_id: Optional[str] = None) -> str:
+    """`<output_dir_base>/<modelo>/<base>-<job_id>`."""
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir_base, model_name, job_dir_name(base, job_id))
+
+
 def separate_audio(
     input_path: str,
     mode: str,
@@ -23,138 +260,59 @@ def separate_audio(
     device: torch.device,
     models_store: Dict[str, Any],
     requested_stems: Optional[List[str]] = None,
+    cpu_bf16: bool = False,
+    residual_other: bool = False,
+    job_id: Optional[str] = None,
+    stem_format: str = "float32",
+    stem_dither: bool = True,
+    decoded: Optional[Tuple[torch.Tensor, Dict[str, Any]]] = None,
 ) -> List[str]:
     """
     Separa um arquivo de áudio usando Demucs (API Python) e salva os stems no disco.
     Retorna lista de caminhos dos stems gerados.
+    
+    Com cpu_bf16=True (e device CPU), o forward roda em autocast bf16 e as
+    saídas intermediárias são acumuladas em bf16, com fp32 só na normalização final.
+    
+    Em bags com um modelo por fonte (htdemucs_ft), só os membros necessários
+    para os stems pedidos são executados; `no_vocals` (e `other`, com
+    residual_other=True) vêm da mistura menos as fontes calculadas.
+    
+    Os stems são escritos em um diretório de staging e publicados juntos
+    (rename atômico) em `<output_dir_base>/<modelo>/<base>-<job_id>`, em
+    `stem_format` ("float32" ou "int16", com dither TPDF se stem_dither).
+    
+    `decoded` permite passar o áudio já decodificado (decode_audio na taxa e
+    nos canais do modelo), para sobrepor o decode com outra inferência.
+    
+    Executa os três estágios (decode_stage, infer_stage, encode_stage) em
+    sequência; o servidor os executa em pipeline (ver pipeline.py).
     """
     t_start = time.time()
 
     try:
         logger.info(f"Iniciando separação via API Python para: {input_path}, modo: {mode}")
+        model_name, model = get_model_for(mode, models_store)
 
-        # Seleciona modelo e stems suportados
-        if mode in ("6-stem", "custom"):
-            model_name = EXTRA_MODEL_NAME
-            supported = ["vocals", "drums", "bass", "guitar", "piano", "other"]
-        else:
-            model_name = BEST_MODEL_NAME
-            supported = ["vocals", "drums", "bass", "other"]
-
-        model = models_store.get(model_name)
-        if model is None:
-            msg = f"Modelo '{model_name}' não encontrado em models_store"
-            logger.error(msg)
-            raise RuntimeError(msg)
-
-        # 1) Carrega e prepara o áudio (otimizado para GPU)
+        # 1) Carrega e prepara o áudio
         t0 = time.time()
-        wav, sr = torchaudio.load(input_path)  # shape: [C, T]
-        
-        # Ajuste de canais
-        if wav.ndim == 1:
-            wav = wav.unsqueeze(0)
-        if wav.shape[0] != model.audio_channels:
-            # mixdown para mono
-            wav = wav.mean(dim=0, keepdim=True)
-            if model.audio_channels == 2:
-                wav = torch.cat([wav, wav], dim=0)
-        
-        # Resample se necessário (otimizado)
-        if sr != model.samplerate:
-            logger.info(f"Resampling de {sr}Hz para {model.samplerate}Hz")
-            # Usar GPU para resampling se disponível
-            if device.type == 'cuda':
-                wav = wav.to(device)
-                resampler = torchaudio.transforms.Resample(sr, model.samplerate).to(device)
-                wav = resampler(wav)
-            else:
-                wav = torchaudio.transforms.Resample(sr, model.samplerate)(wav)
-        
-        # Mover para GPU e adicionar batch dimension
-        if device.type == 'cuda' and wav.device != device:
-            wav = wav.to(device, non_blocking=True)
-        wav = wav.unsqueeze(0)  # shape: [1, C, T]
-        
+        wav, _ = decoded if decoded is not None else decode_stage(input_path, model)
         t1 = time.time()
-        logger.info(f"🚀 Áudio preparado em {t1-t0:.2f}s (shape={tuple(wav.shape)}, device={wav.device})")
+        logger.info(f"🚀 Áudio preparado em {t1-t0:.2f}s (shape={tuple(wav.shape)})")
 
-        # 2) Inferência otimizada com mixed precision
+        # 2) Inferência
         t2 = time.time()
-        
-        # Limpar cache da GPU antes da inferência
-        if device.type == 'cuda':
-            torch.cuda.empty_cache()
-            
-        with torch.no_grad():
-            # Usar mixed precision para melhor performance
-            with torch.cuda.amp.autocast(enabled=device.type == 'cuda', dtype=torch.float16):
-                separated = apply_model(
-                    model,
-                    wav,
-                    device=device,
-                    progress=False,
-                    num_workers=0,  # Evitar overhead de multiprocessing
-                )
-                
-        # Sincronizar GPU se necessário
-        if device.type == 'cuda':
-            torch.cuda.synchronize()
-            
+        stems, names = infer_stage(model, wav, mode, device, requested_stems, cpu_bf16, residual_other)
+        del wav
         t3 = time.time()
-        logger.info(f"🔥 Inferência GPU concluída em {t3-t2:.2f}s")
-
-        # Normaliza dimensões: se batch dimension existir, remove
-        if separated.dim() == 4:
-            # [batch, S, C, T] -> [S, C, T]
-            separated = separated[0]
-        elif separated.dim() == 3:
-            # já [S, C, T]
-            pass
-        else:
-            msg = f"Formato inesperado de saída do Demucs: {separated.shape}"
-            logger.error(msg)
-            raise RuntimeError(msg)
-
-        # 3) Define quais stems salvar
-        if mode == "2-stem":
-            # vocals + no_vocals
-            idx_v = model.sources.index("vocals")
-            vocals = separated[idx_v]
-            no_vocals = separated.sum(dim=0) - vocals
-            stems_to_save = {"vocals": vocals, "no_vocals": no_vocals}
-        elif mode == "custom" and requested_stems:
-            stems_to_save = {
-                name: separated[i]
-                for i, name in enumerate(model.sources)
-                if name in requested_stems
-            }
-        else:
-            # 4-stem ou 6-stem
-            stems_to_save = {name: separated[i] for i, name in enumerate(model.sources)}
+        logger.info(f"🔥 Inferência concluída em {t3-t2:.2f}s")
 
-        # 4) Salva stems (otimizado)
+        # 3) Salva stems: conversão vetorizada única e escrita paralela
         t4 = time.time()
-        base = os.path.splitext(os.path.basename(input_path))[0]
-        out_dir = os.path.join(output_dir_base, model_name, base)
-        os.makedirs(out_dir, exist_ok=True)
-        output_paths: List[str] = []
-
-        # Mover todos os tensors para CPU de uma vez para otimizar
-        stems_cpu = {}
-        for name, tensor in stems_to_save.items():
-            stems_cpu[name] = tensor.cpu()
-        
-        # Limpar cache da GPU após mover para CPU
-        if device.type == 'cuda':
-            torch.cuda.empty_cache()
-
-        # Salvar arquivos
-        for name, tensor_cpu in stems_cpu.items():
-            path = os.path.join(out_dir, f"{name}.wav")
-            torchaudio.save(path, tensor_cpu, sample_rate=model.samplerate)
-            output_paths.append(path)
-            logger.info(f"💾 Stem salvo: {path}")
+        output_paths = encode_stage(
+            stems, names, job_output_dir(output_dir_base, model_name, input_path, job_id),
+            model.samplerate, stem_format, stem_dither
+        )
         t5 = time.time()
 
         # Log de performance detalhado
@@ -169,4 +327,3 @@ def separate_audio(
     except Exception as e:
         logger.error(f"Erro em separate_audio (API Python): {e}", exc_info=True)
         return []
-
@@ -0,0 +1,117 @@
+# On-demand torch.profiler capture for individual separation requests
+import os
+import hmac
+import json
+import random
+import shutil
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import torch
+
+from staging import make_staging_dir, new_job_id, publish_dir
+
+logger = logging.getLogger(__name__)
+
+# Header com o token de administrador que liga o profiling de uma requisição
+PROFILE_HEADER = "X-Profile-Token"
+
+# O profiler do PyTorch é global ao processo: uma captura por vez
+_capture_lock = threading.Lock()
+
+
+def should_profile(header_token: Optional[str], admin_token: Optional[str], sample_rate: float = 0.0) -> bool:
+    """
+    Decide se uma requisição será perfilada.
+
+    Args:
+        header_token: Valor do header X-Profile-Token
+        admin_token: PROFILE_ADMIN_TOKEN (None desativa o header)
+        sample_rate: Fração das requisições perfiladas por amostragem (0 a 1)
+    """
+    if header_token and admin_token and hmac.compare_digest(header_token, admin_token):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class ProfileSession:
+    """
+    Capturas do torch.profiler de uma requisição, salvas como artefato.
+
+    Cada estágio (decode, infer, encode, diarize) vira um trace Chrome
+    (`<estágio>.trace.json`, abra em chrome://tracing ou Perfetto) e entra no
+    `summary.json` com os operadores de maior self-time. O diretório é
+    publicado em `<profiles_dir>/<profile_id>` ao chamar `finish()`.
+    """
+
+    def __init__(self, profiles_dir: str, top_ops: int = 25, profile_id: Optional[str] = None):
+        self.profile_id = profile_id or new_job_id()
+        self.profiles_dir = profiles_dir
+        self.top_ops = top_ops
+        self.final_dir = os.path.join(profiles_dir, self.profile_id)
+        self._stages: Dict[str, Any] = {}
+        self.work_dir = make_staging_dir(self.final_dir)
+
+    @contextmanager
+    def capture(self, stage: str) -> Iterator[None]:
+        """Perfila o bloco na thread atual (o profiler só vê as ops desta thread e seus workers)."""
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        with _capture_lock:
+            with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+                yield
+            try:
+                self._save(stage, prof)
+            except Exception as e:
+                logger.warning(f"⚠️ Falha ao salvar profile de {stage}: {e}")
+
+    def wrap(self, stage: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """fn perfilada no estágio `stage`, na thread em que for executada."""
+        def wrapped(*args, **kwargs):
+            with self.capture(stage):
+                return fn(*args, **kwargs)
+        return wrapped
+
+    def _save(self, stage: str, prof: "torch.profiler.profile"):
+        prof.export_chrome_trace(os.path.join(self.work_dir, f"{stage}.trace.json"))
+
+        averages = prof.key_averages()
+        sort_key = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        with open(os.path.join(self.work_dir, f"{stage}.top_ops.txt"), "w") as f:
+            f.write(averages.table(sort_by=sort_key, row_limit=self.top_ops))
+
+        top: List[Dict[str, Any]] = []
+        for event in sorted(averages, key=lambda e: e.self_cpu_time_total, reverse=True)[:self.top_ops]:
+            top.append({
+                "op": event.key,
+                "calls": event.count,
+                "self_cpu_ms": round(event.self_cpu_time_total / 1000, 3),
+                "cpu_total_ms": round(event.cpu_time_total / 1000, 3),
+            })
+        self._stages[stage] = {"trace": f"{stage}.trace.json", "top_ops": top}
+
+    def finish(self, metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Grava o summary.json e publica o artefato.
+
+        Returns:
+            Diretório publicado, ou None se nenhum estágio foi capturado
+        """
+        if not self._stages:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            return None
+        summary = {"profile_id": self.profile_id, **(metadata or {}), "stages": self._stages}
+        with open(os.path.join(self.work_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        publish_dir(self.work_dir, self.final_dir)
+        logger.info(f"🔬 Profile {self.profile_id} salvo em {self.final_dir}")
+        return self.final_dir
+
+
+def maybe_capture(session: Optional[ProfileSession], stage: str):
+    """capture() da sessão, ou um contexto vazio sem profiling."""
+    return session.capture(stage) if session is not None else nullcontext()
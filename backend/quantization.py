@@ -0,0 +1,349 @@
+# Int8 quantization presets for CPU inference
+import sys
+import copy
+import math
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+# Presets de inferência em CPU
+# - fp32: modelo original
+# - int8: quantização dinâmica int8 das camadas lineares (feed-forward e projeções da atenção)
+# - int8_static: int8 + quantização estática das convoluções (requer calibração)
+INFERENCE_PRESETS = ("fp32", "int8", "int8_static")
+
+
+def _select_engine():
+    """Seleciona o engine de kernels quantizados disponível (x86 > fbgemm > qnnpack)."""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    return None
+
+
+def weight_bytes(model: nn.Module) -> int:
+    """Memória ocupada pelos pesos (inclui pesos empacotados das camadas quantizadas)."""
+    total = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _SplitMultiheadAttention(nn.Module):
+    """
+    nn.MultiheadAttention com as projeções em nn.Linear separados (q, k, v, out).
+
+    O MultiheadAttention guarda a projeção de entrada em um único parâmetro
+    e o out_proj como NonDynamicallyQuantizableLinear, então o
+    quantize_dynamic não toca em nenhum dos dois. Com as projeções como
+    Linear comuns elas viram int8; a atenção em si roda em float
+    (scaled_dot_product_attention). Os pesos da atenção (need_weights) não
+    são retornados.
+    """
+
+    def __init__(self, mha: nn.MultiheadAttention):
+        super().__init__()
+        self.embed_dim = mha.embed_dim
+        self.num_heads = mha.num_heads
+        self.head_dim = mha.head_dim
+        self.dropout = mha.dropout
+        self.batch_first = mha.batch_first
+
+        if mha._qkv_same_embed_dim:
+            weights = mha.in_proj_weight.chunk(3)
+        else:
+            weights = (mha.q_proj_weight, mha.k_proj_weight, mha.v_proj_weight)
+        biases = mha.in_proj_bias.chunk(3) if mha.in_proj_bias is not None else (None,) * 3
+
+        def linear(weight, bias):
+            layer = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None)
+            layer.weight.data.copy_(weight.detach())
+            if bias is not None:
+                layer.bias.data.copy_(bias.detach())
+            return layer
+
+        self.q_proj, self.k_proj, self.v_proj = (linear(w, b) for w, b in zip(weights, biases))
+        self.out_proj = linear(mha.out_proj.weight, mha.out_proj.bias)
+
+    def forward(self, query, key, value, key_padding_mask=None, need_weights=True, attn_mask=None,
+                average_attn_weights=True, is_causal=False):
+        if not self.batch_first:
+            query, key, value = (t.transpose(0, 1) for t in (query, key, value))
+        batch, target, source = query.shape[0], query.shape[1], key.shape[1]
+
+        def heads(x, length):
+            return x.view(batch, length, self.num_heads, self.head_dim).transpose(1, 2)
+
+        q = heads(self.q_proj(query), target)
+        k = heads(self.k_proj(key), source)
+        v = heads(self.v_proj(value), source)
+
+        # Máscaras no formato do MultiheadAttention (bool True = bloqueado) -> máscara aditiva
+        mask = None
+        if attn_mask is not None:
+            mask = _additive_mask(attn_mask, q.dtype)
+            if mask.dim() == 3:
+                mask = mask.view(batch, self.num_heads, target, source)
+        if key_padding_mask is not None:
+            padding = _additive_mask(key_padding_mask, q.dtype).view(batch, 1, 1, source)
+            mask = padding if mask is None else mask + padding
+
+        out = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=mask, dropout_p=self.dropout if self.training else 0.0,
+            is_causal=is_causal and mask is None,
+        )
+        out = self.out_proj(out.transpose(1, 2).reshape(batch, target, self.embed_dim))
+        if not self.batch_first:
+            out = out.transpose(0, 1)
+        return out, None
+
+
+def _additive_mask(mask: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    if mask.dtype == torch.bool:
+        return torch.zeros(mask.shape, dtype=dtype, device=mask.device).masked_fill(mask, float("-inf"))
+    return mask.to(dtype)
+
+
+def _split_attention(sub_model: nn.Module) -> int:
+    """Troca cada nn.MultiheadAttention por _SplitMultiheadAttention. Retorna quantas foram trocadas."""
+    replaced = 0
+    for parent in list(sub_model.modules()):
+        for name, child in parent.named_children():
+            if type(child) is not nn.MultiheadAttention:
+                continue
+            if child.bias_k is not None or child.add_zero_attn:
+                logger.warning(f"⚠️ Atenção {name} mantida em float (bias_k/add_zero_attn não suportados)")
+                continue
+            setattr(parent, name, _SplitMultiheadAttention(child))
+            replaced += 1
+    return replaced
+
+
+def float_linear_layers(model: nn.Module) -> List[str]:
+    """Nomes das camadas lineares/de atenção que continuam em float após a quantização."""
+    return [
+        name for name, module in model.named_modules()
+        if type(module) in (nn.Linear, nn.modules.linear.NonDynamicallyQuantizableLinear, nn.MultiheadAttention)
+    ]
+
+
+def _quantize_convs_static(sub_model: nn.Module, calibration_mix: torch.Tensor) -> int:
+    """
+    Quantização estática (eager) das convoluções do encoder/decoder de um HTDemucs.
+
+    As camadas HEncLayer/HDecLayer ramificam em `x.dim()` e não passam pelo
+    FX; por isso cada Conv1d/Conv2d interna é envolvida em um QuantWrapper
+    (quantize -> conv int8 -> dequantize), e o resto da camada segue em
+    float. Retorna o número de convoluções convertidas.
+    """
+    from torch.ao.quantization import QuantWrapper, convert, get_default_qconfig, prepare
+
+    qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    targets = []
+    for attr in ("encoder", "decoder", "tencoder", "tdecoder"):
+        layers = getattr(sub_model, attr, None)
+        if layers is None:
+            continue
+        for parent in layers.modules():
+            for name, child in parent.named_children():
+                if type(child) in (nn.Conv1d, nn.Conv2d):
+                    targets.append((attr, parent, name, child))
+
+    prepared = []
+    for attr, parent, name, conv in targets:
+        wrapper = QuantWrapper(conv)
+        wrapper.qconfig = qconfig
+        try:
+            prepare(wrapper, inplace=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Convolução {attr}.{name} mantida em float: {e}")
+            continue
+        setattr(parent, name, wrapper)
+        prepared.append(wrapper)
+
+    if not prepared:
+        return 0
+
+    # Calibração: um forward completo com os observers inseridos
+    with torch.no_grad():
+        sub_model(calibration_mix)
+
+    for wrapper in prepared:
+        convert(wrapper, inplace=True)
+    return len(prepared)
+
+
+def quantize_model(bag: Any, preset: str = "int8",
+                   calibration_mix: Optional[torch.Tensor] = None) -> Any:
+    """
+    Retorna uma cópia quantizada de um modelo Demucs (bag ou modelo único) para CPU.
+
+    Args:
+        bag: Modelo retornado por demucs.pretrained.get_model
+        preset: "int8" ou "int8_static"
+        calibration_mix: Trecho [1, C, segment] usado para calibrar as convoluções (int8_static)
+
+    Returns:
+        Modelo quantizado (mesma interface, usável com apply_model)
+    """
+    if preset not in INFERENCE_PRESETS:
+        raise ValueError(f"Preset inválido: '{preset}'. Use: {', '.join(INFERENCE_PRESETS)}")
+    if preset == "fp32":
+        return bag
+
+    engine = _select_engine()
+    if engine is None:
+        logger.warning("⚠️ Nenhum engine de quantização disponível, mantendo fp32")
+        return bag
+
+    before = weight_bytes(bag)
+    quantized = copy.deepcopy(bag).cpu().eval()
+    sub_models = getattr(quantized, "models", None)
+    targets = list(sub_models) if sub_models is not None else [quantized]
+
+    for index, sub_model in enumerate(targets):
+        # Lineares do transformer (feed-forward), projeções e, após separar
+        # q/k/v/out do MultiheadAttention, as projeções da atenção
+        attention = _split_attention(sub_model)
+        q = torch.ao.quantization.quantize_dynamic(sub_model, {nn.Linear}, dtype=torch.qint8)
+        remaining = float_linear_layers(q)
+        logger.info(
+            f"🔢 Sub-modelo {index}: {attention} atenções com projeções em int8"
+            + (f"; em float: {', '.join(remaining)}" if remaining else "")
+        )
+
+        if preset == "int8_static":
+            if calibration_mix is None:
+                logger.warning("⚠️ int8_static sem áudio de calibração: apenas quantização dinâmica aplicada")
+            else:
+                segment_length = int(q.segment * q.samplerate)
+                converted = _quantize_convs_static(q, calibration_mix[..., :segment_length])
+                if converted:
+                    logger.info(f"🔢 Sub-modelo {index}: {converted} convoluções em int8 estático")
+                else:
+                    logger.warning(
+                        f"⚠️ Sub-modelo {index}: nenhuma convolução quantizada; preset rebaixado para int8 (dinâmico)"
+                    )
+
+        if sub_models is not None:
+            sub_models[index] = q
+        else:
+            quantized = q
+
+    after = weight_bytes(quantized)
+    logger.info(
+        f"🔢 Quantização '{preset}' ({engine}): pesos {before / 1024**2:.1f}MB -> {after / 1024**2:.1f}MB"
+    )
+    return quantized
+
+
+def load_calibration_mix(path: str, samplerate: int, channels: int) -> torch.Tensor:
+    """Carrega um trecho de áudio para calibração da quantização estática."""
+    import torchaudio
+
+    wav, sr = torchaudio.load(path)
+    if sr != samplerate:
+        wav = torchaudio.transforms.Resample(sr, samplerate)(wav)
+    if wav.shape[0] != channels:
+        wav = wav.mean(dim=0, keepdim=True).expand(channels, -1)
+    return wav.unsqueeze(0).contiguous()
+
+
+def _snr_db(ref: torch.Tensor, est: torch.Tensor) -> float:
+    """SNR em dB da estimativa em relação à referência (mesma definição do evaluate_separation.py)."""
+    noise = torch.sum((ref - est) ** 2).item()
+    signal = torch.sum(ref ** 2).item()
+    if noise == 0:
+        return float("inf")
+    if signal == 0:
+        return float("-inf")
+    return 10 * math.log10(signal / noise)
+
+
+def accuracy_report(audio_path: str, model_name: str, preset: str = "int8",
+                    seconds: float = 30.0) -> Dict[str, Any]:
+    """
+    Compara a separação fp32 com a quantizada em um trecho de áudio.
+
+    Usa a saída fp32 como referência e calcula SNR, MSE e, se o museval
+    estiver instalado, SDR para cada stem. Lista também as camadas lineares
+    que ficaram em float no modelo quantizado.
+
+    Returns:
+        Dict com tempos, speedup, memória de pesos e métricas por stem
+    """
+    from demucs.apply import apply_model
+    from demucs.pretrained import get_model
+
+    bag = get_model(model_name).cpu().eval()
+    mix = load_calibration_mix(audio_path, bag.samplerate, bag.audio_channels)
+    mix = mix[..., :int(seconds * bag.samplerate)]
+    quantized = quantize_model(bag, preset, calibration_mix=mix)
+
+    timings = {}
+    outputs = {}
+    for label, model in (("fp32", bag), (preset, quantized)):
+        t0 = time.time()
+        with torch.no_grad():
+            outputs[label] = apply_model(model, mix, shifts=0, progress=False, num_workers=0)[0]
+        timings[label] = time.time() - t0
+
+    stems = {}
+    for i, name in enumerate(bag.sources):
+        ref = outputs["fp32"][i].mean(dim=0)
+        est = outputs[preset][i].mean(dim=0)
+        stems[name] = {"snr_db": round(_snr_db(ref, est), 2), "mse": float(torch.mean((ref - est) ** 2))}
+
+    try:
+        import numpy as np
+        import museval
+        refs = [outputs["fp32"][i].T.numpy() for i in range(len(bag.sources))]
+        ests = [outputs[preset][i].T.numpy() for i in range(len(bag.sources))]
+        scores = museval.evaluate(refs, ests, win=bag.samplerate, hop=bag.samplerate)
+        for i, name in enumerate(bag.sources):
+            stems[name]["sdr_db"] = round(float(np.nanmedian(scores[0][i])), 2)
+    except ImportError:
+        logger.info("museval não instalado: SDR omitido")
+
+    return {
+        "model": model_name,
+        "preset": preset,
+        "audio_seconds": round(mix.shape[-1] / bag.samplerate, 2),
+        "fp32_seconds": round(timings["fp32"], 3),
+        f"{preset}_seconds": round(timings[preset], 3),
+        "speedup": round(timings["fp32"] / timings[preset], 2),
+        "fp32_weights_mb": round(weight_bytes(bag) / 1024**2, 1),
+        f"{preset}_weights_mb": round(weight_bytes(quantized) / 1024**2, 1),
+        "fp32_layers": float_linear_layers(quantized),
+        "stems": stems,
+    }
+
+
+if __name__ == "__main__":
+    # Uso: python quantization.py <audio> [modelo] [preset] [segundos]
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) < 2:
+        print("Uso: python quantization.py <audio> [modelo] [preset] [segundos]")
+        sys.exit(1)
+
+    report = accuracy_report(
+        sys.argv[1],
+        sys.argv[2] if len(sys.argv) > 2 else "htdemucs_ft",
+        sys.argv[3] if len(sys.argv) > 3 else "int8",
+        float(sys.argv[4]) if len(sys.argv) > 4 else 30.0,
+    )
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,220 @@
+# Server-side stem remix/mixdown: block-wise mix of published stems, streamed while encoding
+import os
+import json
+import glob
+import math
+import struct
+import hashlib
+import logging
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from staging import STAGING_PREFIX, staged_file
+
+logger = logging.getLogger(__name__)
+
+# Importação condicional do encoder MP3 (dependência do Demucs)
+try:
+    import lameenc
+    MP3_AVAILABLE = True
+except ImportError:
+    MP3_AVAILABLE = False
+    logger.info("lameenc não disponível: remix somente em WAV")
+
+REMIX_FORMATS = {"wav": "audio/wav", "mp3": "audio/mpeg"}
+
+# Frames lidos de cada stem por bloco (~1,5s a 44.1kHz)
+BLOCK_FRAMES = 65536
+
+
+def parse_gains(values: Sequence[str]) -> Dict[str, float]:
+    """Converte ["vocals:-6", "drums:2.5"] em {stem: ganho em dB} ("-inf" = mudo)."""
+    gains = {}
+    for value in values:
+        name, sep, db = value.partition(":")
+        if not sep or not name:
+            raise ValueError(f"Ganho inválido: '{value}'. Use stem:dB (ex: vocals:-6)")
+        gain = float(db)
+        if math.isnan(gain) or gain == math.inf:
+            raise ValueError(f"Ganho inválido: '{value}'")
+        gains[name] = gain
+    return gains
+
+
+def job_stems(job_dir: str) -> Dict[str, str]:
+    """Stems publicados de um job (nome -> caminho)."""
+    return {os.path.splitext(os.path.basename(p))[0]: p for p in sorted(glob.glob(os.path.join(job_dir, "*.wav")))}
+
+
+def remix_key(job_dir: str, stems: Dict[str, str], gains: Dict[str, float], start: float,
+              end: Optional[float], fmt: str) -> str:
+    """Chave do cache: parâmetros normalizados + identidade (tamanho, mtime) dos stems (job_stems)."""
+    identity = {name: [os.path.getsize(p), os.path.getmtime(p)] for name, p in stems.items()}
+    params = {
+        "job": os.path.abspath(job_dir),
+        "stems": identity,
+        "gains": {name: gains.get(name, 0.0) for name in stems},
+        "start": round(start, 3),
+        "end": None if end is None else round(end, 3),
+        "format": fmt,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def _wav_header(frames: int, sample_rate: int, channels: int) -> bytes:
+    """Cabeçalho WAV PCM 16-bit para um tamanho conhecido (permite streaming)."""
+    data_size = frames * channels * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * channels * 2, channels * 2, 16,
+        b"data", data_size,
+    )
+
+
+class RemixCache:
+    """
+    Mixdowns já codificados, em disco (`<cache_dir>/<chave>.<formato>`).
+
+    Fica dentro de OUTPUT_DIR, então TTL e orçamento do storage manager
+    também valem; além disso mantém no máximo `max_files` arquivos,
+    removendo os mais antigos. Um mixdown só aparece no cache completo.
+    """
+
+    def __init__(self, cache_dir: str, max_files: int = 50):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str) -> Optional[str]:
+        path = self.path(key, fmt)
+        return path if os.path.exists(path) else None
+
+    def publish(self, tmp_path: str, key: str, fmt: str):
+        os.replace(tmp_path, self.path(key, fmt))
+        self._trim()
+
+    def _trim(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(STAGING_PREFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _mix_blocks(stems: List[Tuple[str, float]], start: float, end: Optional[float],
+                block_frames: int) -> Tuple[int, int, int, Iterator[np.ndarray]]:
+    """
+    Abre os stems e prepara a leitura em blocos do intervalo pedido.
+
+    Returns:
+        Tupla (taxa, canais, frames do intervalo, iterador de blocos int16 [L, C])
+    """
+    infos = [sf.info(path) for path, _ in stems]
+    sample_rate, channels = infos[0].samplerate, infos[0].channels
+    if any(i.samplerate != sample_rate or i.channels != channels for i in infos):
+        raise ValueError("Stems com taxa ou canais diferentes")
+    total = min(i.frames for i in infos)
+    first = min(int(start * sample_rate), total)
+    last = total if end is None else min(int(end * sample_rate), total)
+    frames = max(0, last - first)
+    # Ganhos lineares; stems mudos (ganho -inf) nem são abertos
+    active = [(path, 10 ** (db / 20)) for path, db in stems if db != -math.inf]
+
+    def blocks() -> Iterator[np.ndarray]:
+        rng = np.random.default_rng(0)
+        with ExitStack() as stack:
+            files = [(stack.enter_context(sf.SoundFile(path)), gain) for path, gain in active]
+            for f, _ in files:
+                f.seek(first)
+            remaining = frames
+            while remaining > 0:
+                n = min(block_frames, remaining)
+                mix = np.zeros((n, channels), dtype=np.float32)
+                for f, gain in files:
+                    block = f.read(n, dtype="float32", always_2d=True)
+                    mix[:len(block)] += gain * block
+                # PCM 16-bit com dither TPDF (±1 LSB)
+                mix *= 32767
+                mix += rng.random(mix.shape, dtype=np.float32) - rng.random(mix.shape, dtype=np.float32)
+                yield np.clip(np.round(mix), -32768, 32767).astype(np.int16)
+                remaining -= n
+
+    return sample_rate, channels, frames, blocks()
+
+
+def stream_remix(stems: List[Tuple[str, float]], fmt: str = "wav", start: float = 0.0,
+                 end: Optional[float] = None, cache: Optional[RemixCache] = None,
+                 cache_key: Optional[str] = None, mp3_bitrate: int = 192,
+                 block_frames: int = BLOCK_FRAMES) -> Tuple[Iterator[bytes], Optional[int]]:
+    """
+    Mixdown dos stems codificado conforme é lido, sem carregar as faixas inteiras.
+
+    Args:
+        stems: (caminho, ganho em dB) de cada stem; -inf = mudo
+        fmt: "wav" (PCM 16-bit) ou "mp3"
+        start / end: Intervalo em segundos (end None = até o fim)
+        cache / cache_key: Se informados, a saída também é gravada no cache
+            e publicada ao terminar (uma transmissão interrompida é descartada)
+
+    Returns:
+        Tupla (iterador de bytes codificados, tamanho total em bytes se conhecido)
+    """
+    if fmt not in REMIX_FORMATS:
+        raise ValueError(f"Formato inválido: {fmt}. Use {list(REMIX_FORMATS)}")
+    if fmt == "mp3" and not MP3_AVAILABLE:
+        raise ValueError("Remix em MP3 requer lameenc")
+
+    sample_rate, channels, frames, blocks = _mix_blocks(stems, start, end, block_frames)
+    length = 44 + frames * channels * 2 if fmt == "wav" else None
+
+    def encoded() -> Iterator[bytes]:
+        if fmt == "wav":
+            yield _wav_header(frames, sample_rate, channels)
+            for block in blocks:
+                yield block.tobytes()
+            return
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(mp3_bitrate)
+        encoder.set_in_sample_rate(sample_rate)
+        encoder.set_channels(channels)
+        encoder.set_quality(2)
+        for block in blocks:
+            data = encoder.encode(block.tobytes())
+            if data:
+                yield bytes(data)
+        yield bytes(encoder.flush())
+
+    if cache is None or cache_key is None:
+        return encoded(), length
+
+    def teed() -> Iterator[bytes]:
+        tmp_path = staged_file(cache.path(cache_key, fmt))
+        completed = False
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in encoded():
+                    out.write(chunk)
+                    yield chunk
+            completed = True
+            cache.publish(tmp_path, cache_key, fmt)
+        finally:
+            if not completed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return teed(), length
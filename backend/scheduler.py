@@ -0,0 +1,194 @@
+# Core-partitioning scheduler for concurrent CPU inference
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Concessão do job em execução nesta thread (lida por checkpoint())
+_current = threading.local()
+
+
+class CoreGrant:
+    """Conjunto de núcleos concedido a um job (pode mudar no rebalanceamento)."""
+
+    def __init__(self, job_id: int, cores: List[int], pin_affinity: bool = False):
+        self.job_id = job_id
+        self.cores = cores
+        self.pin_affinity = pin_affinity
+
+    @property
+    def num_threads(self) -> int:
+        return len(self.cores)
+
+
+def _apply(grant: CoreGrant):
+    cores = list(grant.cores)
+    torch.set_num_threads(len(cores))
+    if grant.pin_affinity:
+        # pid 0 = só a thread atual: o pool intra-op já existe e mantém a máscara anterior
+        os.sched_setaffinity(0, cores)
+    _current.threads = len(cores)
+
+
+def checkpoint():
+    """
+    Aplica um rebalanceamento pendente à thread atual.
+
+    Chamado entre trechos da inferência (hook de forward dos sub-modelos,
+    ver process.load_separation_model); fora de scheduler.run não faz nada.
+    """
+    grant = getattr(_current, "grant", None)
+    if grant is not None and grant.num_threads != _current.threads:
+        _apply(grant)
+
+
+class InferenceScheduler:
+    """
+    Distribui os núcleos da máquina entre jobs de inferência concorrentes.
+
+    Cada job recebe um conjunto disjunto de núcleos e usa esse número de
+    threads intra-op. A fatia segue a demanda (jobs rodando + esperando):
+    um job sozinho usa todos os núcleos; quando outro chega, os jobs em
+    execução cedem núcleos até ~núcleos/N e o novo começa sem esperar o
+    primeiro terminar. Quando um job termina, os núcleos livres voltam aos
+    que continuam rodando. Um job em execução aplica a nova fatia no próximo
+    checkpoint() (a cada trecho de inferência); até lá pode haver
+    sobreposição breve de threads.
+
+    A afinidade (pin_affinity) só alcança a thread do job, não o pool
+    intra-op já criado. Modelos ONNX Runtime usam as threads fixas da
+    sessão (ONNX_THREADS) e não são particionados.
+    """
+
+    def __init__(self, total_cores: int = 0, min_cores: int = 2, pin_affinity: bool = False):
+        """
+        Args:
+            total_cores: Núcleos gerenciados (0 = todos os disponíveis ao processo)
+            min_cores: Mínimo de núcleos por job
+            pin_affinity: Fixa a afinidade da thread do job nos núcleos concedidos (Linux)
+        """
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+            else list(range(os.cpu_count() or 1))
+        if total_cores > 0:
+            available = available[:total_cores]
+
+        self.cores = available
+        self.min_cores = max(1, min(min_cores, len(available)))
+        self.pin_affinity = pin_affinity and hasattr(os, "sched_setaffinity")
+
+        self._free: List[int] = list(available)
+        self._running: Dict[int, CoreGrant] = {}
+        self._waiting: deque = deque()
+        self._cond = threading.Condition()
+        self._next_id = 0
+
+        logger.info(
+            f"🧮 Scheduler de inferência: {len(self.cores)} núcleos, mínimo {self.min_cores} por job, "
+            f"afinidade {'ativa' if self.pin_affinity else 'desativada'}"
+        )
+
+    def _share(self) -> int:
+        """Fatia de núcleos por job conforme a demanda atual (rodando + esperando)."""
+        demand = len(self._running) + len(self._waiting)
+        return max(self.min_cores, len(self.cores) // max(1, demand))
+
+    def _reclaim(self, share: int):
+        """Tira dos jobs em execução os núcleos acima da fatia (aplicado no checkpoint deles)."""
+        for grant in self._running.values():
+            if grant.num_threads > share:
+                grant.cores, excess = grant.cores[:share], grant.cores[share:]
+                self._free = sorted(self._free + excess)
+
+    def _grow(self):
+        """Sem fila, distribui os núcleos livres entre os jobs em execução."""
+        if self._waiting or not self._running:
+            return
+        share = self._share()
+        for grant in sorted(self._running.values(), key=lambda g: g.num_threads):
+            extra = min(share - grant.num_threads, len(self._free))
+            if extra > 0:
+                grant.cores = sorted(grant.cores + self._free[:extra])
+                self._free = self._free[extra:]
+
+    def _try_grant(self, job_id: int) -> Optional[CoreGrant]:
+        # Somente o primeiro da fila pode receber núcleos (FIFO)
+        if not self._waiting or self._waiting[0] != job_id:
+            return None
+        share = self._share()
+        if len(self._free) < share:
+            self._reclaim(share)
+        if len(self._free) < self.min_cores:
+            return None
+
+        size = min(share, len(self._free))
+        cores, self._free = self._free[:size], self._free[size:]
+        self._waiting.popleft()
+        grant = CoreGrant(job_id, cores, self.pin_affinity)
+        self._running[job_id] = grant
+        return grant
+
+    @contextmanager
+    def acquire(self) -> Iterator[CoreGrant]:
+        """Aguarda núcleos livres e os reserva durante o bloco."""
+        with self._cond:
+            job_id = self._next_id
+            self._next_id += 1
+            self._waiting.append(job_id)
+            t0 = time.time()
+            grant = self._try_grant(job_id)
+            while grant is None:
+                self._cond.wait()
+                grant = self._try_grant(job_id)
+            waited = time.time() - t0
+
+        if waited > 0.01:
+            logger.info(f"🧮 Job {job_id} aguardou {waited:.2f}s por núcleos")
+        logger.info(f"🧮 Job {job_id}: {grant.num_threads} núcleos {grant.cores}")
+
+        try:
+            yield grant
+        finally:
+            with self._cond:
+                del self._running[job_id]
+                self._free = sorted(self._free + grant.cores)
+                self._grow()
+                self._cond.notify_all()
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa fn na thread atual com núcleos reservados.
+
+        Ajusta o número de threads intra-op do PyTorch (e a afinidade, se
+        configurado) para a fatia concedida, reajusta a cada checkpoint() e
+        restaura ao final.
+        """
+        with self.acquire() as grant:
+            previous_threads = torch.get_num_threads()
+            previous_affinity = os.sched_getaffinity(0) if self.pin_affinity else None
+            _current.grant = grant
+            _apply(grant)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _current.grant = None
+                torch.set_num_threads(previous_threads)
+                if previous_affinity is not None:
+                    os.sched_setaffinity(0, previous_affinity)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado atual do scheduler."""
+        with self._cond:
+            return {
+                "total_cores": len(self.cores),
+                "free_cores": len(self._free),
+                "running_jobs": len(self._running),
+                "waiting_jobs": len(self._waiting),
+                "grants": {job_id: grant.cores for job_id, grant in self._running.items()},
+            }
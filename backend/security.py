@@ -15,7 +15,7 @@ limiter = Limiter(
 )
 
 # File validation settings
-ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.flac', '.m4a'}
+ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.flac', '.m4a', '.mp4'}
 MAX_FILE_SIZE = 200 * 1024 * 1024  # 200MB
 
 def validate_audio_file(file, max_size: int = MAX_FILE_SIZE):
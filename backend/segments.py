@@ -0,0 +1,253 @@
+# Representação colunar dos resultados de diarização
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class DiarizationSegments:
+    """
+    Segmentos de diarização armazenados em colunas NumPy.
+
+    Em vez de uma lista de dicts por segmento, guarda três arrays paralelos
+    (início, fim e índice do artista) ordenados por início, mais a tabela de
+    rótulos. Consultas de sobreposição usam busca binária sobre o início e
+    sobre o máximo acumulado dos fins, então custam O(log n + k).
+    O formato JSON antigo é gerado somente quando pedido.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, speakers: np.ndarray, labels: List[str]):
+        """
+        Args:
+            starts: Início de cada segmento em segundos
+            ends: Fim de cada segmento em segundos
+            speakers: Índice (em labels) do artista de cada segmento
+            labels: Identificadores dos artistas (ex: 'artist_SPEAKER_00')
+        """
+        order = np.argsort(starts, kind='stable')
+        self.starts = np.ascontiguousarray(starts[order], dtype=np.float64)
+        self.ends = np.ascontiguousarray(ends[order], dtype=np.float64)
+        self.speakers = np.ascontiguousarray(speakers[order], dtype=np.int32)
+        self.labels = list(labels)
+        # Máximo acumulado dos fins: monotônico, permite busca binária
+        self._max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    @classmethod
+    def from_turns(cls, turns: Iterable[Tuple[float, float, Any]], prefix: str = "artist_") -> "DiarizationSegments":
+        """
+        Constrói a partir de tuplas (start, end, speaker).
+
+        Args:
+            turns: Iterável de (início, fim, rótulo do speaker)
+            prefix: Prefixo aplicado aos rótulos
+
+        Returns:
+            Instância com os segmentos em colunas
+        """
+        label_index: Dict[str, int] = {}
+        starts: List[float] = []
+        ends: List[float] = []
+        speakers: List[int] = []
+
+        for start, end, speaker in turns:
+            label = f"{prefix}{speaker}"
+            idx = label_index.setdefault(label, len(label_index))
+            starts.append(start)
+            ends.append(end)
+            speakers.append(idx)
+
+        return cls(
+            np.asarray(starts, dtype=np.float64),
+            np.asarray(ends, dtype=np.float64),
+            np.asarray(speakers, dtype=np.int32),
+            list(label_index.keys())
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def num_speakers(self) -> int:
+        return len(self.labels)
+
+    @property
+    def total_duration(self) -> float:
+        return float(self._max_ends[-1]) if len(self) else 0.0
+
+    def for_speaker(self, speaker: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (starts, ends) dos segmentos de um artista."""
+        mask = self.speakers == speaker
+        return self.starts[mask], self.ends[mask]
+
+    def overlapping(self, start: float, end: float) -> np.ndarray:
+        """
+        Índices dos segmentos que se sobrepõem ao intervalo [start, end).
+
+        Args:
+            start: Início do intervalo em segundos
+            end: Fim do intervalo em segundos
+
+        Returns:
+            Array com os índices (na ordem por início)
+        """
+        # Candidatos: começam antes do fim da consulta...
+        hi = int(np.searchsorted(self.starts, end, side='left'))
+        # ...e a partir do primeiro cujo máximo acumulado dos fins passa do início
+        lo = int(np.searchsorted(self._max_ends, start, side='right'))
+        if lo >= hi:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.arange(lo, hi)
+        return candidates[self.ends[lo:hi] > start]
+
+    def speakers_at(self, time: float) -> List[str]:
+        """Artistas ativos em um instante."""
+        idx = self.overlapping(time, np.nextafter(time, np.inf))
+        return [self.labels[i] for i in np.unique(self.speakers[idx])]
+
+    def to_dict(self) -> Dict[str, List[Dict[str, float]]]:
+        """Gera o formato legado {artist_id: [{'start', 'end', 'duration'}]}."""
+        result: Dict[str, List[Dict[str, float]]] = {label: [] for label in self.labels}
+        for start, end, speaker in zip(self.starts.tolist(), self.ends.tolist(), self.speakers.tolist()):
+            result[self.labels[speaker]].append({
+                'start': start,
+                'end': end,
+                'duration': end - start
+            })
+        return result
+
+    def nbytes(self) -> int:
+        """Memória ocupada pelas colunas."""
+        return self.starts.nbytes + self.ends.nbytes + self.speakers.nbytes + self._max_ends.nbytes
+
+
+def as_segments(diarization_result: Optional[Dict[str, Any]]) -> Optional[DiarizationSegments]:
+    """
+    Obtém os segmentos colunares de um resultado de diarização.
+
+    Aceita também resultados no formato legado ('speakers' como dict de listas).
+    """
+    if not diarization_result:
+        return None
+
+    segments = diarization_result.get('segments')
+    if isinstance(segments, DiarizationSegments):
+        return segments
+
+    speakers = diarization_result.get('speakers')
+    if speakers is None:
+        return None
+
+    return DiarizationSegments.from_turns(
+        ((seg['start'], seg['end'], speaker_id) for speaker_id, segs in speakers.items() for seg in segs),
+        prefix=""
+    )
+
+
+# =============
+# MÁSCARAS POR ARTISTA (precisão de amostra)
+# =============
+
+# Como tratar trechos em que mais de um artista canta ao mesmo tempo:
+# - "duplicate": o trecho é copiado integralmente para todas as faixas ativas
+# - "soft": o trecho é dividido entre as faixas com pesos proporcionais à
+#   energia média de cada artista nos trechos em que canta sozinho
+OVERLAP_MODES = ("duplicate", "soft")
+
+
+class SpeakerMaskEngine:
+    """
+    Gera máscaras de ganho por artista na taxa de amostragem original.
+
+    As máscaras são calculadas por blocos a partir dos segmentos colunares:
+    cada bloco consulta apenas os segmentos que o tocam e marca início/fim
+    com um vetor de diferenças + soma acumulada, sem laços por segmento.
+    Limites fora do áudio são recortados em vez de descartados.
+    """
+
+    def __init__(self, segments: DiarizationSegments, sample_rate: int, num_samples: int,
+                 overlap_mode: str = "duplicate"):
+        """
+        Args:
+            segments: Segmentos de diarização
+            sample_rate: Taxa de amostragem do áudio a ser mascarado
+            num_samples: Número total de amostras do áudio
+            overlap_mode: Um de OVERLAP_MODES
+        """
+        if overlap_mode not in OVERLAP_MODES:
+            raise ValueError(f"overlap_mode inválido: '{overlap_mode}'. Use: {', '.join(OVERLAP_MODES)}")
+
+        self.segments = segments
+        self.sample_rate = sample_rate
+        self.num_samples = num_samples
+        self.overlap_mode = overlap_mode
+        self.weights = np.ones(segments.num_speakers, dtype=np.float32)
+
+    def activity(self, b0: int, b1: int) -> np.ndarray:
+        """
+        Atividade de cada artista no bloco [b0, b1).
+
+        Returns:
+            Array bool [S, b1 - b0]
+        """
+        sr = self.sample_rate
+        length = b1 - b0
+        idx = self.segments.overlapping(b0 / sr, b1 / sr)
+
+        delta = np.zeros((self.segments.num_speakers, length + 1), dtype=np.int32)
+        if len(idx):
+            starts = np.clip(np.rint(self.segments.starts[idx] * sr).astype(np.int64), b0, b1) - b0
+            ends = np.clip(np.rint(self.segments.ends[idx] * sr).astype(np.int64), b0, b1) - b0
+            speakers = self.segments.speakers[idx]
+            np.add.at(delta, (speakers, starts), 1)
+            np.add.at(delta, (speakers, ends), -1)
+
+        return np.cumsum(delta[:, :-1], axis=1) > 0
+
+    def estimate_weights(self, audio: np.ndarray, block_size: int) -> np.ndarray:
+        """
+        Estima o peso de cada artista pela energia média nos trechos solo.
+
+        Args:
+            audio: Áudio [T, C]
+            block_size: Tamanho do bloco em amostras
+
+        Returns:
+            Pesos [S] (também guardados em self.weights)
+        """
+        num_speakers = self.segments.num_speakers
+        energy = np.zeros(num_speakers, dtype=np.float64)
+        count = np.zeros(num_speakers, dtype=np.float64)
+
+        for b0 in range(0, self.num_samples, block_size):
+            b1 = min(b0 + block_size, self.num_samples)
+            active = self.activity(b0, b1)
+            solo = active & (active.sum(axis=0) == 1)
+            power = np.square(audio[b0:b1], dtype=np.float32).mean(axis=1)
+            energy += solo @ power
+            count += solo.sum(axis=1)
+
+        weights = np.divide(energy, count, out=np.zeros_like(energy), where=count > 0)
+        # Artista sem trecho solo: usa a média dos demais
+        known = weights > 0
+        fallback = weights[known].mean() if known.any() else 1.0
+        weights[~known] = fallback
+
+        self.weights = weights.astype(np.float32)
+        return self.weights
+
+    def gains(self, b0: int, b1: int) -> np.ndarray:
+        """
+        Ganhos de cada artista no bloco [b0, b1).
+
+        Returns:
+            Array float32 [S, b1 - b0]
+        """
+        active = self.activity(b0, b1)
+        if self.overlap_mode == "duplicate":
+            return active.astype(np.float32)
+
+        weighted = active * self.weights[:, None]
+        total = weighted.sum(axis=0, keepdims=True)
+        return np.divide(weighted, total, out=np.zeros_like(weighted), where=total > 0)
@@ -0,0 +1,94 @@
+# Single-flight coalescing: identical concurrent separations share one in-flight job
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def flight_key(content_hash: str, model_name: str, mode: str,
+               requested_stems: Optional[Sequence[str]] = None) -> Tuple[str, str, str, Tuple[str, ...]]:
+    """Chave de uma separação: conteúdo do áudio, modelo e conjunto de stems pedido."""
+    stems = tuple(sorted(set(requested_stems))) if mode == "custom" and requested_stems else ()
+    return content_hash, model_name, mode, stems
+
+
+def _forward(source: Future, target: Future):
+    """Repassa o desfecho do Future do job ao Future do voo."""
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class _Flight:
+    def __init__(self, future: Future, context: Any):
+        self.future = future
+        self.context = context
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Coalescência de jobs idênticos em andamento.
+
+    O primeiro pedido de uma chave (líder) cria o job; os pedidos que chegam
+    enquanto ele não termina (seguidores) recebem o mesmo Future e o mesmo
+    resultado, sem nova inferência. A chave sai do mapa quando o Future
+    termina: um pedido depois disso é um novo líder. `context` guarda dados
+    do líder que os seguidores precisam (ex: caminhos a fixar no storage).
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable, start: Callable[[], Future], context: Any = None) -> Tuple[Future, bool, Any]:
+        """
+        Junta-se ao job em andamento da chave ou inicia um com `start()`.
+
+        O voo é registrado sob o lock com um Future próprio e `start()` roda
+        fora dele (pode fazer I/O, ex: gravar o spool no modo coordenador);
+        o resultado do job é repassado a esse Future. Se `start()` falhar, a
+        exceção chega ao líder e aos seguidores.
+
+        Returns:
+            Tupla (Future do job, True se este pedido é o líder, context do líder)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.future.done():
+                flight.followers += 1
+                self.coalesced += 1
+                return flight.future, False, flight.context
+            future: Future = Future()
+            self._flights[key] = _Flight(future, context)
+            self.leaders += 1
+        future.add_done_callback(lambda f: self._finish(key, f))
+
+        try:
+            job = start()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        job.add_done_callback(lambda f: _forward(f, future))
+        return future, True, context
+
+    def _finish(self, key: Hashable, future: Future):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or flight.future is not future:
+                return
+            del self._flights[key]
+        if flight.followers:
+            logger.info(f"🪢 Job coalescido concluído: {flight.followers} pedido(s) idêntico(s) reaproveitaram o resultado")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {"in_flight": in_flight, "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,65 @@
+# Per-job staging directories with atomic publish
+import os
+import uuid
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Prefixo dos diretórios de staging (ignorados pelo storage manager enquanto recentes)
+STAGING_PREFIX = ".staging-"
+
+
+def new_job_id() -> str:
+    """Identificador curto e único de um job."""
+    return uuid.uuid4().hex[:12]
+
+
+def job_dir_name(base: str, job_id: Optional[str] = None) -> str:
+    """Nome do diretório de saída de um job (`<base>-<job_id>`)."""
+    return f"{base}-{job_id}" if job_id else base
+
+
+def make_staging_dir(final_dir: str) -> str:
+    """Cria um diretório de staging irmão de `final_dir` (mesmo sistema de arquivos)."""
+    parent = os.path.dirname(final_dir)
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{os.path.basename(final_dir)}-", dir=parent)
+
+
+def publish_dir(staging: str, final_dir: str):
+    """Publica o staging em `final_dir` com um único rename atômico."""
+    os.chmod(staging, 0o755)
+    # Falha com OSError se final_dir já existir com conteúdo: nunca sobrescreve uma publicação
+    os.rename(staging, final_dir)
+    logger.info(f"📦 Publicado: {final_dir}")
+
+
+@contextmanager
+def staged_output(final_dir: str) -> Iterator[str]:
+    """
+    Diretório de staging publicado em `final_dir` com um rename atômico.
+
+    O staging fica no mesmo diretório pai (mesmo sistema de arquivos), então
+    o rename publica todos os arquivos de uma vez: quem lê `final_dir` vê o
+    conjunto completo ou nada. Se o bloco falhar, o staging é descartado.
+
+    Yields:
+        Caminho do diretório de staging onde os arquivos devem ser escritos
+    """
+    staging = make_staging_dir(final_dir)
+    try:
+        yield staging
+        publish_dir(staging, final_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def staged_file(path: str) -> str:
+    """Caminho temporário, no mesmo diretório, para escrever `path` e publicar com os.replace."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f"{STAGING_PREFIX}{name}-{uuid.uuid4().hex[:8]}")
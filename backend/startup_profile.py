@@ -0,0 +1,196 @@
+# Import-time and cold-start profiling: per-module import cost and time-to-ready
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import importlib
+import importlib.abc
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Módulos deste diretório (primeira parte) aparecem com o custo cumulativo
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _process_start_time() -> float:
+    """Instante de criação do processo (psutil), ou o import deste módulo."""
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except Exception:
+        return time.time()
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Loader que mede exec_module e devolve o loader original ao módulo."""
+
+    def __init__(self, loader: Any, profiler: "ImportProfiler"):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # O código do módulo (e quem o inspecionar depois) vê o loader original
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.profiler._enter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler._exit(module.__name__, getattr(module, "__file__", None))
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    Mede o custo de import de cada módulo (como `python -X importtime`, dentro do processo).
+
+    Fica na frente de sys.meta_path, delega a busca aos outros finders e
+    envolve o loader encontrado. Cada módulo tem tempo cumulativo (com os
+    imports aninhados) e próprio (sem eles); a pilha é por thread, então
+    imports concorrentes não se misturam.
+    """
+
+    def __init__(self):
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self)
+            return spec
+        return None
+
+    def _stack(self) -> List[List[float]]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self):
+        self._stack().append([time.perf_counter(), 0.0])
+
+    def _exit(self, name: str, file: Optional[str]):
+        stack = self._stack()
+        start, children = stack.pop()
+        total = time.perf_counter() - start
+        if stack:
+            stack[-1][1] += total
+        with self._lock:
+            self.records[name] = {"cumulative": total, "self": total - children, "file": file}
+
+    def by_package(self, top: int = 15) -> List[Dict[str, Any]]:
+        """Pacotes de topo ordenados pela soma dos tempos próprios dos seus módulos."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, record in self.records.items():
+                package = name.split(".")[0]
+                totals[package] = totals.get(package, 0.0) + record["self"]
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+        return [{"package": p, "seconds": round(s, 3)} for p, s in ranked]
+
+    def first_party(self) -> List[Dict[str, Any]]:
+        """Módulos do backend com o custo cumulativo (inclui as dependências que puxam)."""
+        with self._lock:
+            modules = [(name, r["cumulative"]) for name, r in self.records.items()
+                       if r["file"] and os.path.dirname(os.path.abspath(r["file"])) == _BACKEND_DIR]
+        modules.sort(key=lambda item: item[1], reverse=True)
+        return [{"module": m, "cumulative_seconds": round(s, 3)} for m, s in modules]
+
+
+class StartupProfile:
+    """Fases do cold start (segundos desde a criação do processo) e o custo dos imports."""
+
+    def __init__(self):
+        self.process_start = _process_start_time()
+        self.profiler = ImportProfiler()
+        self.phases: Dict[str, float] = {}
+
+    def install(self):
+        self.profiler.install()
+
+    def mark(self, phase: str):
+        """Registra o fim de uma fase (ex: imports, models, ready)."""
+        self.phases[phase] = round(time.time() - self.process_start, 3)
+        if phase == "ready":
+            # Imports tardios (lazy) não fazem parte do cold start
+            self.profiler.uninstall()
+
+    def report(self, top: int = 15, budget_seconds: float = 0.0) -> Dict[str, Any]:
+        report = {
+            "phases": dict(self.phases),
+            "top_packages": self.profiler.by_package(top),
+            "first_party": self.profiler.first_party()[:top],
+        }
+        if budget_seconds > 0 and "ready" in self.phases:
+            report["budget_seconds"] = budget_seconds
+            report["within_budget"] = self.phases["ready"] <= budget_seconds
+        return report
+
+    def log_report(self, top: int = 10, budget_seconds: float = 0.0):
+        report = self.report(top, budget_seconds)
+        phases = " | ".join(f"{name} {seconds:.2f}s" for name, seconds in report["phases"].items())
+        packages = ", ".join(f"{p['package']} {p['seconds']:.2f}s" for p in report["top_packages"])
+        logger.info(f"⏱️ COLD START: {phases}")
+        logger.info(f"⏱️ Imports mais caros: {packages}")
+        if report.get("within_budget") is False:
+            logger.warning(
+                f"⚠️ Cold start de {report['phases']['ready']:.2f}s acima do orçamento de {budget_seconds:.2f}s"
+            )
+
+
+# Instância do processo: main.py instala antes dos demais imports
+startup_profile = StartupProfile()
+
+
+if __name__ == "__main__":
+    # Uso: python startup_profile.py [módulo] [--budget segundos]
+    # Mede só o import (sem carregar modelos); falha se passar do orçamento (CI)
+    parser = argparse.ArgumentParser(description="Custo de import de um módulo do backend.")
+    parser.add_argument("module", nargs="?", default="main", help="Módulo importado (padrão: main)")
+    parser.add_argument("--budget", type=float, default=0.0, help="Orçamento do import em segundos (0 = sem)")
+    parser.add_argument("--top", type=int, default=15, help="Pacotes e módulos listados")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # Mesma instância que main.py instala (este arquivo roda como __main__)
+    from startup_profile import startup_profile as profile
+    profile.install()
+    t0 = time.perf_counter()
+    importlib.import_module(args.module)
+    elapsed = time.perf_counter() - t0
+    profile.profiler.uninstall()
+
+    print(f"Import de {args.module}: {elapsed:.3f}s")
+    print("\nPacotes (tempo próprio):")
+    for item in profile.profiler.by_package(args.top):
+        print(f"  {item['package']:<24} {item['seconds']:8.3f}s")
+    print("\nMódulos do backend (cumulativo):")
+    for item in profile.profiler.first_party()[:args.top]:
+        print(f"  {item['module']:<24} {item['cumulative_seconds']:8.3f}s")
+
+    if args.budget > 0 and elapsed > args.budget:
+        print(f"\n❌ Acima do orçamento de {args.budget:.3f}s")
+        sys.exit(1)
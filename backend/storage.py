@@ -0,0 +1,295 @@
+# Storage lifecycle manager for uploads and generated stems
+import os
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
+
+from staging import STAGING_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Staging mais antigo que isso é resto de um job interrompido e entra no despejo normal
+STALE_STAGING_SECONDS = 3600
+
+
+class _Unit:
+    """Artefato indexado (arquivo de upload ou diretório de um job)."""
+
+    __slots__ = ("path", "size", "last_used", "dir_mtime")
+
+    def __init__(self, path: str, size: int, last_used: float, dir_mtime: float):
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        self.dir_mtime = dir_mtime
+
+
+def _tree_size(path: str) -> Tuple[int, float]:
+    """Tamanho total e mtime mais recente de uma árvore, via os.scandir."""
+    total = 0
+    latest = 0.0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            total += st.st_size
+                            latest = max(latest, st.st_mtime)
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            continue
+    return total, latest
+
+
+class StorageManager:
+    """
+    Indexa os artefatos de cada job e aplica orçamento de bytes + TTL com despejo LRU.
+
+    Cada raiz é indexada até uma profundidade fixa: em UPLOAD_DIR cada arquivo
+    é uma unidade; em OUTPUT_DIR cada diretório de job. As varreduras usam
+    os.scandir e são incrementais: diretórios cujo mtime não mudou reaproveitam
+    o tamanho já calculado. Unidades fixadas (em processamento ou sendo
+    servidas) e diretórios de staging recentes nunca são removidos.
+    """
+
+    def __init__(self, roots: List[Tuple[str, int]], budget_bytes: int, ttl_seconds: float,
+                 scan_interval: float = 300.0):
+        """
+        Args:
+            roots: Lista de (diretório raiz, profundidade das unidades)
+            budget_bytes: Orçamento total em bytes (0 = sem limite)
+            ttl_seconds: Tempo máximo sem uso antes da remoção (0 = sem TTL)
+            scan_interval: Intervalo entre varreduras em segundos
+        """
+        self.roots = [(os.path.abspath(root), depth) for root, depth in roots]
+        self.budget_bytes = budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.scan_interval = scan_interval
+
+        self._units: Dict[str, _Unit] = {}
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_scan: Optional[float] = None
+        self._evicted_bytes = 0
+
+    # ---------- Mapeamento caminho -> unidade ----------
+
+    def unit_for(self, path: str) -> Optional[str]:
+        """Unidade (arquivo ou diretório de job) que contém o caminho."""
+        path = os.path.abspath(path)
+        for root, depth in self.roots:
+            if path == root or not path.startswith(root + os.sep):
+                continue
+            parts = os.path.relpath(path, root).split(os.sep)
+            return os.path.join(root, *parts[:depth])
+        return None
+
+    def hold(self, *paths: str):
+        """Fixa as unidades desses caminhos (podem ainda não existir)."""
+        units = [u for u in (self.unit_for(p) for p in paths) if u]
+        with self._lock:
+            for unit in units:
+                self._pins[unit] = self._pins.get(unit, 0) + 1
+
+    def release(self, *paths: str):
+        """Libera unidades fixadas com hold() e marca o uso para o LRU."""
+        units = [u for u in (self.unit_for(p) for p in paths) if u]
+        now = time.time()
+        with self._lock:
+            for unit in units:
+                if unit not in self._pins:
+                    continue
+                self._pins[unit] -= 1
+                if not self._pins[unit]:
+                    del self._pins[unit]
+                if unit in self._units:
+                    self._units[unit].last_used = now
+
+    @contextmanager
+    def pin(self, *paths: str) -> Iterator[None]:
+        """Impede a remoção das unidades desses caminhos durante o bloco."""
+        self.hold(*paths)
+        try:
+            yield
+        finally:
+            self.release(*paths)
+
+    def touch(self, path: str):
+        """Registra uso de um artefato (para o LRU)."""
+        unit = self.unit_for(path)
+        if unit:
+            with self._lock:
+                if unit in self._units:
+                    self._units[unit].last_used = time.time()
+
+    # ---------- Varredura e despejo ----------
+
+    def _scan_level(self, path: str, depth: int, seen: Dict[str, _Unit]):
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        for entry in entries:
+            try:
+                if entry.name.startswith(STAGING_PREFIX) and \
+                        now - entry.stat(follow_symlinks=False).st_mtime < STALE_STAGING_SECONDS:
+                    continue  # job em andamento: ainda não publicado
+                if depth > 1 and entry.is_dir(follow_symlinks=False):
+                    self._scan_level(entry.path, depth - 1, seen)
+                    continue
+
+                st = entry.stat(follow_symlinks=False)
+                previous = self._units.get(entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    if previous is not None and previous.dir_mtime == st.st_mtime:
+                        seen[entry.path] = previous  # sem mudanças: reaproveita
+                        continue
+                    size, latest = _tree_size(entry.path)
+                    last_used = max(latest, st.st_mtime, previous.last_used if previous else 0.0)
+                    seen[entry.path] = _Unit(entry.path, size, last_used, st.st_mtime)
+                else:
+                    last_used = max(st.st_mtime, previous.last_used if previous else 0.0)
+                    seen[entry.path] = _Unit(entry.path, st.st_size, last_used, st.st_mtime)
+            except FileNotFoundError:
+                continue
+
+    def scan(self):
+        """Atualiza o índice (incremental)."""
+        seen: Dict[str, _Unit] = {}
+        for root, depth in self.roots:
+            self._scan_level(root, depth, seen)
+        with self._lock:
+            # Preserva acessos registrados durante a varredura
+            for path, unit in seen.items():
+                current = self._units.get(path)
+                if current is not None:
+                    unit.last_used = max(unit.last_used, current.last_used)
+            self._units = seen
+            self._last_scan = time.time()
+
+    def _remove(self, unit: _Unit):
+        try:
+            if os.path.isdir(unit.path):
+                shutil.rmtree(unit.path)
+            else:
+                os.remove(unit.path)
+            self._evicted_bytes += unit.size
+            logger.info(f"🗑️ Removido {unit.path} ({unit.size / 1024**2:.1f}MB)")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Erro ao remover {unit.path}: {e}")
+
+    def enforce(self) -> int:
+        """
+        Aplica TTL e orçamento. Retorna o número de unidades removidas.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = sorted(
+                (u for u in self._units.values() if u.path not in self._pins),
+                key=lambda u: u.last_used
+            )
+            total = sum(u.size for u in self._units.values())
+
+            victims = []
+            for unit in candidates:
+                expired = self.ttl_seconds and now - unit.last_used > self.ttl_seconds
+                over_budget = self.budget_bytes and total > self.budget_bytes
+                if not (expired or over_budget):
+                    continue
+                victims.append(unit)
+                total -= unit.size
+
+        removed = 0
+        for unit in victims:
+            # Remoção sob o lock: um hold()/pin() feito depois da seleção ainda impede o despejo
+            with self._lock:
+                if unit.path in self._pins or self._units.get(unit.path) is not unit:
+                    continue
+                del self._units[unit.path]
+                self._remove(unit)
+            removed += 1
+        return removed
+
+    def run_once(self) -> int:
+        self.scan()
+        return self.enforce()
+
+    # ---------- Thread de fundo ----------
+
+    def start(self):
+        """Inicia a varredura periódica em uma thread daemon."""
+        if self._thread is not None:
+            return
+
+        def worker():
+            while not self._stop.is_set():
+                try:
+                    removed = self.run_once()
+                    if removed:
+                        logger.info(f"🧹 Storage: {removed} artefatos removidos")
+                except Exception as e:
+                    logger.error(f"Erro na manutenção de storage: {e}", exc_info=True)
+                self._stop.wait(self.scan_interval)
+
+        self._thread = threading.Thread(target=worker, name="storage-manager", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"🧹 Storage manager iniciado: orçamento {self.budget_bytes / 1024**3:.1f}GB, "
+            f"TTL {self.ttl_seconds / 3600:.1f}h, varredura a cada {self.scan_interval:.0f}s"
+        )
+
+    def stop(self):
+        self._stop.set()
+
+    def usage(self) -> Dict[str, Any]:
+        """Uso atual para o /status."""
+        with self._lock:
+            by_root = {}
+            for root, _ in self.roots:
+                units = [u for u in self._units.values() if u.path.startswith(root + os.sep)]
+                by_root[root] = {"units": len(units), "bytes": sum(u.size for u in units)}
+            return {
+                "total_bytes": sum(u.size for u in self._units.values()),
+                "budget_bytes": self.budget_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "units": len(self._units),
+                "pinned": len(self._pins),
+                "evicted_bytes": self._evicted_bytes,
+                "last_scan": self._last_scan,
+                "roots": by_root,
+            }
+
+
+class TrackedStaticFiles(StaticFiles):
+    """StaticFiles que fixa o artefato enquanto ele está sendo servido."""
+
+    def __init__(self, *args, storage: StorageManager, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage = storage
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await super().__call__(scope, receive, send)
+        # Mesmo caminho que o StaticFiles resolve (sem o prefixo do mount)
+        path = os.path.join(self.directory, self.get_path(scope))
+        with self.storage.pin(path):
+            await super().__call__(scope, receive, send)
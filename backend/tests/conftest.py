@@ -0,0 +1,5 @@
+# Os módulos do backend são importados como top-level (ex: `from config import config`)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+# Testes do token bucket em memória do CostLimiter
+import pytest
+
+import cost_limiter
+from cost_limiter import CostLimiter, MemoryBucketStore
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cost_limiter.time, "time", fake)
+    return fake
+
+
+def make_limiter(**kwargs) -> CostLimiter:
+    params = dict(client_capacity=100, client_refill=10, global_capacity=300, global_refill=30)
+    params.update(kwargs)
+    return CostLimiter(MemoryBucketStore(), **params)
+
+
+def levels(limiter: CostLimiter, client_id: str = "a"):
+    """Saldos (cliente, global) sem debitar: custo 0 só atualiza a reposição."""
+    store = limiter.store
+    return tuple(store._buckets[key][0] for key in (f"client:{client_id}", "global"))
+
+
+def test_refill_restores_tokens_over_time(clock):
+    limiter = make_limiter()
+    assert limiter.charge("a", 100) == (True, 0.0)
+
+    allowed, wait = limiter.charge("a", 50)
+    assert not allowed
+    assert wait == pytest.approx(5.0)
+
+    clock.now += 5.0
+    assert limiter.charge("a", 50) == (True, 0.0)
+
+
+def test_refill_never_exceeds_capacity(clock):
+    limiter = make_limiter()
+    limiter.charge("a", 10)
+    clock.now += 3600
+    limiter.charge("a", 0)
+    assert levels(limiter)[0] == pytest.approx(100)
+
+
+def test_client_and_global_buckets_are_debited_together(clock):
+    limiter = make_limiter()
+    assert limiter.charge("a", 40)[0]
+    assert levels(limiter) == (pytest.approx(60), pytest.approx(260))
+
+    assert limiter.charge("b", 70)[0]
+    assert levels(limiter, "b") == (pytest.approx(30), pytest.approx(190))
+
+
+def test_global_bucket_limits_distinct_clients(clock):
+    limiter = make_limiter(global_capacity=150, global_refill=15)
+    assert limiter.charge("a", 100)[0]
+
+    allowed, wait = limiter.charge("b", 100)
+    assert not allowed
+    assert wait == pytest.approx(50 / 15)
+
+
+def test_rejection_does_not_partially_debit(clock):
+    limiter = make_limiter(global_capacity=150, global_refill=15)
+    assert limiter.charge("a", 100)[0]
+    before = limiter.store._buckets.copy()
+
+    # O cliente "b" tem saldo, mas o global não: nenhum dos dois é debitado
+    assert not limiter.charge("b", 100)[0]
+    assert limiter.store._buckets == before
+    assert "client:b" not in limiter.store._buckets
+
+
+def test_cost_above_capacity_is_capped(clock):
+    limiter = make_limiter()
+    assert limiter.charge("a", 10_000)[0]
+    assert levels(limiter)[0] == pytest.approx(0)
+
+
+def test_cost_scales_with_member_fraction():
+    limiter = make_limiter(model_costs={"htdemucs_ft": 4.0}, diarization_cost=0.5)
+    assert limiter.cost(60, "htdemucs_ft") == pytest.approx(240)
+    assert limiter.cost(60, "htdemucs_ft", member_fraction=0.25) == pytest.approx(60)
+    assert limiter.cost(60, "htdemucs_ft", diarization=True, member_fraction=0.25) == pytest.approx(90)
@@ -0,0 +1,223 @@
+# Inference worker for coordinator mode: pulls jobs from the shared spool queue
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from cluster import SpoolQueue, choose_job, default_node
+from config import config
+from inference import resolve_cpu_bf16
+from process import decode_stage, load_separation_model, separate_audio
+from staging import new_job_id
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterWorker:
+    """
+    Worker de inferência: reivindica jobs da fila, separa e publica o resultado.
+
+    Os modelos carregados ficam quentes e são anunciados no heartbeat; a
+    escolha de jobs prefere os que usam esses modelos e cujo upload foi
+    gravado neste nó (ver cluster.choose_job). Um modelo frio é carregado
+    na primeira vez que o worker aceita um job que o usa.
+    """
+
+    def __init__(self, queue_dir: str, worker_id: Optional[str] = None, node: Optional[str] = None,
+                 preload: Optional[List[str]] = None, poll_interval: float = 0.5,
+                 heartbeat_interval: float = 5.0, affinity_wait: float = 5.0, worker_timeout: float = 30.0):
+        """
+        Args:
+            queue_dir: Diretório da fila compartilhada (CLUSTER_QUEUE_DIR)
+            worker_id: Identificador único do worker
+            node: Nó deste worker (mesmo valor de CLUSTER_NODE no coordenador da máquina)
+            preload: Modelos carregados no início de run(), já com heartbeat ativo
+            affinity_wait: Segundos que um job espera por um worker com afinidade maior
+            worker_timeout: Idade máxima do heartbeat de um worker considerado ativo
+        """
+        self.queue = SpoolQueue(queue_dir)
+        self.worker_id = worker_id or f"{default_node()}-{os.getpid()}-{new_job_id()[:4]}"
+        self.node = node or default_node()
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.affinity_wait = affinity_wait
+        self.worker_timeout = worker_timeout
+
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.cpu_bf16 = self.device.type == "cpu" and config.INFERENCE_PRESET == "fp32" \
+            and resolve_cpu_bf16(config.CPU_BF16)
+        self.models_store: Dict[str, Any] = {}
+        self.preload = list(preload or [])
+        self.busy = False
+        self.starting = False
+        self.completed = 0
+        self._stop = threading.Event()
+
+    def _ensure_model(self, name: str):
+        if name not in self.models_store:
+            self.models_store[name] = load_separation_model(
+                name, self.device,
+                inference_preset=config.INFERENCE_PRESET,
+                inference_backend=config.INFERENCE_BACKEND,
+                calibration_file=config.QUANTIZATION_CALIBRATION_FILE,
+                onnx_cache_dir=config.ONNX_CACHE_DIR,
+                onnx_threads=config.ONNX_THREADS
+            )
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "node": self.node,
+            "models": sorted(self.models_store),
+            "busy": self.busy,
+            "starting": self.starting,
+            "completed": self.completed,
+            "pid": os.getpid(),
+        }
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.queue.heartbeat(self.worker_id, self.state())
+            except OSError as e:
+                logger.warning(f"⚠️ Heartbeat falhou: {e}")
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        # Só jobs cujo upload é legível aqui (mesmo nó ou volume compartilhado)
+        jobs = [job for job in self.queue.pending()
+                if os.path.exists(os.path.join(config.UPLOAD_DIR, job["input"]))]
+        if not jobs:
+            return None
+        workers = self.queue.workers(self.worker_timeout)
+        for job in choose_job(jobs, self.state(), workers, self.affinity_wait):
+            if self.queue.claim(job, self.worker_id):
+                return job
+        return None
+
+    def _run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.time()
+        cold = job["model"] not in self.models_store
+        try:
+            self._ensure_model(job["model"])
+            input_path = os.path.join(config.UPLOAD_DIR, job["input"])
+            model = self.models_store[job["model"]]
+            decoded = decode_stage(input_path, model, job.get("info"))
+            paths = separate_audio(
+                input_path, job["mode"], config.OUTPUT_DIR,
+                self.device, self.models_store,
+                requested_stems=job.get("requested_stems"),
+                cpu_bf16=self.cpu_bf16,
+                residual_other=config.RESIDUAL_OTHER,
+                job_id=job.get("job_id"),
+                stem_format=config.STEM_FORMAT,
+                stem_dither=config.STEM_DITHER,
+                decoded=decoded
+            )
+            error = None if paths else "separate_audio não gerou stems"
+        except Exception as e:
+            logger.error(f"❌ Job {job['queue_id']} falhou: {e}", exc_info=True)
+            paths, error = [], str(e)
+        return {
+            "worker_id": self.worker_id,
+            "stems": [os.path.relpath(p, config.OUTPUT_DIR) for p in paths],
+            "error": error,
+            "seconds": round(time.time() - t0, 2),
+            "cold_model": cold,
+            "local_upload": job.get("node") == self.node,
+        }
+
+    def run(self):
+        """Loop principal até stop() (ou Ctrl+C)."""
+        # Heartbeat antes de carregar os modelos: o coordenador não expira jobs
+        # por falta de workers durante um cold start; "busy" evita que outros
+        # workers guardem jobs para este enquanto ele não reivindica nada
+        self.busy = self.starting = bool(self.preload)
+        self.queue.heartbeat(self.worker_id, self.state())
+        threading.Thread(target=self._heartbeat_loop, name="worker-heartbeat", daemon=True).start()
+        try:
+            for name in self.preload:
+                self._ensure_model(name)
+            self.busy = self.starting = False
+            self.queue.heartbeat(self.worker_id, self.state())
+            logger.info(f"👷 Worker {self.worker_id} ativo (nó {self.node}, modelos {sorted(self.models_store)})")
+
+            while not self._stop.is_set():
+                job = self._claim()
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                self.busy = True
+                self.queue.heartbeat(self.worker_id, self.state())
+                logger.info(f"🎯 Job {job['queue_id']}: {job['input']} ({job['mode']}, {job['model']})")
+                result = self._run_job(job)
+                self.queue.complete(job, self.worker_id, result)
+                self.completed += 1
+                self.busy = False
+                logger.info(
+                    f"✅ Job {job['queue_id']} em {result['seconds']:.2f}s "
+                    f"(modelo {'frio' if result['cold_model'] else 'quente'}, "
+                    f"upload {'local' if result['local_upload'] else 'remoto'})"
+                )
+        finally:
+            self._stop.set()  # encerra o heartbeat antes de sair da lista de workers
+            self.queue.unregister(self.worker_id)
+
+    def stop(self):
+        self._stop.set()
+
+
+def _worker_main(args: argparse.Namespace, index: int, threads: int):
+    logging.basicConfig(level=config.LOG_LEVEL, format=f"%(asctime)s [worker {index}] %(levelname)s - %(message)s")
+    if threads > 0:
+        torch.set_num_threads(threads)
+    worker_id = f"{args.worker_id}-{index}" if args.worker_id else None
+    worker = ClusterWorker(
+        args.queue_dir, worker_id=worker_id, node=args.node, preload=args.models,
+        affinity_wait=config.CLUSTER_AFFINITY_WAIT, worker_timeout=config.CLUSTER_WORKER_TIMEOUT
+    )
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Worker de inferência do modo coordenador (CLUSTER_MODE=coordinator).")
+    parser.add_argument("--queue-dir", default=config.CLUSTER_QUEUE_DIR, help="Fila compartilhada (padrão: CLUSTER_QUEUE_DIR)")
+    parser.add_argument("--models", nargs="*", default=[], help="Modelos pré-carregados (ex: htdemucs_ft htdemucs_6s)")
+    parser.add_argument("--processes", type=int, default=1, help="Processos worker nesta máquina")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Threads de inferência por processo (padrão: núcleos / processos)")
+    parser.add_argument("--worker-id", help="Prefixo do identificador dos workers")
+    parser.add_argument("--node", default=config.CLUSTER_NODE, help="Nó desta máquina (padrão: CLUSTER_NODE)")
+    return parser
+
+
+if __name__ == "__main__":
+    # Uso: python worker.py --processes 2 --models htdemucs_ft
+    # (com a API em CLUSTER_MODE=coordinator apontando para a mesma fila)
+    args = build_parser().parse_args()
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(1, args.processes))
+
+    if args.processes <= 1:
+        _worker_main(args, 0, threads)
+        sys.exit(0)
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_worker_main, args=(args, i, threads), name=f"worker-{i}")
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()